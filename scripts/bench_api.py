@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+HTTP load benchmark of a served .scoda package, view by view.
+
+Serves a .scoda from dist/ in-process through scoda_engine.app (the same
+wiring as the combined-deployment tests: the package DB extracted, paleocore
+attached as pc, a scratch overlay DB), reads its ui_manifest and turns every
+view into the requests the viewer makes for it:
+
+  source_query / item_query      GET /api/queries/{query}/execute?{params}
+  (also inside tabs, panels and global_controls)
+  detail views (type "detail")   GET /api/composite/{view}?id={id}
+                                 (genus_detail, taxon_detail_view, ...)
+  the package itself             GET /api/manifest
+
+Parameters and ids are drawn up front from the package's own data with
+bench_queries.ParamSampler, so sampling is outside the timed loop and the
+same --seed replays the same URLs.
+
+Each view is then hammered alone with --requests requests at every
+--concurrency level, followed by one mixed run over all views ("(all
+views)", the package row), by two clients:
+
+  thread   ThreadPoolExecutor workers sharing one starlette TestClient
+  async    asyncio tasks sharing one httpx.AsyncClient over ASGITransport
+
+With --url the requests go to an already running server instead (e.g.
+`scoda-server` or uvicorn in the release container); the .scoda argument
+then only supplies the manifest and the sampled ids, and must be the
+package that server is serving.
+
+Per view and client/concurrency it reports requests, errors (status >= 400
+or transport failures), throughput (req/s) and p50/p95/p99 latency.
+
+Usage:
+  python scripts/bench_api.py                          # latest .scoda of every package
+  python scripts/bench_api.py brachiopoda --concurrency 1,8,32 --requests 500
+  python scripts/bench_api.py dist/trilobita-0.3.4.scoda --client async
+  python scripts/bench_api.py brachiopoda --url http://127.0.0.1:8080 --json .cache/bench_api.json
+"""
+
+import argparse
+import asyncio
+import json
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import quote, urlencode
+
+from bench_queries import ParamSampler, percentile
+from db_path import find_paleocore_db, open_package, package_dbs
+
+ROOT = Path(__file__).resolve().parent.parent
+DIST_DIR = ROOT / "dist"
+
+CLIENTS = ("thread", "async")
+
+# Manifest keys naming a ui_query the viewer executes
+_QUERY_KEYS = ("source_query", "source_query_override", "item_query")
+
+# Row label of the mixed run
+ALL_VIEWS = "(all views)"
+
+
+def package_scodas(dist_dir=DIST_DIR):
+    """{package: latest {name}-{version}.scoda path} in dist_dir."""
+    return {pkg: versions[-1] for pkg, versions in package_dbs(dist_dir, ".scoda").items()}
+
+
+# ---------------------------------------------------------------------------
+# Request plan
+# ---------------------------------------------------------------------------
+
+def _manifest_queries(node):
+    """Names of the ui_queries referenced anywhere inside a manifest node."""
+    names = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in _QUERY_KEYS and isinstance(value, str):
+                names.append(value)
+            else:
+                names += _manifest_queries(value)
+    elif isinstance(node, list):
+        for item in node:
+            names += _manifest_queries(item)
+    return list(dict.fromkeys(names))
+
+
+def _query_url(name, params):
+    params = {k: v for k, v in params.items() if v is not None}
+    url = f"/api/queries/{quote(name)}/execute"
+    return f"{url}?{urlencode(params)}" if params else url
+
+
+def plan_requests(conn, manifest, n, seed=1):
+    """{view: [n request paths]} for every view of manifest, sampled from conn.
+
+    Views whose queries are missing from ui_queries are skipped with a
+    warning; a detail view needs its source_query to draw ids from.
+    """
+    sampler = ParamSampler(conn, seed)
+    queries = {name: (sql, params_json) for name, sql, params_json in conn.execute(
+        "SELECT name, sql, params_json FROM ui_queries")}
+
+    def draws(name):
+        sql, params_json = queries[name]
+        return sampler.plan(sql, params_json)
+
+    plan = {"(manifest)": ["/api/manifest"] * n}
+    views = [("(global controls)", {"controls": manifest.get("global_controls", [])})]
+    for view, spec in views + list(manifest.get("views", {}).items()):
+        if spec.get("type") == "detail":
+            query, param = spec.get("source_query"), spec.get("source_param")
+            if query not in queries or not param:
+                print(f"  Warning: {view}: no sampleable source_query, skipped",
+                      file=sys.stderr)
+                continue
+            draw = draws(query)
+            plan[view] = [f"/api/composite/{quote(view)}?id={quote(str(draw()[param]))}"
+                          for _ in range(n)]
+            continue
+        names = [q for q in _manifest_queries(spec) if q in queries]
+        missing = [q for q in _manifest_queries(spec) if q not in queries]
+        if missing:
+            print(f"  Warning: {view}: unknown queries {', '.join(missing)}", file=sys.stderr)
+        if not names:
+            continue
+        draw = {name: draws(name) for name in names}
+        # the view's queries in turn, as the viewer issues them on open
+        plan[view] = [_query_url(names[i % len(names)], draw[names[i % len(names)]]())
+                      for i in range(n)]
+    return plan
+
+
+def _mixed(plan, n):
+    """n requests interleaving every view of plan."""
+    paths = []
+    for i in range(max(map(len, plan.values()), default=0)):
+        paths += [urls[i] for urls in plan.values() if i < len(urls)]
+    return paths[:n]
+
+
+# ---------------------------------------------------------------------------
+# Serving
+# ---------------------------------------------------------------------------
+
+def _create_overlay(path, version):
+    """Empty overlay DB (overlay_metadata + user_annotations) for the server."""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS overlay_metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS user_annotations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity_type TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            entity_name TEXT,
+            annotation_type TEXT NOT NULL,
+            content TEXT NOT NULL,
+            author TEXT,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+    """)
+    conn.execute("INSERT OR REPLACE INTO overlay_metadata VALUES ('canonical_version', ?)",
+                 (version,))
+    conn.commit()
+    conn.close()
+
+
+class ServedPackage:
+    """A .scoda (plus paleocore) wired into scoda_engine.app for the duration of a with."""
+
+    def __init__(self, scoda_path, dist_dir=DIST_DIR):
+        self.scoda_path = Path(scoda_path)
+        self.dist_dir = Path(dist_dir)
+        self.pkg = None
+        self.db_path = None
+        self._dep_pkgs = []
+        self._tmp = None
+
+    def __enter__(self):
+        import scoda_engine.scoda_package as scoda_package
+        from scoda_engine.scoda_package import ScodaPackage
+
+        self._module = scoda_package
+        self.pkg = ScodaPackage(str(self.scoda_path))
+        self.db_path = self.pkg.db_path
+        dep_pkgs = []
+        pc = package_scodas(self.dist_dir).get("paleocore")
+        if pc is not None:
+            dep_pkgs.append(ScodaPackage(str(pc)))
+            pc_db = dep_pkgs[0].db_path
+        else:
+            pc_db = find_paleocore_db()
+        self._dep_pkgs = dep_pkgs
+        self._tmp = tempfile.TemporaryDirectory(prefix="bench_api_")
+        overlay = str(Path(self._tmp.name) / "overlay.db")
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro&immutable=1", uri=True)
+        version = conn.execute(
+            "SELECT value FROM artifact_metadata WHERE key = 'version'").fetchone()
+        conn.close()
+        _create_overlay(overlay, version[0] if version else "0.0.0")
+
+        scoda_package._canonical_db = self.db_path
+        scoda_package._overlay_db = overlay
+        scoda_package._dep_dbs = {"pc": pc_db}
+        scoda_package._scoda_pkg = self.pkg
+        scoda_package._dep_pkgs = dep_pkgs
+        return self
+
+    def __exit__(self, *exc):
+        self._module._reset_paths()
+        for pkg in [self.pkg] + self._dep_pkgs:
+            close = getattr(pkg, "close", None)
+            if close:
+                close()
+        self._tmp.cleanup()
+
+
+# ---------------------------------------------------------------------------
+# Load runners
+# ---------------------------------------------------------------------------
+
+def _stats(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "req_s": round(len(latencies) / elapsed, 1) if elapsed > 0 else None,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def run_threads(client, paths, concurrency):
+    """GET every path with concurrency threads sharing client. Returns stats."""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    queue = iter(paths)
+
+    def worker():
+        nonlocal errors
+        while True:
+            with lock:
+                path = next(queue, None)
+            if path is None:
+                return
+            t0 = time.perf_counter()
+            try:
+                ok = client.get(path).status_code < 400
+            except Exception:
+                ok = False
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                latencies.append(ms)
+                errors += not ok
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return _stats(latencies, errors, time.perf_counter() - t0)
+
+
+async def _run_async(client, paths, concurrency):
+    latencies, errors = [], 0
+    queue = iter(paths)
+
+    async def worker():
+        nonlocal errors
+        for path in queue:
+            t0 = time.perf_counter()
+            try:
+                ok = (await client.get(path)).status_code < 400
+            except Exception:
+                ok = False
+            latencies.append((time.perf_counter() - t0) * 1000)
+            errors += not ok
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _stats(latencies, errors, time.perf_counter() - t0)
+
+
+def run_async(make_client, paths, concurrency):
+    """GET every path from concurrency asyncio tasks. Returns stats."""
+    async def main():
+        async with make_client() as client:
+            return await _run_async(client, paths, concurrency)
+    return asyncio.run(main())
+
+
+def _clients(url):
+    """{client kind: runner(paths, concurrency)} plus the thread client to close."""
+    import httpx
+
+    if url:
+        sync = httpx.Client(base_url=url, timeout=60)
+        make_async = lambda: httpx.AsyncClient(base_url=url, timeout=60)
+    else:
+        from scoda_engine.app import app
+        from starlette.testclient import TestClient
+        sync = TestClient(app)
+        sync.__enter__()
+        make_async = lambda: httpx.AsyncClient(transport=httpx.ASGITransport(app=app),
+                                               base_url="http://bench", timeout=60)
+    runners = {
+        "thread": lambda paths, c: run_threads(sync, paths, c),
+        "async": lambda paths, c: run_async(make_async, paths, c),
+    }
+    return runners, sync
+
+
+def bench_package(scoda_path, requests=200, concurrency=(1, 8), clients=CLIENTS,
+                  seed=1, url=None, dist_dir=DIST_DIR):
+    """{"client@concurrency": {view: stats}} for one .scoda."""
+    with ServedPackage(scoda_path, dist_dir) as served:
+        conn = open_package(served.db_path)
+        manifest = json.loads(conn.execute(
+            "SELECT manifest_json FROM ui_manifest WHERE name = 'default'").fetchone()[0])
+        plan = plan_requests(conn, manifest, requests, seed)
+        conn.close()
+        plan[ALL_VIEWS] = _mixed(plan, requests * len(plan))
+
+        runners, sync = _clients(url)
+        results = {}
+        try:
+            for kind in clients:
+                for c in concurrency:
+                    run = results[f"{kind}@{c}"] = {}
+                    runners[kind](plan["(manifest)"][:c], c)     # warm-up
+                    for view, paths in plan.items():
+                        run[view] = runners[kind](paths, c)
+        finally:
+            if url:
+                sync.close()
+            else:
+                sync.__exit__(None, None, None)
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------------
+
+def _ms(value):
+    return f"{value:8.2f}" if value is not None else "       -"
+
+
+def _report(path, results):
+    for run, views in results.items():
+        kind, c = run.split("@")
+        print(f"\n{Path(path).name}  ({kind}, concurrency {c})")
+        print(f"  {'view':<32} {'requests':>8} {'errors':>7} {'req/s':>9} "
+              f"{'p50':>8} {'p95':>8} {'p99':>8}")
+        for view, s in views.items():
+            req_s = f"{s['req_s']:9.1f}" if s["req_s"] is not None else "        -"
+            print(f"  {view:<32} {s['requests']:8d} {s['errors']:7d} {req_s} "
+                  f"{_ms(s['p50_ms'])} {_ms(s['p95_ms'])} {_ms(s['p99_ms'])}")
+
+
+def _targets(names, dist_dir):
+    """.scoda paths for package names or paths (default: latest of every package)."""
+    scodas = package_scodas(dist_dir)
+    if not names:
+        return [path for pkg, path in sorted(scodas.items()) if pkg != "paleocore"]
+    paths = []
+    for name in names:
+        if name in scodas:
+            paths.append(scodas[name])
+        elif Path(name).exists():
+            paths.append(Path(name))
+        else:
+            raise SystemExit(f"Error: no package or .scoda named {name!r} in {dist_dir}")
+    return paths
+
+
+def _int_list(text):
+    return tuple(int(x) for x in text.split(","))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-benchmark every manifest view of a served .scoda package")
+    parser.add_argument("targets", nargs="*",
+                        help="Package names or .scoda paths (default: latest of every package)")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="Requests per view and run (default: 200)")
+    parser.add_argument("--concurrency", type=_int_list, default=(1, 8),
+                        help="Comma-separated concurrency levels (default: 1,8)")
+    parser.add_argument("--client", choices=CLIENTS + ("both",), default="both",
+                        help="Thread pool, asyncio or both (default: both)")
+    parser.add_argument("--url", default=None,
+                        help="Benchmark a running server at this base URL instead")
+    parser.add_argument("--seed", type=int, default=1, help="Parameter sampling seed")
+    parser.add_argument("--dist-dir", type=Path, default=DIST_DIR,
+                        help=f".scoda directory (default: {DIST_DIR.relative_to(ROOT)})")
+    parser.add_argument("--json", type=Path, default=None,
+                        help="Write the full results to this JSON file")
+    args = parser.parse_args()
+
+    clients = CLIENTS if args.client == "both" else (args.client,)
+    report, failing = {}, defaultdict(int)
+    for path in _targets(args.targets, args.dist_dir):
+        results = bench_package(path, args.requests, args.concurrency, clients,
+                                args.seed, args.url, args.dist_dir)
+        _report(path, results)
+        for views in results.values():
+            for view, s in views.items():
+                if view != ALL_VIEWS and s["errors"]:
+                    failing[f"{path.name}: {view}"] += s["errors"]
+        report[path.name] = results
+
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps(report, indent=1) + "\n")
+    if failing:
+        print(f"\nError: {len(failing)} view(s) returned errors:", file=sys.stderr)
+        for view, n in failing.items():
+            print(f"  {view}: {n} failed request(s)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
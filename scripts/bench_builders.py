@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+Builder throughput benchmark on synthetic TSF sources.
+
+Generates two R04/TSF sources per size, an original and a revision, and
+runs them through a package builder's own code, timing each phase:
+
+  parse             iter_placements() over both sources, uncached
+  parse_cache_hit   load_placements() served from the marshal cache
+  resolve_taxon     every placement / parent / synonym name into a fresh stage
+  process_source    both profiles through process_source() (taxa, assertions)
+  flush             BuildStage.flush() of the staged rows
+  edge_cache        classification_edge_cache rows + orphan bridge to the root taxon
+  rollup.*          each tree_cache builder (closure, nested set, node stats,
+                    diversity cube, profile diff, timeline snapshots / frames)
+
+The sources have a realistic rank mix (Class > Order > [Suborder] >
+Superfamily > Family > [Subfamily] > Genus, ~11 genera per family) and the
+markers the parser handles: "= X (j.s.s.)" / "~ X (misspelling)" synonym
+lines, "?" and "[incertae sedis]" status, "[*type species]" blocks and
+"| location | temporal" fields.  The revision moves ~10% of the genera to
+the next (sub)family, so profile_diff_cache has work to do.  Generation is
+deterministic per (size, seed); files are kept in .cache/bench/.
+
+Every run is appended to .cache/bench_builders.json.  --check compares each
+phase with the median of the previous runs of the same builder, size and
+seed, and exits 1 when one is slower than --tolerance x that median (and by
+more than MIN_REGRESSION_S), so a slow builder change is caught before it
+reaches a release build.
+
+Usage:
+  python scripts/bench_builders.py                          # 10k genera, brachiopoda
+  python scripts/bench_builders.py --sizes 10k,100k,1m --repeat 3
+  python scripts/bench_builders.py --builder mollusca --check
+"""
+
+import argparse
+import importlib
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from db_path import find_paleocore_db
+from staging import BuildStage, open_build_db
+from tree_cache import (build_classification_closure, build_diversity_cube,
+                        build_profile_diff_cache, build_profile_node_stats,
+                        build_profile_tree_index, build_timeline_frames,
+                        build_timeline_snapshots)
+from tree_engine import load_profile_trees
+from tsf_parser import iter_placements, load_placements, read_source
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_DIR = ROOT / ".cache" / "bench"
+HISTORY_FILE = ROOT / ".cache" / "bench_builders.json"
+
+# Phases faster than this never count as a regression (timer noise)
+MIN_REGRESSION_S = 0.05
+
+# Root the orphan top-level taxa are bridged to (at the builder's top rank)
+ROOT_TAXON = "Synthetica"
+
+_SYLLABLES = ("ba", "ce", "di", "fo", "gu", "ka", "le", "mi",
+              "no", "pu", "ra", "se", "ti", "vo", "xa", "zu")
+_GENUS_SUFFIXES = ("ia", "ella", "ites", "ina", "us", "aspis", "odus", "ops")
+_AUTHORS = ("HALL", "WALCOTT", "COOPER", "WILLIAMS", "HAVLICEK", "POPOV & HOLMER",
+            "ROWELL", "WRIGHT", "SCHUCHERT & LEVENE", "KONEVA in GORJANSKY & KONEVA")
+_LOCATIONS = ("USA", "Canada", "China", "Australia", "Russia", "England",
+              "Bohemia", "Morocco", "Argentina", "Kazakhstan")
+_TEMPORAL = ("LCAM", "MCAM", "UCAM", "LORD", "MORD", "UORD", "LSIL", "USIL",
+             "LDEV", "MDEV", "UDEV", "MISS", "PENN", "LPERM", "UPERM", "LTRI",
+             "MTRI", "UTRI", "LJUR", "MJUR", "UJUR", "LCRET", "UCRET", "TERT", "HOL")
+
+# Separate name spaces so names never collide across ranks or with synonyms
+_RANK_NAMES = {
+    "Class": (1, "ATA"), "Order": (2, "IDA"), "Suborder": (3, "INA"),
+    "Superfamily": (4, "OIDEA"), "Family": (5, "IDAE"), "Subfamily": (6, "INAE"),
+}
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1m' -> 1000000."""
+    text = text.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def _stem(i):
+    """Unique pronounceable stem for i (fixed-width syllables, no collisions)."""
+    digits = []
+    while True:
+        i, d = divmod(i, len(_SYLLABLES))
+        digits.append(_SYLLABLES[d])
+        if not i:
+            break
+    return "".join(reversed(digits))
+
+
+def _higher_name(rank, i):
+    space, suffix = _RANK_NAMES[rank]
+    return (_stem(space) + _stem(i)).upper() + suffix
+
+
+def _genus_name(i, space=0):
+    return (_stem(space) + _stem(i)).capitalize() + _GENUS_SUFFIXES[i % len(_GENUS_SUFFIXES)]
+
+
+def _genus_lines(i, rng):
+    """Text lines of genus i: the taxon line plus its synonym lines."""
+    name = _genus_name(i)
+    line = f"{name} {rng.choice(_AUTHORS)}, {rng.randint(1840, 2010)}"
+    if rng.random() < 0.7:
+        line += f" [*{name[0]}. {_stem(i + 7).lower()}us]"
+    fad = rng.randrange(len(_TEMPORAL))
+    code = _TEMPORAL[fad]
+    if rng.random() < 0.3 and fad + 1 < len(_TEMPORAL):
+        code += "-" + _TEMPORAL[rng.randrange(fad + 1, min(fad + 5, len(_TEMPORAL)))]
+    r = rng.random()
+    if r < 0.6:
+        line += f" | {rng.choice(_LOCATIONS)} | {code}"
+    elif r < 0.9:
+        line += f" | {code}"
+    r = rng.random()
+    if r < 0.05:
+        line = "?" + line
+    elif r < 0.07:
+        line += " [incertae sedis]"
+    lines = [line]
+    r = rng.random()
+    if r < 0.08:
+        # junior synonym, usually a name of its own, sometimes another genus
+        target = _genus_name(rng.randrange(i)) if i and rng.random() < 0.2 else _genus_name(i, 9)
+        lines.append(f"= {target} {rng.choice(_AUTHORS)}, {rng.randint(1840, 2010)} (j.s.s.)")
+    elif r < 0.10:
+        lines.append(f"~ {_genus_name(i, 10)} (misspelling)")
+    return lines
+
+
+def iter_synthetic_tsf(n_genera, seed, revised=False):
+    """Yield the body lines of a synthetic source with n_genera genera.
+
+    The rank tree and the genus lines depend only on (n_genera, seed); a
+    revised source has the same genera but moves ~10% of them to the next
+    (sub)family, the last one keeping what it was handed.  The sources start
+    at Class; run_once() bridges the classes to ROOT_TAXON.
+    """
+    struct = random.Random(seed)
+    attrs = random.Random(seed + 1)
+    moves = random.Random(seed + 2)
+    counters = dict.fromkeys(_RANK_NAMES, 0)
+    genus = 0
+    carry = []
+
+    def header(rank, depth):
+        counters[rank] += 1
+        return (f"{'  ' * depth}{rank} {_higher_name(rank, counters[rank])} "
+                f"{struct.choice(_AUTHORS).title()}, {struct.randint(1840, 2000)}")
+
+    while genus < n_genera:
+        yield header("Class", 1)
+        for _ in range(struct.randint(3, 8)):
+            if genus >= n_genera:
+                break
+            yield header("Order", 2)
+            for sub in range(2 if struct.random() < 0.25 else 1):
+                if struct.random() < 0.25 or sub:
+                    yield header("Suborder", 3)
+                for _ in range(struct.randint(2, 6)):
+                    if genus >= n_genera:
+                        break
+                    yield header("Superfamily", 4)
+                    for _ in range(struct.randint(2, 8)):
+                        if genus >= n_genera:
+                            break
+                        yield header("Family", 5)
+                        for subfamily in range(2 if struct.random() < 0.3 else 1):
+                            if subfamily or struct.random() < 0.1:
+                                yield header("Subfamily", 6)
+                            members = carry
+                            carry = []
+                            for _ in range(struct.randint(3, 18)):
+                                if genus >= n_genera:
+                                    break
+                                lines = _genus_lines(genus, attrs)
+                                genus += 1
+                                if revised and moves.random() < 0.1:
+                                    carry.append(lines)
+                                else:
+                                    members.append(lines)
+                            yield from _indented(members)
+    yield from _indented(carry)
+
+
+def _indented(genera):
+    for lines in genera:
+        yield "              " + lines[0]
+        for syn in lines[1:]:
+            yield "                " + syn
+
+
+def write_synthetic_sources(n_genera, seed, out_dir=BENCH_DIR):
+    """Write (or reuse) the original and revised sources. Returns their paths."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for revised in (False, True):
+        kind = "revised" if revised else "original"
+        path = out_dir / f"synthetic_{n_genera}_{seed}_{kind}.txt"
+        if not path.exists():
+            tmp = path.with_name(path.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write("---\n"
+                        f"reference: Synthetic benchmark source ({kind}, {n_genera} genera, "
+                        f"seed {seed})\n"
+                        "scope:\n"
+                        f"  - taxon: {ROOT_TAXON}\n"
+                        "    coverage: comprehensive\n"
+                        "---\n\n")
+                for line in iter_synthetic_tsf(n_genera, seed, revised):
+                    f.write(line + "\n")
+            tmp.replace(path)
+        paths.append(path)
+    return paths
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+class PhaseTimer:
+    """Wall seconds per named phase (repeated phases add up)."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def __call__(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - t0
+
+
+def _temporal_code_mya(conn):
+    conn.execute("ATTACH DATABASE ? AS pc", (str(find_paleocore_db()),))
+    conn.execute("""
+        CREATE TABLE temporal_code_mya AS
+        SELECT code, start_mya AS fad_mya, end_mya AS lad_mya
+        FROM pc.temporal_ranges
+        WHERE start_mya IS NOT NULL
+    """)
+    conn.execute("DETACH DATABASE pc")
+
+
+def run_once(builder, sources):
+    """One pass of every phase over sources. Returns (seconds, counts)."""
+    timer = PhaseTimer()
+    dialect = builder.TSF_DIALECT
+    root_rank = min(builder.RANK_ORDER, key=builder.RANK_ORDER.get)
+
+    with timer("parse"):
+        placements = [list(iter_placements(read_source(p)[1], "Genus", dialect))
+                      for p in sources]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for p in sources:
+            load_placements(p, "Genus", dialect, cache_dir=cache_dir)
+        with timer("parse_cache_hit"):
+            for p in sources:
+                load_placements(p, "Genus", dialect, cache_dir=cache_dir)
+
+    # resolve_taxon alone, into a scratch DB
+    scratch = open_build_db()
+    builder.create_schema(scratch.cursor())
+    stage, index, cache = BuildStage(scratch), {}, {}
+    with timer("resolve_taxon"):
+        for source in placements:
+            for p in source:
+                builder.resolve_taxon(p.name, p.rank, stage, index, cache)
+                if p.parent_name:
+                    builder.resolve_taxon(p.parent_name, p.parent_rank, stage, index, cache)
+                for syn in p.synonyms:
+                    builder.resolve_taxon(syn["target"], "Genus", stage, index, cache)
+    scratch.close()
+
+    conn = open_build_db()
+    cur = conn.cursor()
+    cur.execute("PRAGMA foreign_keys=ON")
+    builder.create_schema(cur)
+    stage = BuildStage(conn)
+    taxon_index = {}
+    for pi, (path, source) in enumerate(zip(sources, placements), 1):
+        cur.execute("INSERT INTO reference (authors, year, title, reference_type) "
+                    "VALUES ('Synthetic', 2000, ?, 'book')", (path.name,))
+        ref_id = cur.lastrowid
+        new_taxa_cache = {}
+        with timer("process_source"):
+            _counts, edges = builder.process_source(
+                stage, source, ref_id, taxon_index, new_taxa_cache)
+        with timer("flush"):
+            stage.flush()
+        taxon_index.update(new_taxa_cache)
+
+        with timer("edge_cache"):
+            cur.execute("INSERT INTO classification_profile (name, description, rule_json) "
+                        "VALUES (?, '', '{}')", (path.stem,))
+            profile_id = cur.lastrowid
+            cur.executemany(f"""
+                INSERT OR IGNORE INTO classification_edge_cache (profile_id, child_id, parent_id)
+                VALUES ({profile_id}, ?, ?)
+            """, edges)
+            root_id = builder.resolve_taxon(
+                ROOT_TAXON, root_rank, stage, taxon_index, new_taxa_cache)
+            stage.flush()
+            orphans = conn.execute("""
+                SELECT DISTINCT e.parent_id FROM classification_edge_cache e
+                WHERE e.profile_id = ? AND e.parent_id != ?
+                  AND e.parent_id NOT IN (
+                      SELECT e2.child_id FROM classification_edge_cache e2
+                      WHERE e2.profile_id = ?)
+            """, (profile_id, root_id, profile_id)).fetchall()
+            cur.executemany(f"""
+                INSERT OR IGNORE INTO classification_edge_cache (profile_id, child_id, parent_id)
+                VALUES ({profile_id}, ?, ?)
+            """, [(oid, root_id) for (oid,) in orphans])
+            conn.commit()
+
+    _temporal_code_mya(conn)
+    queries = builder._build_queries()
+    axis_sql = next((q[2] for q in queries if q[0] == "timeline_geologic_periods"), None)
+    pubyear_sql = next((q[2] for q in queries if q[0] == "timeline_publication_years"), None)
+    with timer("rollup.load"):
+        trees = load_profile_trees(conn)
+    with timer("rollup.closure"):
+        build_classification_closure(conn, trees)
+    with timer("rollup.tree_index"):
+        build_profile_tree_index(conn, trees)
+    with timer("rollup.node_stats"):
+        build_profile_node_stats(conn, trees)
+    with timer("rollup.diversity_cube"):
+        build_diversity_cube(conn)
+    with timer("rollup.profile_diff"):
+        build_profile_diff_cache(conn)
+    if axis_sql:
+        with timer("rollup.timeline_snapshots"):
+            build_timeline_snapshots(conn, trees, axis_sql)
+    if axis_sql or pubyear_sql:
+        with timer("rollup.timeline_frames"):
+            build_timeline_frames(conn, trees, axis_sql, pubyear_sql)
+    conn.commit()
+
+    counts = {
+        "placements": sum(len(s) for s in placements),
+        "taxa": conn.execute("SELECT COUNT(*) FROM taxon").fetchone()[0],
+        "assertions": conn.execute("SELECT COUNT(*) FROM assertion").fetchone()[0],
+        "edges": conn.execute("SELECT COUNT(*) FROM classification_edge_cache").fetchone()[0],
+        "closure": conn.execute("SELECT COUNT(*) FROM classification_closure").fetchone()[0],
+    }
+    conn.close()
+    return timer.seconds, counts
+
+
+def bench(builder_name, n_genera, seed=1, repeat=1):
+    """Best-of-repeat phase timings of one builder at one size (a history entry)."""
+    builder = importlib.import_module(f"build_{builder_name}_db")
+    t0 = time.perf_counter()
+    sources = write_synthetic_sources(n_genera, seed)
+    generated = time.perf_counter() - t0
+    best, counts = {}, None
+    for _ in range(repeat):
+        seconds, counts = run_once(builder, sources)
+        for phase, s in seconds.items():
+            best[phase] = min(best.get(phase, s), s)
+    return {
+        "builder": builder_name,
+        "genera": n_genera,
+        "seed": seed,
+        "repeat": repeat,
+        "generate_s": round(generated, 3),
+        "phases": {k: round(v, 4) for k, v in best.items()},
+        "total_s": round(sum(best.values()), 4),
+        "counts": counts,
+    }
+
+
+# ---------------------------------------------------------------------------
+# History
+# ---------------------------------------------------------------------------
+
+def read_history(path=HISTORY_FILE):
+    path = Path(path)
+    if not path.exists():
+        return []
+    return json.loads(path.read_text())
+
+
+def append_history(entries, path=HISTORY_FILE):
+    path = Path(path)
+    history = read_history(path) + entries
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(history, indent=1) + "\n")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(entry, history, tolerance, window=5):
+    """[(phase, seconds, baseline)] slower than tolerance x the recent median."""
+    previous = [h for h in history
+                if (h["builder"], h["genera"], h["seed"])
+                == (entry["builder"], entry["genera"], entry["seed"])][-window:]
+    found = []
+    for phase, seconds in entry["phases"].items():
+        past = [h["phases"][phase] for h in previous if phase in h["phases"]]
+        if not past:
+            continue
+        baseline = statistics.median(past)
+        if seconds > baseline * tolerance and seconds - baseline > MIN_REGRESSION_S:
+            found.append((phase, seconds, baseline))
+    return found
+
+
+def _report(entry, slow):
+    slow = {phase: baseline for phase, _s, baseline in slow}
+    print(f"\n{entry['builder']}: {entry['genera']:,} genera "
+          f"({entry['counts']['placements']:,} placements, {entry['counts']['taxa']:,} taxa, "
+          f"{entry['counts']['closure']:,} closure rows)")
+    for phase, seconds in entry["phases"].items():
+        note = f"  REGRESSION (median {slow[phase]:.3f} s)" if phase in slow else ""
+        print(f"  {phase:<28} {seconds:9.3f} s{note}")
+    print(f"  {'total':<28} {entry['total_s']:9.3f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark builder phases on synthetic TSF sources")
+    parser.add_argument("--builder", default="brachiopoda",
+                        help="TSF package builder to run (default: brachiopoda)")
+    parser.add_argument("--sizes", default="10k",
+                        help="Comma-separated genus counts, e.g. 10k,100k,1m (default: 10k)")
+    parser.add_argument("--seed", type=int, default=1, help="Generator seed (default: 1)")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs per size; the fastest time of each phase is kept")
+    parser.add_argument("--history", type=Path, default=HISTORY_FILE,
+                        help=f"JSON history file (default: {HISTORY_FILE.relative_to(ROOT)})")
+    parser.add_argument("--check", action="store_true",
+                        help="Exit 1 if a phase regressed against the history")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="Slowdown factor counted as a regression (default: 1.25)")
+    parser.add_argument("--no-save", action="store_true",
+                        help="Do not append this run to the history")
+    args = parser.parse_args()
+
+    history = read_history(args.history)
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+    }
+    entries, failed = [], False
+    for size in args.sizes.split(","):
+        entry = dict(run, **bench(args.builder, parse_size(size), args.seed, args.repeat))
+        slow = regressions(entry, history, args.tolerance)
+        _report(entry, slow)
+        failed |= bool(slow)
+        entries.append(entry)
+
+    if not args.no_save:
+        append_history(entries, args.history)
+        print(f"\nHistory: {args.history}")
+    if args.check and failed:
+        print("Error: phase regression against the benchmark history", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+ui_queries latency benchmark and cross-version regression check.
+
+Opens a package DB from db/ read-only, with paleocore attached as pc, and
+runs every ui_queries entry --runs times with parameters sampled from the
+DB's own data:
+
+  profile_id            cycles through every classification profile
+  compare_profile_id    another profile than profile_id (when there is one)
+  q / query / name      3-5 letter fragments of real taxon names
+  anything compared     distinct values of that column: for "e.parent_id =
+  with a column         :taxon_id" the parent ids of the edge cache, for
+                        "s.stop_mya IS :timeline_value" the snapshot stops, ...
+  the rest              index_advisor.representative_params()
+
+Per query it reports p50/p95/p99 latency and the mean rows returned.  The
+same parameter sequence is then replayed on the previous version of the
+package (brachiopoda-0.2.6 for brachiopoda-0.2.7, or --against, which must be
+the same package), so both sides time the same lookups; runs whose row
+count differs between the two are reported as row mismatches.  A query
+fails the check when its p95 grew past --max-slowdown x the previous p95
+(and by more than MIN_REGRESSION_MS), or past --budget-ms.  Queries that
+fail to run are reported as errors; a query missing from the previous
+version is new.
+
+Usage:
+  python scripts/bench_queries.py                       # latest of every package
+  python scripts/bench_queries.py brachiopoda mollusca --runs 200
+  python scripts/bench_queries.py db/brachiopoda-0.2.7.db --against db/brachiopoda-0.2.5.db
+  python scripts/bench_queries.py ostracoda --json .cache/bench_queries.json
+"""
+
+import argparse
+import json
+import random
+import re
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+from db_path import open_package, package_version, previous_version, resolve_package_dbs
+from index_advisor import alias_map, query_params, representative_params, table_columns
+
+ROOT = Path(__file__).resolve().parent.parent
+DB_DIR = ROOT / "db"
+
+# p95 growth below this never counts as a regression (timer noise)
+MIN_REGRESSION_MS = 0.5
+
+# Distinct values kept per sampled column
+SAMPLE_POOL = 500
+
+_TEXT_PARAMS = {"q", "query", "name"}
+
+
+# ---------------------------------------------------------------------------
+# Parameter sampling
+# ---------------------------------------------------------------------------
+
+# "alias.column <op> :param" / "column <op> :param"
+_COMPARE_RE = re.compile(
+    r"(?:(\w+)\.)?(\w+)\s*(?:=|==|IS|>=|<=|>|<|!=)\s*:(\w+)", re.IGNORECASE)
+
+
+class ParamSampler:
+    """Draws ui_query parameters from the values actually stored in a package DB."""
+
+    def __init__(self, conn, seed=1):
+        self.conn = conn
+        self.rng = random.Random(seed)
+        self._pools = {}
+        self._next_profile = 0
+        self.profiles = self._values("classification_profile", "id") or [1]
+        names = self._values("taxon", "name")
+        self.fragments = sorted({n[i:i + k].lower() for n in names
+                                 for k in (3, 5) for i in (0, 1) if len(n) >= i + k}) or ["ab"]
+
+    def _values(self, table, column):
+        key = (table, column)
+        if key not in self._pools:
+            values = []
+            if column in table_columns(self.conn, table):
+                try:
+                    values = [r[0] for r in self.conn.execute(
+                        f"SELECT DISTINCT {column} FROM {table} LIMIT 100000")]
+                except sqlite3.Error:
+                    values = []
+            if len(values) > SAMPLE_POOL:
+                values = random.Random(repr(key)).sample(values, SAMPLE_POOL)
+            self._pools[key] = values
+        return self._pools[key]
+
+    def _column_pools(self, sql):
+        """{param: [candidate values]} from the columns the param is compared with."""
+        aliases = alias_map(sql)
+        tables = list(dict.fromkeys(aliases.values()))
+        pools = {}
+        for alias, column, param in _COMPARE_RE.findall(sql):
+            if param in pools:
+                continue
+            if alias:
+                candidates = [aliases[alias]] if alias in aliases else []
+            else:
+                candidates = tables
+            for table in candidates:
+                values = self._values(table, column)
+                if values:
+                    pools[param] = values
+                    break
+        return pools
+
+    def plan(self, sql, params_json=None):
+        """A callable returning a fresh parameter dict for each run of sql."""
+        names = query_params(sql)
+        defaults = representative_params(sql, params_json)
+        pools = self._column_pools(sql)
+
+        def draw():
+            params = {}
+            for name in names:
+                if name == "profile_id":
+                    params[name] = self.profiles[self._next_profile % len(self.profiles)]
+                    self._next_profile += 1
+                elif name == "compare_profile_id":
+                    others = [p for p in self.profiles if p != params.get("profile_id")]
+                    params[name] = self.rng.choice(others or self.profiles)
+                elif name in _TEXT_PARAMS:
+                    params[name] = self.rng.choice(self.fragments)
+                elif name in pools:
+                    params[name] = self.rng.choice(pools[name])
+                else:
+                    params[name] = defaults[name]
+            return params
+        return draw
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+def sample_params(path, runs=50, seed=1):
+    """{query: [runs + 1 parameter dicts]} drawn from a package DB's own data.
+
+    The first dict of each list is for the warm-up run.
+    """
+    conn = open_package(path)
+    sampler = ParamSampler(conn, seed)
+    plans = {}
+    for name, sql, params_json in conn.execute(
+            "SELECT name, sql, params_json FROM ui_queries ORDER BY name").fetchall():
+        draw = sampler.plan(sql, params_json)
+        plans[name] = [draw() for _ in range(runs + 1)]
+    conn.close()
+    return plans
+
+
+def bench_db(path, plans):
+    """Time the ui_queries of a package DB on sample_params() lists. Returns {query: stats}.
+
+    Queries without a plan are skipped; parameters a query takes that its
+    plan lacks (an older version of it) get representative_params().
+    """
+    conn = open_package(path)
+    results = {}
+    queries = conn.execute(
+        "SELECT name, sql, params_json FROM ui_queries ORDER BY name").fetchall()
+    for name, sql, params_json in queries:
+        if name not in plans:
+            continue
+        defaults = representative_params(sql, params_json)
+        warmup, *runs = [{**defaults, **params} for params in plans[name]]
+        latencies, rows = [], []
+        error = None
+        try:
+            conn.execute(sql, warmup).fetchall()
+            for params in runs:
+                t0 = time.perf_counter()
+                n = len(conn.execute(sql, params).fetchall())
+                latencies.append((time.perf_counter() - t0) * 1000)
+                rows.append(n)
+        except sqlite3.Error as e:
+            error = str(e)
+        latencies.sort()
+        results[name] = {
+            "runs": len(latencies),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "rows": round(sum(rows) / len(rows), 1) if rows else None,
+            "row_counts": rows,
+            "error": error,
+        }
+    conn.close()
+    return results
+
+
+def compare(current, previous, max_slowdown, budget_ms=None):
+    """Annotate current's stats with the previous p95, row mismatches and a status.
+
+    row_mismatches counts the runs whose row count differs from the same run
+    on the previous DB; it is reported, not failed on (the data may differ
+    between versions).  Returns the failed query names.
+    """
+    failed = []
+    for name, stats in current.items():
+        before = (previous or {}).get(name)
+        stats["prev_p95_ms"] = before["p95_ms"] if before else None
+        stats["row_mismatches"] = None
+        if before and not stats["error"] and not before["error"]:
+            stats["row_mismatches"] = sum(
+                a != b for a, b in zip(stats.get("row_counts", []), before.get("row_counts", [])))
+        if stats["error"]:
+            stats["status"] = "error"
+        elif budget_ms is not None and stats["p95_ms"] > budget_ms:
+            stats["status"] = "over budget"
+        elif before is None or before["p95_ms"] is None:
+            stats["status"] = "new" if previous is not None else ""
+            continue
+        elif (stats["p95_ms"] > before["p95_ms"] * max_slowdown
+              and stats["p95_ms"] - before["p95_ms"] > MIN_REGRESSION_MS):
+            stats["status"] = "slower"
+        else:
+            stats["status"] = "ok"
+            continue
+        failed.append(name)
+    return failed
+
+
+def _ms(value):
+    return f"{value:8.2f}" if value is not None else "       -"
+
+
+def _report(path, against, results):
+    print(f"\n{Path(path).name}" + (f"  (vs {Path(against).name})" if against else ""))
+    print(f"  {'query':<40} {'p50':>8} {'p95':>8} {'p99':>8} {'rows':>8} {'prev p95':>9} "
+          f"{'rows!=':>6}")
+    for name, s in sorted(results.items()):
+        rows = f"{s['rows']:8.1f}" if s["rows"] is not None else "       -"
+        mismatches = s.get("row_mismatches")
+        mismatches = f"{mismatches:6d}" if mismatches is not None else "     -"
+        status = s.get("status", "")
+        if s["error"]:
+            status = f"error: {s['error']}"
+        print(f"  {name:<40} {_ms(s['p50_ms'])} {_ms(s['p95_ms'])} {_ms(s['p99_ms'])} "
+              f"{rows} {_ms(s.get('prev_p95_ms'))} {mismatches} {status}".rstrip())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark ui_queries latency against the previous package version")
+    parser.add_argument("targets", nargs="*",
+                        help="Package names or DB paths (default: latest of every package)")
+    parser.add_argument("--against", type=Path, default=None,
+                        help="Baseline DB of the same package (default: its previous version)")
+    parser.add_argument("--runs", type=int, default=50,
+                        help="Timed runs per query (default: 50)")
+    parser.add_argument("--seed", type=int, default=1, help="Parameter sampling seed")
+    parser.add_argument("--max-slowdown", type=float, default=1.5,
+                        help="Fail when a p95 exceeds this factor x the baseline p95 "
+                             "(default: 1.5)")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="Fail when any query's p95 exceeds this many milliseconds")
+    parser.add_argument("--db-dir", type=Path, default=DB_DIR,
+                        help=f"Package DB directory (default: {DB_DIR.relative_to(ROOT)})")
+    parser.add_argument("--json", type=Path, default=None,
+                        help="Write the full results to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        targets = resolve_package_dbs(args.targets, args.db_dir)
+    except FileNotFoundError as e:
+        raise SystemExit(f"Error: {e}")
+    if args.against:
+        baseline = package_version(args.against)
+        for path in targets:
+            target = package_version(path)
+            if not baseline or not target or target[0] != baseline[0]:
+                raise SystemExit(f"Error: --against {args.against.name} is not a version "
+                                 f"of the same package as {Path(path).name}")
+
+    report, failures = {}, []
+    for path in targets:
+        against = args.against or previous_version(path, args.db_dir)
+        # one parameter sequence per query, drawn from the newer DB, replayed on both
+        plans = sample_params(path, args.runs, args.seed)
+        current = bench_db(path, plans)
+        previous = bench_db(against, plans) if against else None
+        failed = compare(current, previous, args.max_slowdown, args.budget_ms)
+        _report(path, against, current)
+        failures += [f"{path.name}: {name} ({current[name]['status']})" for name in failed]
+        report[path.name] = {"against": against.name if against else None,
+                             "queries": current}
+
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps(report, indent=1) + "\n")
+    if failures:
+        print(f"\nError: {len(failures)} query regression(s):", file=sys.stderr)
+        for line in failures:
+            print(f"  {line}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,307 +1,338 @@
 #!/usr/bin/env python3
 """
-Create a .scoda package from trilobita.db
+Build every package in dependency order.
+
+  paleocore DB ──┬── 11 taxon DBs ──── 11 taxon .scoda ──┬── paleobase .scoda
+                 └──────────────── paleocore .scoda ─────┘
+
+Targets that do not depend on each other run in parallel, each builder in
+its own process (--jobs workers, default: one per CPU).  Before a target
+runs, its inputs are fingerprinted:
+
+  - the builder script and the scripts/ modules it imports (transitively),
+  - the data files the script names (data/sources/*.txt, data/*.json, ...),
+  - extra inputs: the paleocore DB every taxon DB attaches, the legacy
+    canonical DB trilobita is built from,
+  - the SHA-256 of every output of its dependencies, and its own output
+    paths, which carry the package versions.
+
+A target whose fingerprint matches its last successful build and whose
+outputs exist is skipped.  Fingerprints are kept in .cache/build_all.json,
+builder output in .cache/build_logs/<target>.log.
+
+The paleocore DB is an input, not a target: build_paleocore_db.py extracts
+it from trilobita tables that Phase 34 dropped, so the shipped
+db/paleocore-*.db is used as is.
 
 Usage:
-  python scripts/create_scoda.py              # create trilobita.scoda
-  python scripts/create_scoda.py --dry-run    # preview manifest without creating file
-  python scripts/create_scoda.py --output out.scoda  # custom output path
-  python scripts/create_scoda.py --with-spa           # include reference SPA
+  python scripts/build_all.py                        # build what is out of date
+  python scripts/build_all.py --jobs 4
+  python scripts/build_all.py brachiopoda mollusca   # these packages (+ what they need)
+  python scripts/build_all.py --db-only              # package DBs, no .scoda
+  python scripts/build_all.py --force                # ignore the up-to-date check
+  python scripts/build_all.py --dry-run              # show the plan
 """
 
 import argparse
 import hashlib
 import json
 import os
+import re
 import sqlite3
+import subprocess
 import sys
-from datetime import datetime, timezone
-
-from scoda_engine.scoda_package import ScodaPackage, _sha256_file
-from scoda_engine_core import validate_db
-
-from db_path import find_trilobita_db
-
-DEFAULT_DB = find_trilobita_db()
-DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(__file__), '..', 'dist')
-DEFAULT_MCP_TOOLS = os.path.join(os.path.dirname(__file__), '..', 'data', 'mcp_tools_trilobita.json')
-
-
-def _read_version(db_path):
-    """Read version from artifact_metadata table."""
-    conn = sqlite3.connect(db_path)
-    try:
-        row = conn.execute("SELECT value FROM artifact_metadata WHERE key='version'").fetchone()
-        return row[0] if row else '0.0.0'
-    finally:
-        conn.close()
-
-
-def _read_db_metadata(db_path):
-    """Read all artifact_metadata as a dict."""
-    conn = sqlite3.connect(db_path)
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from build_state import file_sha256
+from db_path import find_canonical_db, find_paleocore_db
+
+ROOT = Path(__file__).resolve().parent.parent
+SCRIPTS = ROOT / "scripts"
+DB_DIR = ROOT / "db"
+DIST_DIR = ROOT / "dist"
+STATE_FILE = ROOT / ".cache" / "build_all.json"
+LOG_DIR = ROOT / ".cache" / "build_logs"
+
+# Taxon packages, in paleobase dependency order
+TAXON_PACKAGES = [
+    "trilobita", "brachiopoda", "graptolithina", "chelicerata", "ostracoda",
+    "bryozoa", "coelenterata", "hexapoda", "porifera", "echinodermata", "mollusca",
+]
+
+_VERSION_RE = re.compile(r'^(?:ASSERTION_)?VERSION = "(\d+\.\d+\.\d+)"', re.M)
+_IMPORT_RE = re.compile(r"^(?:from (\w+) import|import (\w+))", re.M)
+_DATA_FILE_RE = re.compile(r"""["']([\w.\-]+\.(?:txt|json|md))["']""")
+_DATA_DIRS = (ROOT / "data" / "sources", ROOT / "data", ROOT)
+
+
+class Target:
+    """One builder run: script + args, producing outputs from inputs."""
+
+    def __init__(self, name, script, args=(), deps=(), outputs=(), inputs=()):
+        self.name = name
+        self.script = SCRIPTS / script
+        self.args = [str(a) for a in args]
+        self.deps = list(deps)
+        self.outputs = [Path(p) for p in outputs]
+        self.inputs = [Path(p) for p in inputs]
+
+
+# ---------------------------------------------------------------------------
+# Dependency graph
+# ---------------------------------------------------------------------------
+
+def script_version(script):
+    """The VERSION constant of a builder script."""
+    m = _VERSION_RE.search((SCRIPTS / script).read_text(encoding="utf-8"))
+    if not m:
+        raise ValueError(f"{script}: no VERSION constant")
+    return m.group(1)
+
+
+def _db_version(db_path):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
     try:
-        rows = conn.execute("SELECT key, value FROM artifact_metadata").fetchall()
-        return dict(rows)
+        row = conn.execute(
+            "SELECT value FROM artifact_metadata WHERE key = 'version'").fetchone()
+        return row[0] if row else "0.0.0"
     finally:
         conn.close()
 
 
-def _sha256_scoda(path):
-    """Compute SHA-256 of a .scoda file."""
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-
-def generate_hub_manifest(scoda_path, db_path):
-    """Generate Hub Manifest JSON alongside the .scoda file."""
-    meta = _read_db_metadata(db_path)
-    package_id = meta.get('artifact_id', 'trilobita')
-    version = meta.get('version', '0.0.0')
-
-    # Read provenance from DB
-    provenance = []
-    conn = sqlite3.connect(db_path)
+def build_targets():
+    """{name: Target} for the whole release."""
+    pc_db = Path(find_paleocore_db())
+    targets = {}
+    for pkg in TAXON_PACKAGES:
+        version = script_version(f"build_{pkg}_db.py")
+        db = DB_DIR / f"{pkg}-{version}.db"
+        extra = [pc_db]
+        if pkg == "trilobita":
+            try:
+                extra.append(Path(find_canonical_db()))
+            except FileNotFoundError:
+                pass    # the builder reports it
+        targets[f"{pkg}_db"] = Target(
+            f"{pkg}_db", f"build_{pkg}_db.py", ["--version", version],
+            outputs=[db], inputs=extra)
+        scoda = DIST_DIR / f"{pkg}-{version}.scoda"
+        targets[f"{pkg}_scoda"] = Target(
+            f"{pkg}_scoda", f"build_{pkg}_scoda.py", ["--db", db, "--output", scoda],
+            deps=[f"{pkg}_db"], outputs=[scoda])
+
+    scoda = DIST_DIR / f"paleocore-{_db_version(pc_db)}.scoda"
+    targets["paleocore_scoda"] = Target(
+        "paleocore_scoda", "build_paleocore_scoda.py", ["--db", pc_db, "--output", scoda],
+        outputs=[scoda], inputs=[pc_db])
+
+    scoda = DIST_DIR / f"paleobase-{script_version('build_paleobase_scoda.py')}.scoda"
+    targets["paleobase_scoda"] = Target(
+        "paleobase_scoda", "build_paleobase_scoda.py", ["--output", scoda],
+        deps=["paleocore_scoda"] + [f"{pkg}_scoda" for pkg in TAXON_PACKAGES],
+        outputs=[scoda])
+    return targets
+
+
+def select_targets(targets, packages=(), db_only=False):
+    """The targets of the given packages (all when empty) and everything they need."""
+    if db_only:
+        wanted = [n for n in targets if n.endswith("_db")]
+    else:
+        wanted = list(targets)
+    if packages:
+        unknown = set(packages) - {n.rsplit("_", 1)[0] for n in targets}
+        if unknown:
+            raise SystemExit(f"Unknown package(s): {', '.join(sorted(unknown))}")
+        wanted = [n for n in wanted if n.rsplit("_", 1)[0] in packages]
+    selected = set()
+    stack = list(wanted)
+    while stack:
+        name = stack.pop()
+        if name not in selected:
+            selected.add(name)
+            stack.extend(targets[name].deps)
+    return {n: t for n, t in targets.items() if n in selected}
+
+
+# ---------------------------------------------------------------------------
+# Fingerprints
+# ---------------------------------------------------------------------------
+
+def code_files(script):
+    """script and the scripts/ modules it imports, transitively."""
+    seen, stack = [], [Path(script)]
+    while stack:
+        path = stack.pop()
+        if path in seen:
+            continue
+        seen.append(path)
+        for a, b in _IMPORT_RE.findall(path.read_text(encoding="utf-8")):
+            module = SCRIPTS / f"{a or b}.py"
+            if module.exists():
+                stack.append(module)
+    return sorted(seen)
+
+
+def data_files(script):
+    """Files under data/ (or the repo root) that the script names literally."""
+    found = set()
+    for name in _DATA_FILE_RE.findall(Path(script).read_text(encoding="utf-8")):
+        for d in _DATA_DIRS:
+            if (d / name).is_file():
+                found.add(d / name)
+                break
+    return sorted(found)
+
+
+_hashes = {}
+
+
+def _sha256(path):
+    """file_sha256, memoized per (path, size, mtime) for the run."""
+    if not path.exists():
+        return None
+    st = path.stat()
+    key = (path, st.st_size, st.st_mtime_ns)
+    if key not in _hashes:
+        _hashes[key] = file_sha256(path)
+    return _hashes[key]
+
+
+def fingerprint(target, targets):
+    """SHA-256 over everything the target's outputs are derived from."""
+    parts = [("args", " ".join(target.args))]
+    for path in code_files(target.script) + data_files(target.script) + target.inputs:
+        parts.append((path.relative_to(ROOT).as_posix() if path.is_relative_to(ROOT)
+                      else path.as_posix(), _sha256(path)))
+    for dep in target.deps:
+        for path in targets[dep].outputs:
+            parts.append((f"{dep}:{path.name}", _sha256(path)))
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def read_state():
     try:
-        rows = conn.execute("SELECT citation FROM provenance WHERE citation IS NOT NULL").fetchall()
-        provenance = [r[0] for r in rows]
-    finally:
-        conn.close()
-
-    manifest = {
-        "hub_manifest_version": "1.0",
-        "package_id": package_id,
-        "version": version,
-        "title": meta.get('name', 'Trilobita') + ' - ' + meta.get('description', ''),
-        "description": meta.get('description', ''),
-        "license": meta.get('license', 'CC-BY-4.0'),
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "provenance": provenance,
-        "dependencies": {
-            "paleocore": ">=0.1.1,<0.2.0"
-        },
-        "filename": os.path.basename(scoda_path),
-        "sha256": _sha256_scoda(scoda_path),
-        "size_bytes": os.path.getsize(scoda_path),
-        "scoda_format_version": "1.0",
-        "engine_compat": ">=0.1.0",
-    }
-
-    out_path = os.path.join(os.path.dirname(scoda_path), f"{package_id}-{version}.manifest.json")
-    with open(out_path, "w") as f:
-        json.dump(manifest, f, indent=2, ensure_ascii=False)
-        f.write("\n")
-
-    print(f"  Hub Manifest: {out_path}")
-    return out_path
+        return json.loads(STATE_FILE.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(state):
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+    tmp.write_text(json.dumps(state, indent=2, sort_keys=True) + "\n")
+    os.replace(tmp, STATE_FILE)
+
+
+# ---------------------------------------------------------------------------
+# Scheduler
+# ---------------------------------------------------------------------------
+
+def run_target(target):
+    """Run the builder in its own process. Returns (returncode, seconds)."""
+    start = time.monotonic()
+    for path in target.outputs:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOG_DIR / f"{target.name}.log", "w") as log:
+        proc = subprocess.run([sys.executable, str(target.script), *target.args],
+                              cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    return proc.returncode, time.monotonic() - start
+
+
+def _report(label, name, detail=""):
+    print(f"  {label:<11} {name} {detail}".rstrip(), flush=True)
+
+
+def build(targets, jobs=None, force=False, dry_run=False):
+    """Run the out-of-date targets as their dependencies complete.
+
+    Returns {target: status}, status being 'built', 'up to date',
+    'failed', 'blocked' (a dependency failed) or, with dry_run, 'stale'.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    state = read_state()
+    status = {}
+    pending = dict(targets)
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name, target in list(pending.items()):
+                deps = [d for d in target.deps if d in targets]
+                if any(status.get(d) in ("failed", "blocked") for d in deps):
+                    status[name] = "blocked"
+                elif all(d in status for d in deps):
+                    stale_dep = any(status[d] in ("stale", "built") for d in deps)
+                    fp = fingerprint(target, targets)
+                    fresh = (not force and state.get(name) == fp
+                             and all(p.exists() for p in target.outputs))
+                    if fresh and not (dry_run and stale_dep):
+                        status[name] = "up to date"
+                    elif dry_run:
+                        status[name] = "stale"
+                    elif len(running) >= jobs:
+                        continue
+                    else:
+                        running[pool.submit(run_target, target)] = (name, fp)
+                        _report("started", name)
+                else:
+                    continue
+                del pending[name]
+                if name in status:
+                    _report(status[name], name)
+            if not running:
+                if pending and not any(
+                        all(d in status for d in t.deps if d in targets)
+                        for t in pending.values()):
+                    raise RuntimeError(f"dependency cycle among {sorted(pending)}")
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, fp = running.pop(future)
+                code, seconds = future.result()
+                if code == 0:
+                    status[name] = "built"
+                    state[name] = fp
+                    _report("built", name, f"({seconds:.1f}s)")
+                else:
+                    status[name] = "failed"
+                    state.pop(name, None)
+                    _report("FAILED", name, f"(exit {code}, {seconds:.1f}s) "
+                            f"see {LOG_DIR / (name + '.log')}")
+                write_state(state)
+    return status
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description='Create a .scoda package from trilobita.db')
-    parser.add_argument(
-        '--db', default=DEFAULT_DB,
-        help='Path to source SQLite database (default: trilobita.db)')
-    parser.add_argument(
-        '--output', default=None,
-        help='Output .scoda file path (default: trilobita-{version}.scoda)')
-    parser.add_argument(
-        '--mcp-tools', default=DEFAULT_MCP_TOOLS,
-        help='Path to mcp_tools.json (default: data/mcp_tools_trilobita.json)')
-    parser.add_argument(
-        '--dry-run', action='store_true',
-        help='Preview manifest without creating file')
-    parser.add_argument(
-        '--with-spa', action='store_true',
-        help='Include reference SPA in package (default: excluded)')
-    parser.add_argument(
-        '--no-assertion', action='store_true',
-        help='Skip building trilobita .scoda package')
+        description="Build all package DBs and .scoda packages in dependency order")
+    parser.add_argument("packages", nargs="*",
+                        help="Packages to build (default: all, plus paleobase)")
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help="Parallel builders (default: CPU count)")
+    parser.add_argument("--db-only", action="store_true",
+                        help="Build package DBs only, no .scoda packages")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild targets even when their inputs are unchanged")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Show which targets are stale without building")
     args = parser.parse_args()
 
-    db_path = os.path.abspath(args.db)
-    if args.output:
-        output_path = os.path.abspath(args.output)
-    else:
-        version = _read_version(db_path)
-        output_path = os.path.abspath(
-            os.path.join(DEFAULT_OUTPUT_DIR, f'trilobita-{version}.scoda'))
-
-    if not os.path.exists(db_path):
-        print(f"Error: Database not found: {db_path}", file=sys.stderr)
+    targets = select_targets(build_targets(), args.packages, args.db_only)
+    print(f"=== build_all: {len(targets)} targets ===", flush=True)
+    start = time.monotonic()
+    status = build(targets, args.jobs, args.force, args.dry_run)
+
+    counts = {}
+    for s in status.values():
+        counts[s] = counts.get(s, 0) + 1
+    print(f"\n{', '.join(f'{n} {s}' for s, n in sorted(counts.items()))} "
+          f"in {time.monotonic() - start:.1f}s")
+    if counts.get("failed") or counts.get("blocked"):
         sys.exit(1)
 
-    # Validate manifest before packaging
-    errors, warnings = validate_db(db_path)
-    for w in warnings:
-        print(f"  WARNING: {w}")
-    for e in errors:
-        print(f"  ERROR: {e}", file=sys.stderr)
-    if errors:
-        print(f"\nManifest validation failed: {len(errors)} error(s)", file=sys.stderr)
-        sys.exit(1)
-    print(f"Manifest validation: OK ({len(warnings)} warning(s))")
-
-    if args.dry_run:
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT key, value FROM artifact_metadata")
-        db_meta = {row['key']: row['value'] for row in cursor.fetchall()}
-
-        # Count records: sum all non-SCODA-metadata tables
-        scoda_meta_tables = {'artifact_metadata', 'provenance', 'schema_descriptions',
-                             'ui_display_intent', 'ui_queries', 'ui_manifest'}
-        all_tables = cursor.execute(
-            "SELECT name FROM sqlite_master WHERE type='table'"
-        ).fetchall()
-        record_count = 0
-        for (table_name,) in all_tables:
-            if table_name not in scoda_meta_tables and not table_name.startswith('sqlite_'):
-                cnt = cursor.execute(f"SELECT COUNT(*) FROM [{table_name}]").fetchone()[0]
-                record_count += cnt
-        conn.close()
 
-        checksum = _sha256_file(db_path)
-
-        manifest = {
-            "format": "scoda",
-            "format_version": "1.0",
-            "name": db_meta.get('artifact_id', 'trilobita'),
-            "version": db_meta.get('version', '0.1.0'),
-            "title": db_meta.get('name', 'Trilobita') + ' - ' + db_meta.get('description', ''),
-            "description": db_meta.get('description', ''),
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "license": db_meta.get('license', 'CC-BY-4.0'),
-            "authors": [],
-            "data_file": "data.db",
-            "record_count": record_count,
-            "data_checksum_sha256": checksum,
-            "dependencies": [
-                {
-                    "name": "paleocore",
-                    "alias": "pc",
-                    "version": ">=0.1.1,<0.2.0",
-                    "file": "paleocore.scoda",
-                    "required": True,
-                    "description": "Shared paleontological infrastructure (geography, stratigraphy)"
-                }
-            ],
-        }
-
-        print("=== DRY RUN (no file will be created) ===")
-        print()
-        print(f"Source DB:    {db_path}")
-        print(f"DB size:      {os.path.getsize(db_path):,} bytes")
-        print(f"Output:       {output_path}")
-        print()
-        print("manifest.json:")
-        print(json.dumps(manifest, indent=2, ensure_ascii=False))
-        return
-
-    # Collect SPA files as extra_assets
-    extra_assets = {}
-    if args.with_spa:
-        spa_dir = os.path.join(os.path.dirname(__file__), '..', 'spa')
-        if os.path.isdir(spa_dir):
-            for fname in os.listdir(spa_dir):
-                fpath = os.path.join(spa_dir, fname)
-                if os.path.isfile(fpath):
-                    extra_assets[f'assets/spa/{fname}'] = fpath
-
-    # Include CHANGELOG.md
-    changelog_path = os.path.join(os.path.dirname(__file__), '..', 'CHANGELOG.md')
-    if os.path.isfile(changelog_path):
-        extra_assets['CHANGELOG.md'] = changelog_path
-
-    # Create .scoda package with paleocore dependency + SPA
-    metadata = {
-        "dependencies": [
-            {
-                "name": "paleocore",
-                "alias": "pc",
-                "version": ">=0.1.1,<0.2.0",
-                "file": "paleocore.scoda",
-                "required": True,
-                "description": "Shared paleontological infrastructure (geography, stratigraphy)"
-            }
-        ],
-    }
-    if args.with_spa and extra_assets:
-        metadata["has_reference_spa"] = True
-        metadata["reference_spa_path"] = "assets/spa/"
-
-    # Resolve MCP tools path
-    mcp_tools_path = os.path.abspath(args.mcp_tools)
-    if not os.path.exists(mcp_tools_path):
-        mcp_tools_path = None
-
-    result = ScodaPackage.create(db_path, output_path, metadata=metadata,
-                                 extra_assets=extra_assets if extra_assets else None,
-                                 mcp_tools_path=mcp_tools_path)
-    size = os.path.getsize(result)
-
-    print(f"Created: {result}")
-    print(f"  Size: {size:,} bytes ({size / 1024 / 1024:.1f} MB)")
-
-    # Generate Hub Manifest
-    generate_hub_manifest(result, db_path)
-
-    # Verify by opening
-    with ScodaPackage(result) as pkg:
-        print(f"  Format: {pkg.manifest.get('format')} v{pkg.manifest.get('format_version')}")
-        print(f"  Name: {pkg.name}")
-        print(f"  Version: {pkg.version}")
-        print(f"  Records: {pkg.record_count}")
-        if pkg.verify_checksum():
-            print(f"  Checksum: OK")
-        else:
-            print(f"  Checksum: MISMATCH!", file=sys.stderr)
-            sys.exit(1)
-        mcp = pkg.mcp_tools
-        if mcp:
-            tool_names = [t['name'] for t in mcp.get('tools', [])]
-            print(f"  MCP tools: {len(tool_names)} ({', '.join(tool_names)})")
-        else:
-            print(f"  MCP tools: none")
-
-    # Build trilobita-assertion .scoda package
-    if not args.no_assertion:
-        if not build_trilobita(dry_run=args.dry_run):
-            sys.exit(1)
-
-
-def build_trilobita(dry_run=False):
-    """Build trilobita .scoda package (assertion-centric)."""
-    import subprocess
-    print(flush=True)
-    print("=" * 60, flush=True)
-    print("Building trilobita .scoda ...", flush=True)
-    print("=" * 60, flush=True)
-
-    # Step 1: Rebuild assertion DB (single-script pipeline)
-    db_script = os.path.join(os.path.dirname(__file__), 'build_trilobita_db.py')
-    result = subprocess.run([sys.executable, db_script], cwd=os.path.join(os.path.dirname(__file__), '..'))
-    if result.returncode != 0:
-        print("Error: build_trilobita_db.py failed", file=sys.stderr)
-        return False
-
-    if dry_run:
-        return True
-
-    # Step 2: Build .scoda package
-    scoda_script = os.path.join(os.path.dirname(__file__), 'build_trilobita_scoda.py')
-    result = subprocess.run([sys.executable, scoda_script], cwd=os.path.join(os.path.dirname(__file__), '..'))
-    if result.returncode != 0:
-        print("Error: build_trilobita_scoda.py failed", file=sys.stderr)
-        return False
-
-    return True
-
-
-if __name__ == '__main__':
+if __name__ == "__main__":
     main()
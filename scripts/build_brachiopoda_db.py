@@ -13,13 +13,19 @@ Usage:
 
 import argparse
 import json
-import re
-import sqlite3
 import sys
 from datetime import datetime, timezone
 from pathlib import Path
 
+from build_profiler import BuildProfiler
+from build_state import build_inputs, read_build_state, stale_profiles, write_build_state
 from db_path import find_paleocore_db
+from index_advisor import QueryPlanError, check_query_plans
+from name_reconcile import reconcile_taxa
+from search_index import NAME_LOOKUP_PARAMS, NAME_LOOKUP_SQL, build_search_index
+from staging import BuildStage, open_build_db, persist_build_db
+from tree_cache import build_tree_caches
+from tsf_parser import TSFDialect, load_all_placements, load_placements, synonym_type
 
 VERSION = "0.2.7"
 
@@ -77,33 +83,9 @@ DST_DIR = ROOT / "db"
 
 
 # ---------------------------------------------------------------------------
-# Source file parser (shared logic with trilobase)
+# Source file dialect (parser: tsf_parser.py)
 # ---------------------------------------------------------------------------
 
-def parse_source_header(text: str):
-    """Parse YAML-like header from a source file."""
-    if not text.startswith("---"):
-        return {}, text
-
-    end = text.index("---", 3)
-    header_text = text[3:end].strip()
-    body = text[end + 3:].strip()
-
-    header = {}
-    m = re.search(r'^reference:\s*(.+)$', header_text, re.MULTILINE)
-    if m:
-        header["reference"] = m.group(1).strip()
-
-    scopes = []
-    for sm in re.finditer(
-        r'-\s+taxon:\s*(\S+)\s+coverage:\s*(\S+)', header_text
-    ):
-        scopes.append({"taxon": sm.group(1), "coverage": sm.group(2)})
-    header["scope"] = scopes
-
-    return header, body
-
-
 RANK_KEYWORDS = {
     "Phylum", "Subphylum", "Class", "Order", "Suborder",
     "Superfamily", "Family", "Subfamily",
@@ -113,126 +95,7 @@ RANK_ORDER = {
     "Class": 0, "Order": 1, "Suborder": 2, "Superfamily": 3,
     "Family": 4, "Subfamily": 5, "Genus": 6,
 }
-
-
-def parse_hierarchy_body(body: str, default_leaf_rank="Genus"):
-    """Parse hierarchy body into list of placement records."""
-    placements = []
-    stack = []  # [(rank_order, name, rank)]
-
-    for raw_line in body.splitlines():
-        stripped = raw_line.strip()
-        if not stripped or stripped.startswith("#"):
-            continue
-
-        # Synonym lines
-        syn_match = re.match(r'^\s*(=|~)\s+(.+)$', stripped)
-        if syn_match and placements:
-            marker = syn_match.group(1)
-            syn_text = syn_match.group(2).strip()
-            predicate = "SYNONYM_OF" if marker == "=" else "SPELLING_OF"
-            sm = re.match(r'^(\S+)\s*\(([^)]+)\)$', syn_text)
-            if sm:
-                target = sm.group(1)
-                detail = sm.group(2)
-            else:
-                target = syn_text.split()[0] if syn_text else syn_text
-                detail = ""
-            placements[-1]["synonyms"].append({
-                "predicate": predicate,
-                "target": target,
-                "detail": detail,
-            })
-            continue
-
-        # Subgenus lines (e.g. "S. (Strophomena)") — skip
-        subgenus_match = re.match(r'^\s+\w+\.\s+\(', stripped)
-        if subgenus_match:
-            continue
-
-        # Status markers
-        status = "asserted"
-        line = stripped
-        if line.startswith("?"):
-            status = "questionable"
-            line = line[1:].strip()
-        if "[incertae sedis]" in line:
-            status = "incertae_sedis"
-            line = line.replace("[incertae sedis]", "").strip()
-
-        # Unassigned genera header — skip
-        if "UNASSIGNED" in line.upper() or "GENERA UNASSIGNED" in line.upper():
-            continue
-
-        # Determine rank
-        rank = None
-        has_explicit_rank = False
-        for kw in RANK_KEYWORDS:
-            if line.startswith(kw + " "):
-                rank = kw
-                has_explicit_rank = True
-                line = line[len(kw):].strip()
-                break
-
-        if rank is None:
-            rank = default_leaf_rank
-
-        # Parse name and authority; extract location and temporal_code from | fields
-        clean = re.sub(r'\[.*?\]', '', line).strip()
-        pipe_fields = clean.split("|")
-        clean = pipe_fields[0].strip()
-        location = pipe_fields[1].strip() if len(pipe_fields) > 1 else ""
-        temporal_code = pipe_fields[2].strip() if len(pipe_fields) > 2 else ""
-        # If only 2 fields, the second might be temporal_code (no location)
-        if len(pipe_fields) == 2 and re.match(r'^[A-Z]{2,}', pipe_fields[1].strip()):
-            temporal_code = pipe_fields[1].strip()
-            location = ""
-
-        parts = clean.split(None, 1)
-        if not parts:
-            continue
-        name = parts[0].strip()
-        authority_str = parts[1].strip() if len(parts) > 1 else ""
-
-        # Normalize ALL CAPS names (all ranks — source files use ALLCAPS for ranks)
-        if name == name.upper() and len(name) > 1:
-            name = name[0] + name[1:].lower()
-
-        # Parse author, year
-        author = ""
-        year = ""
-        if authority_str:
-            ym = re.search(r',?\s*(\d{4}[a-z]?)\s*$', authority_str)
-            if ym:
-                year = ym.group(1)
-                author = authority_str[:ym.start()].strip().rstrip(",")
-            else:
-                author = authority_str
-
-        # Parent from rank hierarchy
-        cur_order = RANK_ORDER.get(rank, 6)
-        while stack and stack[-1][0] >= cur_order:
-            stack.pop()
-
-        parent_name = stack[-1][1] if stack else None
-        parent_rank = stack[-1][2] if stack else None
-
-        stack.append((cur_order, name, rank))
-
-        placements.append({
-            "name": name,
-            "rank": rank,
-            "author": author,
-            "year": year,
-            "parent_name": parent_name,
-            "parent_rank": parent_rank,
-            "status": status,
-            "synonyms": [],
-            "location": location,
-            "temporal_code": temporal_code,
-        })
-
-    return placements
+TSF_DIALECT = TSFDialect(RANK_KEYWORDS, RANK_ORDER)
 
 
 # ---------------------------------------------------------------------------
@@ -320,7 +183,7 @@ def create_schema(cur):
 # Build
 # ---------------------------------------------------------------------------
 
-def resolve_taxon(name, rank, dst, taxon_index, new_taxa_cache):
+def resolve_taxon(name, rank, stage, taxon_index, new_taxa_cache):
     key = (name.lower(), rank.lower())
     if key in taxon_index:
         return taxon_index[key]
@@ -328,61 +191,41 @@ def resolve_taxon(name, rank, dst, taxon_index, new_taxa_cache):
         return new_taxa_cache[key]
 
     is_placeholder = 1 if name.lower() in ("uncertain", "unrecognizable") else 0
-    cur = dst.execute("""
-        INSERT INTO taxon (name, rank, is_placeholder, is_valid, created_at)
-        VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)
-    """, (name, rank, is_placeholder))
-    new_id = cur.lastrowid
+    new_id = stage.add_taxon(name, rank, is_placeholder)
     taxon_index[key] = new_id
     new_taxa_cache[key] = new_id
     return new_id
 
 
-def process_source(dst, source_file, ref_id, taxon_index, new_taxa_cache):
-    """Process source file, generating taxa, assertions, and edges."""
-    text = source_file.read_text(encoding="utf-8")
-    header, body = parse_source_header(text)
-    placements = parse_hierarchy_body(body, default_leaf_rank="Genus")
+def process_source(stage, placements, ref_id, taxon_index, new_taxa_cache):
+    """Process a source's placements, staging taxa and assertions; returns (counts, edges)."""
 
     edges = []
     counts = {"taxon": 0, "PLACED_IN": 0, "SYNONYM_OF": 0, "SPELLING_OF": 0}
     placed_children = set()
 
     for p in placements:
-        child_id = resolve_taxon(p["name"], p["rank"], dst, taxon_index, new_taxa_cache)
+        child_id = resolve_taxon(p["name"], p["rank"], stage, taxon_index, new_taxa_cache)
 
-        # Update author/year if we have them and the taxon doesn't yet
+        # Fill author/year if we have them and the taxon doesn't yet
         if p["author"] or p["year"]:
-            dst.execute("""
-                UPDATE taxon SET author = COALESCE(NULLIF(author, ''), ?),
-                                 year = COALESCE(NULLIF(year, ''), ?)
-                WHERE id = ? AND (author IS NULL OR author = '' OR year IS NULL OR year = '')
-            """, (p["author"], p["year"], child_id))
+            stage.fill(child_id, "author", p["author"])
+            stage.fill(child_id, "year", p["year"])
 
-        # Update temporal_code and location
+        # Fill temporal_code and location
         if p.get("temporal_code"):
-            dst.execute("UPDATE taxon SET temporal_code = ? WHERE id = ? AND (temporal_code IS NULL OR temporal_code = '')",
-                        (p["temporal_code"], child_id))
+            stage.fill(child_id, "temporal_code", p["temporal_code"])
         if p.get("location"):
-            dst.execute("UPDATE taxon SET location = ? WHERE id = ? AND (location IS NULL OR location = '')",
-                        (p["location"], child_id))
+            stage.fill(child_id, "location", p["location"])
 
-        # Type species from raw entry
-        ts_match = re.search(r'\[\*(.+?)\]', p.get("raw_entry", "") or "")
-        if ts_match:
-            dst.execute("UPDATE taxon SET type_species = ? WHERE id = ? AND type_species IS NULL",
-                        (ts_match.group(1), child_id))
+        # Type species
+        if p.get("type_species"):
+            stage.fill(child_id, "type_species", p["type_species"], blank=())
 
         if p["parent_name"] and child_id not in placed_children:
             parent_id = resolve_taxon(
-                p["parent_name"], p["parent_rank"], dst, taxon_index, new_taxa_cache)
-
-            dst.execute("""
-                INSERT OR IGNORE INTO assertion
-                    (subject_taxon_id, predicate, object_taxon_id,
-                     reference_id, assertion_status, curation_confidence)
-                VALUES (?, 'PLACED_IN', ?, ?, ?, 'high')
-            """, (child_id, parent_id, ref_id, p["status"]))
+                p["parent_name"], p["parent_rank"], stage, taxon_index, new_taxa_cache)
+            stage.add_assertion(child_id, "PLACED_IN", parent_id, ref_id, p["status"])
             counts["PLACED_IN"] += 1
             edges.append((child_id, parent_id))
             placed_children.add(child_id)
@@ -390,27 +233,18 @@ def process_source(dst, source_file, ref_id, taxon_index, new_taxa_cache):
         # Synonyms
         for syn in p["synonyms"]:
             target_id = resolve_taxon(
-                syn["target"], "Genus", dst, taxon_index, new_taxa_cache)
-            syn_type = ""
-            if syn["detail"]:
-                st_match = re.match(r'(j\.s\.s\.|j\.o\.s\.)', syn["detail"])
-                if st_match:
-                    syn_type = st_match.group(1)
+                syn["target"], "Genus", stage, taxon_index, new_taxa_cache)
+            syn_type = synonym_type(syn["detail"])
             pred = syn["predicate"]
-            dst.execute("""
-                INSERT OR IGNORE INTO assertion
-                    (subject_taxon_id, predicate, object_taxon_id,
-                     reference_id, assertion_status, curation_confidence,
-                     synonym_type, notes)
-                VALUES (?, ?, ?, ?, 'asserted', 'high', ?, ?)
-            """, (child_id, pred, target_id, ref_id, syn_type, syn["detail"]))
+            stage.add_assertion(child_id, pred, target_id, ref_id,
+                                synonym_type=syn_type, notes=syn["detail"])
             counts[pred] = counts.get(pred, 0) + 1
 
     counts["taxon"] = len(taxon_index) + len(new_taxa_cache)
     return counts, edges
 
 
-def load_classification_edges(cls_file: Path, conn, taxon_index: dict, new_taxa_cache: dict, ref_id: int):
+def load_classification_edges(cls_file: Path, stage, taxon_index: dict, new_taxa_cache: dict, ref_id: int):
     """Pre-load structural hierarchy from brachiopoda_classification.txt.
 
     Creates edges for all suprafamilial ranks (Phylum through Superfamily) so
@@ -423,9 +257,7 @@ def load_classification_edges(cls_file: Path, conn, taxon_index: dict, new_taxa_
         print(f"  Warning: classification file not found: {cls_file}", file=sys.stderr)
         return []
 
-    text = cls_file.read_text(encoding="utf-8")
-    _, body = parse_source_header(text)
-    placements = parse_hierarchy_body(body, default_leaf_rank="Genus")
+    placements = load_placements(cls_file, "Genus", TSF_DIALECT)
 
     edges = []
     placed = set()
@@ -434,20 +266,12 @@ def load_classification_edges(cls_file: Path, conn, taxon_index: dict, new_taxa_
             continue
         if p["rank"] == "Genus":
             continue
-        child_id = resolve_taxon(p["name"], p["rank"], conn, taxon_index, new_taxa_cache)
+        child_id = resolve_taxon(p["name"], p["rank"], stage, taxon_index, new_taxa_cache)
         if p.get("author") or p.get("year"):
-            conn.execute("""
-                UPDATE taxon SET author = COALESCE(NULLIF(author, ''), ?),
-                                 year = COALESCE(NULLIF(year, ''), ?)
-                WHERE id = ? AND (author IS NULL OR author = '' OR year IS NULL OR year = '')
-            """, (p["author"], p["year"], child_id))
-        parent_id = resolve_taxon(p["parent_name"], p["parent_rank"], conn, taxon_index, new_taxa_cache)
-        conn.execute("""
-            INSERT OR IGNORE INTO assertion
-                (subject_taxon_id, predicate, object_taxon_id,
-                 reference_id, assertion_status, curation_confidence)
-            VALUES (?, 'PLACED_IN', ?, ?, 'asserted', 'high')
-        """, (child_id, parent_id, ref_id))
+            stage.fill(child_id, "author", p["author"])
+            stage.fill(child_id, "year", p["year"])
+        parent_id = resolve_taxon(p["parent_name"], p["parent_rank"], stage, taxon_index, new_taxa_cache)
+        stage.add_assertion(child_id, "PLACED_IN", parent_id, ref_id)
         if child_id not in placed:
             edges.append((child_id, parent_id))
             placed.add(child_id)
@@ -518,32 +342,27 @@ def _build_queries():
          ")\n"
          "UNION ALL\n"
          "SELECT t.id, t.name, t.rank, e.parent_id, t.author\n"
-         "FROM taxon t\n"
-         "JOIN classification_edge_cache e ON e.child_id = t.id\n"
+         "FROM classification_edge_cache e\n"
+         "CROSS JOIN taxon t ON t.id = e.child_id\n"
          "WHERE e.profile_id = COALESCE(:profile_id, 1) AND t.rank != 'Genus'\n"
          "ORDER BY rank, name",
          '{"profile_id": "integer"}'),
 
         ("taxonomy_tree_genera_counts", "Count of genera per direct parent",
-         "SELECT e.parent_id, COUNT(*) AS genera_count\n"
-         "FROM classification_edge_cache e\n"
-         "JOIN taxon g ON g.id = e.child_id AND g.rank = 'Genus'\n"
-         "WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
-         "GROUP BY e.parent_id",
+         "SELECT s.taxon_id AS parent_id, s.direct_genera AS genera_count\n"
+         "FROM profile_node_stats s\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.direct_genera > 0\n"
+         "ORDER BY s.taxon_id",
          '{"profile_id": "integer"}'),
 
         ("family_genera", "Genera under a family/subfamily subtree",
-         "WITH RECURSIVE subtree AS (\n"
-         "    SELECT child_id FROM classification_edge_cache\n"
-         "    WHERE parent_id = :family_id AND profile_id = COALESCE(:profile_id, 1)\n"
-         "    UNION ALL\n"
-         "    SELECT e.child_id FROM classification_edge_cache e\n"
-         "    JOIN subtree s ON e.parent_id = s.child_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
-         ")\n"
          "SELECT t.id, t.name, t.author, t.year, t.type_species, t.location, t.is_valid\n"
-         "FROM taxon t JOIN subtree ON subtree.child_id = t.id\n"
-         "WHERE t.rank = 'Genus'\n"
+         "FROM profile_tree_index f\n"
+         "JOIN profile_tree_index d ON d.profile_id = f.profile_id\n"
+         "  AND d.lft BETWEEN f.lft + 1 AND f.rgt\n"
+         "JOIN taxon t ON t.id = d.taxon_id\n"
+         "WHERE f.profile_id = COALESCE(:profile_id, 1) AND f.taxon_id = :family_id\n"
+         "  AND t.rank = 'Genus'\n"
          "ORDER BY t.name",
          '{"family_id": "integer", "profile_id": "integer"}'),
 
@@ -579,31 +398,21 @@ def _build_queries():
 
         ("taxon_children", "Children of a taxon",
          "SELECT t.id, t.name, t.rank, t.author,\n"
-         "  (SELECT COUNT(*) FROM classification_edge_cache e2\n"
-         "   JOIN taxon g ON g.id = e2.child_id AND g.rank = 'Genus'\n"
-         "   WHERE e2.parent_id = t.id AND e2.profile_id = COALESCE(:profile_id, 1)\n"
-         "  ) AS genera_count\n"
+         "  COALESCE(s.direct_genera, 0) AS genera_count\n"
          "FROM taxon t\n"
          "JOIN classification_edge_cache e ON e.child_id = t.id\n"
+         "LEFT JOIN profile_node_stats s ON s.profile_id = e.profile_id AND s.taxon_id = t.id\n"
          "WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id = :taxon_id\n"
          "ORDER BY t.rank, t.name",
          '{"taxon_id": "integer", "profile_id": "integer"}'),
 
         ("genus_hierarchy", "Ancestor chain for a taxon",
-         "WITH RECURSIVE ancestors AS (\n"
-         "  SELECT t.id, t.name, t.rank, t.author, 0 as depth\n"
-         "  FROM classification_edge_cache e\n"
-         "  JOIN taxon t ON e.parent_id = t.id\n"
-         "  WHERE e.child_id = :taxon_id\n"
-         "    AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "  UNION ALL\n"
-         "  SELECT t.id, t.name, t.rank, t.author, anc.depth + 1\n"
-         "  FROM ancestors anc\n"
-         "  JOIN classification_edge_cache e ON e.child_id = anc.id\n"
-         "    AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "  JOIN taxon t ON e.parent_id = t.id\n"
-         ")\n"
-         "SELECT id, name, rank, author FROM ancestors ORDER BY depth DESC",
+         "SELECT t.id, t.name, t.rank, t.author\n"
+         "FROM classification_closure c\n"
+         "JOIN taxon t ON t.id = c.ancestor_id\n"
+         "WHERE c.profile_id = COALESCE(:profile_id, 1) AND c.descendant_id = :taxon_id\n"
+         "  AND c.depth > 0\n"
+         "ORDER BY c.depth DESC",
          '{"taxon_id": "integer", "profile_id": "integer"}'),
 
         ("assertion_list", "All assertions",
@@ -623,6 +432,30 @@ def _build_queries():
          "       reference_type\n"
          "FROM reference ORDER BY authors, year", None),
 
+        ("taxon_search", "Full-text taxon search (name, author, type species, locality, formation) ranked by bm25",
+         "SELECT t.id, t.name, t.rank, t.author, t.year, t.family, t.temporal_code, t.is_valid,\n"
+         "       bm25(taxon_fts, 10.0, 3.0, 1.0, 1.0, 1.0) AS score\n"
+         "FROM taxon_fts\n"
+         "JOIN taxon t ON t.id = taxon_fts.rowid\n"
+         "WHERE taxon_fts MATCH '\"' || replace(:q, '\"', '\"\"') || '\"'\n"
+         "  AND (:rank IS NULL OR t.rank = :rank)\n"
+         "ORDER BY score, t.name\n"
+         "LIMIT COALESCE(:limit, 50)",
+         '{"q": "text", "rank": "text", "limit": "integer"}'),
+
+        ("reference_search", "Full-text reference search (authors, title, journal) ranked by bm25",
+         "SELECT r.id, r.authors, r.year, r.year_suffix, r.title, r.journal,\n"
+         "       bm25(reference_fts, 3.0, 2.0, 1.0) AS score\n"
+         "FROM reference_fts\n"
+         "JOIN reference r ON r.id = reference_fts.rowid\n"
+         "WHERE reference_fts MATCH '\"' || replace(:q, '\"', '\"\"') || '\"'\n"
+         "ORDER BY score, r.authors, r.year\n"
+         "LIMIT COALESCE(:limit, 50)",
+         '{"q": "text", "limit": "integer"}'),
+
+        ("taxon_name_lookup", "Typo-tolerant taxon name lookup: closest names by edit distance (taxon_name_deletes)",
+         NAME_LOOKUP_SQL, NAME_LOOKUP_PARAMS),
+
         ("profile_list", "All classification profiles",
          "SELECT cp.id, cp.name, cp.description, cp.rule_json,\n"
          "       (SELECT COUNT(*) FROM classification_edge_cache ec WHERE ec.profile_id = cp.id) as edge_count,\n"
@@ -645,44 +478,20 @@ def _build_queries():
          '{"profile_id": "integer"}'),
 
         # --- Profile diff ---
-        ("profile_diff", "Compare edges between two classification profiles",
+        ("profile_diff", "Compare edges between two classification profiles (profile_diff_cache)",
          "SELECT\n"
-         "    COALESCE(a.child_id, b.child_id) AS taxon_id,\n"
+         "    d.child_id AS taxon_id,\n"
          "    t.name AS taxon_name,\n"
          "    t.rank AS taxon_rank,\n"
          "    pa.name AS parent_a,\n"
          "    pb.name AS parent_b,\n"
-         "    CASE\n"
-         "        WHEN b.child_id IS NULL THEN 'removed'\n"
-         "        WHEN a.child_id IS NULL THEN 'added'\n"
-         "        WHEN a.parent_id != b.parent_id THEN 'moved'\n"
-         "    END AS diff_status\n"
-         "FROM classification_edge_cache a\n"
-         "LEFT JOIN classification_edge_cache b\n"
-         "    ON a.child_id = b.child_id AND b.profile_id = :compare_profile_id\n"
-         "LEFT JOIN taxon t ON t.id = COALESCE(a.child_id, b.child_id)\n"
-         "LEFT JOIN taxon pa ON pa.id = a.parent_id\n"
-         "LEFT JOIN taxon pb ON pb.id = b.parent_id\n"
-         "WHERE a.profile_id = :profile_id\n"
-         "    AND (b.child_id IS NULL OR a.parent_id != b.parent_id)\n"
-         "\n"
-         "UNION ALL\n"
-         "\n"
-         "SELECT\n"
-         "    b.child_id AS taxon_id,\n"
-         "    t.name AS taxon_name,\n"
-         "    t.rank AS taxon_rank,\n"
-         "    NULL AS parent_a,\n"
-         "    pb.name AS parent_b,\n"
-         "    'added' AS diff_status\n"
-         "FROM classification_edge_cache b\n"
-         "LEFT JOIN classification_edge_cache a\n"
-         "    ON b.child_id = a.child_id AND a.profile_id = :profile_id\n"
-         "LEFT JOIN taxon t ON t.id = b.child_id\n"
-         "LEFT JOIN taxon pb ON pb.id = b.parent_id\n"
-         "WHERE b.profile_id = :compare_profile_id\n"
-         "    AND a.child_id IS NULL\n"
-         "\n"
+         "    d.diff_status\n"
+         "FROM profile_diff_cache d\n"
+         "LEFT JOIN taxon t ON t.id = d.child_id\n"
+         "LEFT JOIN taxon pa ON pa.id = d.parent_a\n"
+         "LEFT JOIN taxon pb ON pb.id = d.parent_b\n"
+         "WHERE d.profile_a = COALESCE(:profile_id, 0) AND d.profile_b = COALESCE(:compare_profile_id, 0)\n"
+         "    AND d.diff_status != 'same'\n"
          "ORDER BY diff_status, taxon_rank, taxon_name",
          '{"profile_id": "integer", "compare_profile_id": "integer"}'),
 
@@ -703,55 +512,64 @@ def _build_queries():
 
         ("timeline_publication_years", "Distinct genus naming years for timeline axis",
          "SELECT DISTINCT CAST(t.year AS INTEGER) AS year, CAST(t.year AS INTEGER) AS label\n"
-         "FROM taxon t\n"
-         "JOIN classification_edge_cache e ON e.child_id = t.id\n"
-         "  AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "WHERE t.rank = 'Genus' AND t.year IS NOT NULL\n"
+         "FROM classification_edge_cache e\n"
+         "CROSS JOIN taxon t ON t.id = e.child_id\n"
+         "WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
+         "  AND t.rank = 'Genus' AND t.year IS NOT NULL\n"
          "ORDER BY year",
          '{"profile_id": "integer"}'),
 
-        ("taxonomy_tree_by_geologic", "Taxa filtered by geologic time (Mya snapshot)",
-         "WITH RECURSIVE filtered_genera AS (\n"
-         "    SELECT t.id\n"
-         "    FROM taxon t\n"
-         "    JOIN classification_edge_cache e ON e.child_id = t.id AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "    WHERE t.rank = 'Genus'\n"
-         "    AND (:timeline_value IS NULL OR t.temporal_code IN (\n"
+        ("taxonomy_tree_by_geologic", "Taxa at a geologic timeline stop (timeline_snapshot_nodes)",
+         "WITH ancestors AS (\n"
+         "    -- fallback for values that are not timeline_geologic_periods stops\n"
+         "    SELECT DISTINCT c.ancestor_id AS taxon_id\n"
+         "    FROM classification_edge_cache e\n"
+         "    CROSS JOIN taxon g ON g.id = e.child_id\n"
+         "    CROSS JOIN classification_closure c\n"
+         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND NOT EXISTS (\n"
+         "        SELECT 1 FROM timeline_snapshot_nodes s\n"
+         "        WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.stop_mya IS :timeline_value\n"
+         "    )\n"
+         "    AND g.rank = 'Genus'\n"
+         "    AND g.temporal_code IN (\n"
          "        SELECT tr.code FROM temporal_code_mya tr\n"
          "        WHERE tr.fad_mya >= :timeline_value AND tr.lad_mya <= :timeline_value\n"
-         "    ))\n"
-         "), ancestors AS (\n"
-         "    SELECT id AS taxon_id FROM filtered_genera\n"
-         "    UNION\n"
-         "    SELECT e.parent_id\n"
-         "    FROM classification_edge_cache e\n"
-         "    JOIN ancestors a ON e.child_id = a.taxon_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id IS NOT NULL\n"
+         "    )\n"
+         "    AND c.profile_id = e.profile_id AND c.descendant_id = g.id\n"
          ")\n"
          "SELECT t.id, t.name, t.rank, t.author, t.year, t.temporal_code, t.is_valid\n"
+         "FROM timeline_snapshot_nodes s\n"
+         "JOIN taxon t ON t.id = s.taxon_id\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.stop_mya IS :timeline_value\n"
+         "UNION ALL\n"
+         "SELECT t.id, t.name, t.rank, t.author, t.year, t.temporal_code, t.is_valid\n"
          "FROM taxon t\n"
          "WHERE t.id IN (SELECT taxon_id FROM ancestors)\n"
-         "ORDER BY t.id",
+         "ORDER BY id",
          '{"profile_id": "integer", "timeline_value": "real"}'),
 
-        ("tree_edges_by_geologic", "Edges filtered by geologic time (Mya snapshot)",
-         "WITH RECURSIVE filtered_genera AS (\n"
-         "    SELECT t.id\n"
-         "    FROM taxon t\n"
-         "    JOIN classification_edge_cache e ON e.child_id = t.id AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "    WHERE t.rank = 'Genus'\n"
-         "    AND (:timeline_value IS NULL OR t.temporal_code IN (\n"
+        ("tree_edges_by_geologic", "Edges at a geologic timeline stop (timeline_snapshot_edges)",
+         "WITH ancestors AS (\n"
+         "    -- fallback for values that are not timeline_geologic_periods stops\n"
+         "    SELECT DISTINCT c.ancestor_id AS taxon_id\n"
+         "    FROM classification_edge_cache e\n"
+         "    CROSS JOIN taxon g ON g.id = e.child_id\n"
+         "    CROSS JOIN classification_closure c\n"
+         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND NOT EXISTS (\n"
+         "        SELECT 1 FROM timeline_snapshot_nodes s\n"
+         "        WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.stop_mya IS :timeline_value\n"
+         "    )\n"
+         "    AND g.rank = 'Genus'\n"
+         "    AND g.temporal_code IN (\n"
          "        SELECT tr.code FROM temporal_code_mya tr\n"
          "        WHERE tr.fad_mya >= :timeline_value AND tr.lad_mya <= :timeline_value\n"
-         "    ))\n"
-         "), ancestors AS (\n"
-         "    SELECT id AS taxon_id FROM filtered_genera\n"
-         "    UNION\n"
-         "    SELECT e.parent_id\n"
-         "    FROM classification_edge_cache e\n"
-         "    JOIN ancestors a ON e.child_id = a.taxon_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id IS NOT NULL\n"
+         "    )\n"
+         "    AND c.profile_id = e.profile_id AND c.descendant_id = g.id\n"
          ")\n"
+         "SELECT s.child_id, s.parent_id\n"
+         "FROM timeline_snapshot_edges s\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.stop_mya IS :timeline_value\n"
+         "UNION ALL\n"
          "SELECT e.child_id, e.parent_id\n"
          "FROM classification_edge_cache e\n"
          "WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
@@ -759,113 +577,83 @@ def _build_queries():
          "AND e.parent_id IN (SELECT taxon_id FROM ancestors)",
          '{"profile_id": "integer", "timeline_value": "real"}'),
 
-        ("taxonomy_tree_by_pubyear", "Taxa filtered by naming year (cumulative)",
-         "WITH RECURSIVE filtered_genera AS (\n"
-         "    SELECT t.id\n"
-         "    FROM taxon t\n"
-         "    JOIN classification_edge_cache e ON e.child_id = t.id AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "    WHERE t.rank = 'Genus'\n"
-         "    AND (:timeline_value IS NULL OR (t.year IS NOT NULL AND CAST(t.year AS INTEGER) <= :timeline_value))\n"
-         "), ancestors AS (\n"
-         "    SELECT id AS taxon_id FROM filtered_genera\n"
-         "    UNION\n"
-         "    SELECT e.parent_id\n"
-         "    FROM classification_edge_cache e\n"
-         "    JOIN ancestors a ON e.child_id = a.taxon_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id IS NOT NULL\n"
-         ")\n"
+        ("taxonomy_tree_by_pubyear", "Taxa named by a given year (cumulative, via min_desc_year)",
          "SELECT t.id, t.name, t.rank, t.author, t.year, t.temporal_code, t.is_valid\n"
-         "FROM taxon t\n"
-         "WHERE t.id IN (SELECT taxon_id FROM ancestors)\n"
-         "ORDER BY t.id",
+         "FROM profile_node_stats s\n"
+         "JOIN taxon t ON t.id = s.taxon_id\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.min_desc_year <= :timeline_value\n"
+         "UNION ALL\n"
+         "-- no year filter: every genus of the profile plus its ancestors\n"
+         "SELECT t.id, t.name, t.rank, t.author, t.year, t.temporal_code, t.is_valid\n"
+         "FROM profile_node_stats s\n"
+         "CROSS JOIN taxon t ON t.id = s.taxon_id\n"
+         "WHERE :timeline_value IS NULL AND s.profile_id = COALESCE(:profile_id, 1)\n"
+         "  AND (s.total_genera > 0 OR t.rank = 'Genus')\n"
+         "ORDER BY id",
          '{"profile_id": "integer", "timeline_value": "integer"}'),
 
-        ("tree_edges_by_pubyear", "Edges filtered by naming year (cumulative)",
-         "WITH RECURSIVE filtered_genera AS (\n"
-         "    SELECT t.id\n"
-         "    FROM taxon t\n"
-         "    JOIN classification_edge_cache e ON e.child_id = t.id AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "    WHERE t.rank = 'Genus'\n"
-         "    AND (:timeline_value IS NULL OR (t.year IS NOT NULL AND CAST(t.year AS INTEGER) <= :timeline_value))\n"
-         "), ancestors AS (\n"
-         "    SELECT id AS taxon_id FROM filtered_genera\n"
-         "    UNION\n"
-         "    SELECT e.parent_id\n"
-         "    FROM classification_edge_cache e\n"
-         "    JOIN ancestors a ON e.child_id = a.taxon_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id IS NOT NULL\n"
-         ")\n"
+        ("tree_edges_by_pubyear", "Edges present by a given naming year (cumulative, via min_desc_year)",
          "SELECT e.child_id, e.parent_id\n"
-         "FROM classification_edge_cache e\n"
-         "WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
-         "AND e.child_id IN (SELECT taxon_id FROM ancestors)\n"
-         "AND e.parent_id IN (SELECT taxon_id FROM ancestors)",
+         "FROM profile_node_stats s\n"
+         "JOIN classification_edge_cache e ON e.profile_id = s.profile_id AND e.child_id = s.taxon_id\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.min_desc_year <= :timeline_value\n"
+         "  AND e.parent_id IS NOT NULL\n"
+         "UNION ALL\n"
+         "SELECT e.child_id, e.parent_id\n"
+         "FROM profile_node_stats s\n"
+         "CROSS JOIN taxon t ON t.id = s.taxon_id\n"
+         "JOIN classification_edge_cache e ON e.profile_id = s.profile_id AND e.child_id = s.taxon_id\n"
+         "WHERE :timeline_value IS NULL AND s.profile_id = COALESCE(:profile_id, 1)\n"
+         "  AND (s.total_genera > 0 OR t.rank = 'Genus') AND e.parent_id IS NOT NULL",
          '{"profile_id": "integer", "timeline_value": "integer"}'),
 
-        ("profile_diff_edges", "Diff edges: base profile structure with change status vs compare",
-         "SELECT\n"
-         "    a.child_id,\n"
-         "    a.parent_id,\n"
-         "    a.parent_id AS parent_id_a,\n"
-         "    b.parent_id AS parent_id_b,\n"
-         "    CASE\n"
-         "        WHEN b.child_id IS NULL THEN 'removed'\n"
-         "        WHEN a.parent_id != b.parent_id THEN 'moved'\n"
-         "        ELSE 'same'\n"
-         "    END AS diff_status\n"
-         "FROM classification_edge_cache a\n"
-         "LEFT JOIN classification_edge_cache b\n"
-         "    ON a.child_id = b.child_id AND b.profile_id = :compare_profile_id\n"
-         "WHERE a.profile_id = :profile_id\n"
-         "\n"
-         "UNION ALL\n"
-         "\n"
+        ("timeline_frames", "Frame list for a timeline axis ('geologic' or 'pubyear') with tree sizes",
+         "SELECT f.frame, f.stop_value, f.n_nodes, f.n_edges\n"
+         "FROM timeline_frames f\n"
+         "WHERE f.profile_id = COALESCE(:profile_id, 1) AND f.axis = :axis\n"
+         "ORDER BY f.frame",
+         '{"profile_id": "integer", "axis": "text"}'),
+
+        ("timeline_node_delta", "Taxa added/removed going from frame - 1 to frame (invert ops to step back)",
+         "SELECT t.id, d.op, t.name, t.rank, t.author, t.year, t.temporal_code, t.is_valid\n"
+         "FROM timeline_node_deltas d\n"
+         "JOIN taxon t ON t.id = d.taxon_id\n"
+         "WHERE d.profile_id = COALESCE(:profile_id, 1) AND d.axis = :axis AND d.frame = :frame\n"
+         "ORDER BY d.op, t.id",
+         '{"profile_id": "integer", "axis": "text", "frame": "integer"}'),
+
+        ("timeline_edge_delta", "Edges added/removed going from frame - 1 to frame (invert ops to step back)",
+         "SELECT d.child_id, d.parent_id, d.op\n"
+         "FROM timeline_edge_deltas d\n"
+         "WHERE d.profile_id = COALESCE(:profile_id, 1) AND d.axis = :axis AND d.frame = :frame\n"
+         "ORDER BY d.op, d.child_id",
+         '{"profile_id": "integer", "axis": "text", "frame": "integer"}'),
+
+        ("profile_diff_edges", "Diff edges: base profile structure with change status vs compare (profile_diff_cache)",
          "SELECT\n"
-         "    b.child_id,\n"
-         "    b.parent_id,\n"
-         "    NULL AS parent_id_a,\n"
-         "    b.parent_id AS parent_id_b,\n"
-         "    'added' AS diff_status\n"
-         "FROM classification_edge_cache b\n"
-         "LEFT JOIN classification_edge_cache a\n"
-         "    ON b.child_id = a.child_id AND a.profile_id = :profile_id\n"
-         "WHERE b.profile_id = :compare_profile_id\n"
-         "    AND a.child_id IS NULL",
+         "    d.child_id,\n"
+         "    CASE WHEN d.diff_status = 'added' THEN d.parent_b ELSE d.parent_a END AS parent_id,\n"
+         "    d.parent_a AS parent_id_a,\n"
+         "    d.parent_b AS parent_id_b,\n"
+         "    d.diff_status\n"
+         "FROM profile_diff_cache d\n"
+         "WHERE d.profile_a = COALESCE(:profile_id, 0) AND d.profile_b = COALESCE(:compare_profile_id, 0)",
          '{"profile_id": "integer", "compare_profile_id": "integer"}'),
 
         ("diversity_by_age", "Genus count per temporal code grouped by a parent rank",
-         "WITH RECURSIVE ancestors AS (\n"
-         "    SELECT e.child_id AS genus_id, e.parent_id AS ancestor_id\n"
-         "    FROM classification_edge_cache e\n"
-         "    JOIN taxon t ON t.id = e.child_id AND t.rank = 'Genus'\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
-         "    UNION ALL\n"
-         "    SELECT a.genus_id, e.parent_id\n"
-         "    FROM ancestors a\n"
-         "    JOIN classification_edge_cache e ON e.child_id = a.ancestor_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
-         "),\n"
-         "genus_group AS (\n"
-         "    SELECT a.genus_id, grp.name AS group_name\n"
-         "    FROM ancestors a\n"
-         "    JOIN taxon grp ON grp.id = a.ancestor_id AND grp.rank = :grouping_rank\n"
-         ")\n"
-         "SELECT tcm.code AS age_label, -tcm.fad_mya AS age_order,\n"
-         "       COALESCE(gg.group_name, 'Unknown') AS group_name,\n"
-         "       COUNT(DISTINCT g.id) AS count\n"
-         "FROM taxon g\n"
-         "JOIN classification_edge_cache ge ON ge.child_id = g.id\n"
-         "  AND ge.profile_id = COALESCE(:profile_id, 1)\n"
-         "JOIN temporal_code_mya tcm ON g.temporal_code = tcm.code\n"
-         "LEFT JOIN genus_group gg ON gg.genus_id = g.id\n"
-         "WHERE g.rank = 'Genus' AND g.is_valid = 1\n"
-         "  AND tcm.code IN ('LCAM','MCAM','UCAM','LORD','MORD','UORD',\n"
-         "                    'LSIL','USIL','LDEV','MDEV','UDEV',\n"
-         "                    'MISS','PENN','LPERM','UPERM',\n"
-         "                    'LTRI','MTRI','UTRI','LJUR','MJUR','UJUR',\n"
-         "                    'LCRET','UCRET','TERT','HOL')\n"
-         "GROUP BY tcm.code, gg.group_name\n"
-         "HAVING count > 0\n"
+         "SELECT d.temporal_code AS age_label, d.age_order,\n"
+         "       d.group_name, SUM(d.genus_count) AS count\n"
+         "FROM diversity_cube d\n"
+         "WHERE d.profile_id = COALESCE(:profile_id, 1)\n"
+         "  AND d.grouping_rank = COALESCE((SELECT grouping_rank FROM diversity_cube\n"
+         "                                  WHERE profile_id = COALESCE(:profile_id, 1)\n"
+         "                                    AND grouping_rank = :grouping_rank LIMIT 1), '')\n"
+         "  AND d.temporal_code IN ('LCAM','MCAM','UCAM','LORD','MORD','UORD',\n"
+         "                           'LSIL','USIL','LDEV','MDEV','UDEV',\n"
+         "                           'MISS','PENN','LPERM','UPERM',\n"
+         "                           'LTRI','MTRI','UTRI','LJUR','MJUR','UJUR',\n"
+         "                           'LCRET','UCRET','TERT','HOL')\n"
+         "GROUP BY d.temporal_code, d.group_name\n"
          "ORDER BY age_order, count DESC",
          '{"profile_id": "integer", "grouping_rank": "text"}'),
     ]
@@ -1382,6 +1170,20 @@ def write_scoda_metadata(cur, version, ref_id):
         ("reference", None, "Literature references"),
         ("classification_profile", None, "Named classification profiles"),
         ("classification_edge_cache", None, "Pre-computed parent-child edges per profile"),
+        ("classification_closure", None, "Transitive closure of the edge cache: ancestor, descendant, depth per profile"),
+        ("profile_tree_index", None, "Nested-set numbering (lft, rgt, depth) per profile; subtree = lft range"),
+        ("profile_node_stats", None, "Per-node genus counts (direct, subtree, valid) and child rank counts per profile"),
+        ("profile_node_stats", "min_desc_year", "Earliest descendant genus naming year; tree as of year Y = min_desc_year <= Y"),
+        ("diversity_cube", None, "Pre-aggregated genus counts per profile, grouping rank, temporal code and group"),
+        ("profile_diff_cache", None, "Edge diff status per child for every ordered profile pair"),
+        ("timeline_snapshot_nodes", None, "Taxa shown at each geologic timeline stop per profile; NULL stop = full tree"),
+        ("timeline_snapshot_edges", None, "Edges shown at each geologic timeline stop per profile"),
+        ("timeline_frames", None, "Timeline frames per profile and axis (geologic, pubyear) with tree sizes"),
+        ("timeline_node_deltas", None, "Per-frame taxon additions/removals vs the previous timeline frame"),
+        ("timeline_edge_deltas", None, "Per-frame edge additions/removals vs the previous timeline frame"),
+        ("taxon_fts", None, "FTS5 trigram index over taxon name, author, type_species, location, formation"),
+        ("reference_fts", None, "FTS5 trigram index over reference authors, title, journal"),
+        ("taxon_name_deletes", None, "Lower-cased taxon names with up to one character deleted (typo-tolerant lookup keys)"),
     ]
     cur.executemany(
         "INSERT INTO schema_descriptions (table_name, column_name, description) VALUES (?,?,?)",
@@ -1475,7 +1277,19 @@ def write_scoda_metadata(cur, version, ref_id):
 def main():
     parser = argparse.ArgumentParser(description='Build brachiopoda DB from source')
     parser.add_argument('--version', default=VERSION, help=f'Version (default: {VERSION})')
+    parser.add_argument('--merge-threshold', type=float, default=None,
+                        help='Auto-merge near-duplicate taxon names scoring at or above '
+                             'this similarity (0-1); default: report only')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Keep the previous DB of this version if none of its inputs '
+                             'changed')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Source files parsed in parallel (default: CPU count)')
+    parser.add_argument('--profile', nargs='?', const='all', choices=BuildProfiler.MODES,
+                        help='Write per-phase wall/CPU/peak memory and per-statement SQL '
+                             'timings next to the DB; --profile=time skips tracemalloc')
     args = parser.parse_args()
+    prof = BuildProfiler("brachiopoda", args.profile)
 
     version = args.version
     dst_path = DST_DIR / f"brachiopoda-{version}.db"
@@ -1488,22 +1302,33 @@ def main():
                 print(f"Error: Source file not found: {src_path}", file=sys.stderr)
                 sys.exit(1)
 
-    # Clean slate
-    if dst_path.exists():
-        dst_path.unlink()
+    # Inputs recorded in build_state: sources per profile, build code, options
+    # (profile 2 also pre-loads the suprafamilial classification file)
+    inputs = build_inputs(__file__, {
+        pi: [SOURCES / s for s in profile["sources"]]
+        + ([SOURCES / "brachiopoda_classification.txt"] if pi == 2 else [])
+        for pi, profile in enumerate(PROFILES, 1)},
+        options={"merge_threshold": args.merge_threshold})
+    if args.incremental and stale_profiles(read_build_state(dst_path), inputs) == set():
+        print(f"brachiopoda v{version} is up to date: {dst_path}")
+        return
 
     DST_DIR.mkdir(parents=True, exist_ok=True)
 
     print(f"Building brachiopoda v{version}")
     print(f"  Output: {dst_path}")
     print(f"  Profiles: {len(PROFILES)}")
+    if args.incremental:
+        print("  Incremental: inputs changed or no build_state, building from scratch")
 
-    conn = sqlite3.connect(str(dst_path))
+    # Built in memory; written to dst_path once the build has succeeded
+    conn = open_build_db()
+    prof.attach(conn)
     cur = conn.cursor()
-    cur.execute("PRAGMA journal_mode=WAL")
     cur.execute("PRAGMA foreign_keys=ON")
 
     # Phase 1: Schema
+    prof.phase("[1/5] schema")
     print("\n[1/5] Creating schema...")
     create_schema(cur)
     conn.commit()
@@ -1511,10 +1336,12 @@ def main():
     # Shared taxon index across all profiles (taxa are shared, edges differ)
     taxon_index = {}
     all_ref_ids = []
+    stage = BuildStage(conn)
 
     # Phase 2-3: Process each profile
     for pi, profile in enumerate(PROFILES, 1):
         profile_name = profile["name"]
+        prof.phase(f"[2/5] profile {pi} reference")
         print(f"\n[2/5] Profile {pi}: {profile_name}")
 
         # Insert reference
@@ -1530,6 +1357,7 @@ def main():
         print(f"  Reference id: {ref_id}")
 
         # Process source files for this profile
+        prof.phase(f"[3/5] profile {pi} sources")
         print(f"[3/5] Processing {len(profile['sources'])} source files...")
         all_edges = []
         total_counts = {"PLACED_IN": 0, "SYNONYM_OF": 0, "SPELLING_OF": 0}
@@ -1540,26 +1368,28 @@ def main():
         if pi == 2:
             cls_file = SOURCES / "brachiopoda_classification.txt"
             print(f"  Pre-loading classification from {cls_file.name}...")
-            cls_edges = load_classification_edges(cls_file, conn, taxon_index, new_taxa_cache, ref_id)
+            cls_edges = load_classification_edges(cls_file, stage, taxon_index, new_taxa_cache, ref_id)
             all_edges.extend(cls_edges)
-            conn.commit()
             print(f"  → {len(cls_edges)} structural edges loaded")
 
-        for src_name in profile["sources"]:
-            src_path = SOURCES / src_name
+        # Volumes are parsed in parallel; the merge below stays serial, in source order
+        parsed = load_all_placements([SOURCES / s for s in profile["sources"]],
+                                     "Genus", TSF_DIALECT, jobs=args.jobs)
+        for src_name, placements in zip(profile["sources"], parsed):
             print(f"  {src_name}...", end=" ", flush=True)
             counts, edges = process_source(
-                conn, src_path, ref_id, taxon_index, new_taxa_cache)
-            conn.commit()
+                stage, placements, ref_id, taxon_index, new_taxa_cache)
             all_edges.extend(edges)
             for k in total_counts:
                 total_counts[k] += counts.get(k, 0)
             print(f"({counts['PLACED_IN']} placements)")
+        stage.flush()
 
         # Merge new_taxa_cache into taxon_index
         taxon_index.update(new_taxa_cache)
 
         # Build classification profile
+        prof.phase(f"[4/5] profile {pi} classification")
         print(f"[4/5] Building classification profile {pi}...")
         cur.execute("""
             INSERT INTO classification_profile (name, description, rule_json)
@@ -1577,7 +1407,8 @@ def main():
         conn.commit()
 
         # Bridge orphan roots to Phylum BRACHIOPODA
-        phylum_id = resolve_taxon("BRACHIOPODA", "Phylum", conn, taxon_index, new_taxa_cache)
+        phylum_id = resolve_taxon("BRACHIOPODA", "Phylum", stage, taxon_index, new_taxa_cache)
+        stage.flush()
         taxon_index.update(new_taxa_cache)
         orphan_roots = conn.execute("""
             SELECT DISTINCT e.parent_id, t.name, t.rank
@@ -1611,6 +1442,7 @@ def main():
               f"SYNONYM_OF: {total_counts['SYNONYM_OF']}")
 
     # Phase 5: Views + SCODA metadata
+    prof.phase("[5/5] views")
     total_taxa = conn.execute("SELECT COUNT(*) FROM taxon").fetchone()[0]
     total_assertions = conn.execute("SELECT COUNT(*) FROM assertion").fetchone()[0]
 
@@ -1618,6 +1450,7 @@ def main():
     create_views(cur)
 
     # Build temporal_code_mya mapping table
+    prof.phase("[5/5] temporal_code_mya")
     print("  Building temporal_code_mya table...")
     pc_db = Path(find_paleocore_db())
     conn.execute(f"ATTACH DATABASE '{pc_db}' AS pc")
@@ -1645,8 +1478,44 @@ def main():
     conn.commit()
     print(f"  → {n_tcm} temporal_code_mya mappings")
 
+    # Fuzzy name reconciliation (OCR / spelling-variant duplicates)
+    prof.phase("[5/5] reconcile names")
+    print("  Reconciling taxon names...")
+    rec = reconcile_taxa(conn, merge_threshold=args.merge_threshold,
+                         report_path=dst_path.with_suffix(".reconcile.json"))
+    print(f"  → {rec['candidates']} near-duplicate pairs "
+          f"({rec['merged']} merged, {rec['review']} for review)")
+
+    # Materialized tree caches (read by ui_queries instead of recursive CTEs)
+    prof.phase("[5/5] tree caches")
+    print("  Building tree caches...")
+    for tbl, cnt in build_tree_caches(conn, _build_queries()).items():
+        print(f"  → {tbl}: {cnt}")
+
+    # Full-text search indexes (read by taxon_search / reference_search)
+    prof.phase("[5/5] search indexes")
+    print("  Building search indexes...")
+    for tbl, cnt in build_search_index(conn).items():
+        print(f"  → {tbl}: {cnt}")
+
+    prof.phase("[5/5] scoda metadata")
     write_scoda_metadata(cur, version, all_ref_ids[0])
-    conn.commit()
+    write_build_state(conn, inputs)
+
+    # Index policy + EXPLAIN QUERY PLAN audit (fails the build on table scans)
+    prof.phase("[5/5] query plans")
+    print("  Checking ui_queries plans...")
+    try:
+        check_query_plans(conn, attach={"pc": find_paleocore_db()})
+    except QueryPlanError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    prof.phase("persist")
+    persist_build_db(conn, dst_path)
+    if args.profile:
+        for report in prof.write(dst_path):
+            print(f"  Profile: {report}")
 
     # Summary
     rank_counts = conn.execute(
@@ -19,7 +19,9 @@ import sys
 from datetime import date, datetime, timezone
 
 
+from build_profiler import BuildProfiler
 from db_path import find_trilobita_db
+from index_advisor import QueryPlanError, check_query_plans
 
 SOURCE_DB = find_trilobita_db()
 DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), '..', 'db', 'paleocore.db')
@@ -941,8 +943,12 @@ def check_source_tables(source_db):
     return missing
 
 
-def create_paleocore(source_db, output_path):
-    """Create paleocore.db from source trilobita.db."""
+def create_paleocore(source_db, output_path, profile=None):
+    """Create paleocore.db from source trilobita.db.
+
+    profile: BuildProfiler mode (see build_profiler); None = no profiling.
+    """
+    prof = BuildProfiler("paleocore", profile)
     # Check source tables exist
     missing = check_source_tables(source_db)
     if missing:
@@ -960,9 +966,12 @@ def create_paleocore(source_db, output_path):
 
     src_conn = sqlite3.connect(source_db)
     dst_conn = sqlite3.connect(output_path)
+    prof.attach(src_conn)
+    prof.attach(dst_conn)
 
     # 1. Create data tables and copy data (FK off during bulk insert)
     dst_conn.execute("PRAGMA foreign_keys = OFF")
+    prof.phase("1. data tables")
     print("Creating data tables...")
     total_records = 0
     for table in DATA_TABLES:
@@ -982,6 +991,7 @@ def create_paleocore(source_db, output_path):
     dst_conn.execute("PRAGMA foreign_keys = ON")
 
     # 2. Create SCODA metadata tables
+    prof.phase("2. scoda metadata")
     print("\nCreating SCODA metadata tables...")
     create_scoda_tables(dst_conn)
 
@@ -1005,7 +1015,16 @@ def create_paleocore(source_db, output_path):
 
     dst_conn.commit()
 
+    # Index policy + EXPLAIN QUERY PLAN audit (fails the build on table scans)
+    prof.phase("2. query plans")
+    try:
+        check_query_plans(dst_conn)
+    except QueryPlanError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
     # 3. Verify
+    prof.phase("3. verify")
     print("\nVerification:")
     for table in DATA_TABLES:
         src_count = src_conn.execute(
@@ -1023,6 +1042,7 @@ def create_paleocore(source_db, output_path):
         has_taxa = 'taxa_count' in cols
         print(f"    {table}: {'FAIL (taxa_count present)' if has_taxa else 'OK (removed)'}")
 
+    prof.finish()
     src_conn.close()
     dst_conn.close()
 
@@ -1030,6 +1050,9 @@ def create_paleocore(source_db, output_path):
     print(f"\nCreated: {output_path}")
     print(f"  Size: {size:,} bytes ({size / 1024:.0f} KB)")
     print(f"  Total data records: {total_records:,}")
+    if profile:
+        for report in prof.write(output_path):
+            print(f"  Profile: {report}")
 
 
 def main():
@@ -1044,6 +1067,10 @@ def main():
     parser.add_argument(
         '--dry-run', action='store_true',
         help='Preview without creating file')
+    parser.add_argument(
+        '--profile', nargs='?', const='all', choices=BuildProfiler.MODES,
+        help='Write per-phase wall/CPU/peak memory and per-statement SQL timings '
+             'next to the output; --profile=time skips tracemalloc')
     args = parser.parse_args()
 
     source_db = os.path.abspath(args.source)
@@ -1056,7 +1083,7 @@ def main():
     if args.dry_run:
         dry_run(source_db)
     else:
-        create_paleocore(source_db, output_path)
+        create_paleocore(source_db, output_path, args.profile)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,228 @@
+"""
+Phase- and statement-level profiling for the package builders (--profile).
+
+A builder creates one BuildProfiler, attaches its SQLite connection(s) and
+marks each numbered phase with phase(name); a mark closes the running phase
+and opens the next, so the phases tile the build.  Per phase it records
+
+  - wall time (perf_counter) and CPU time (process_time, plus the CPU of
+    reaped child processes such as the parallel TSF parser workers),
+  - the tracemalloc peak of the Python heap (SQLite's own page cache is
+    allocated outside tracemalloc and is not included),
+  - every SQL statement run on an attached connection, normalized (literals
+    -> ?, whitespace collapsed) and aggregated: calls, seconds, VM steps.
+
+Statement timing uses set_trace_callback() to see a statement start and
+set_progress_handler() to tick every PROGRESS_STEPS virtual-machine
+instructions; a statement's time runs from its start to its last tick, so
+statements shorter than PROGRESS_STEPS instructions count calls but ~0 s.
+
+write() stores the report next to the DB:
+  <db>.profile.json    phases with their top statements
+  <db>.profile.folded  collapsed stacks (build;phase;statement microseconds)
+                       for flamegraph.pl / speedscope / inferno
+
+tracemalloc slows Python-heavy phases several-fold (SQLite work is not
+affected), which skews the wall/CPU split between phases; mode "time"
+(--profile=time) leaves it off for timings close to a plain build.  With
+mode None every method is a no-op, so builders call it unconditionally.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import time
+import tracemalloc
+from pathlib import Path
+
+# VM instructions between progress-handler ticks
+PROGRESS_STEPS = 1000
+
+# Statements kept per phase in the JSON report (the folded file has all)
+TOP_STATEMENTS = 25
+
+_STRING = re.compile(r"'(?:[^']|'')*'|[xX]'[0-9a-fA-F]*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_ROWS = re.compile(r"\(\?(?:, \.\.\.)?\)(?:\s*,\s*\(\?(?:, \.\.\.)?\))+")
+_SPACE = re.compile(r"\s+")
+_DIGITS = str.maketrans("", "", "0123456789")
+
+
+def normalize_sql(sql):
+    """SQL text with literals replaced by ? and value lists collapsed."""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _SPACE.sub(" ", sql).strip()
+    sql = _LIST.sub("?, ...", sql)
+    return _ROWS.sub("(?, ...), ...", sql)
+
+
+def _shape(sql):
+    """Cheap grouping key for normalize_sql(): sql minus string literals and digits."""
+    return "?".join(sql.split("'")[::2]).translate(_DIGITS)
+
+
+def _children_cpu():
+    t = os.times()
+    return t.children_user + t.children_system
+
+
+class BuildProfiler:
+    """Per-phase wall/CPU/memory and per-statement SQLite timings of a build."""
+
+    MODES = ("all", "time")
+
+    def __init__(self, name, mode="all"):
+        """mode: "all", "time" (no tracemalloc) or None (profiling off)."""
+        if mode not in self.MODES + (None,):
+            raise ValueError(f"unknown profile mode: {mode!r}")
+        self.name = name
+        self.enabled = mode is not None
+        self.memory = mode == "all"
+        self.phases = []
+        self._conns = []
+        self._phase = None
+        self._stmt = None       # [sql, start, last tick, ticks] of the running statement
+        self._normalized = {}   # _shape(sql) -> normalize_sql(sql)
+        self._own_tracemalloc = False
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._own_tracemalloc = True
+        if self.enabled:
+            self.phase("setup")
+
+    def attach(self, conn):
+        """Time the statements run on conn."""
+        if not self.enabled:
+            return
+        conn.set_trace_callback(self._trace)
+        conn.set_progress_handler(self._tick, PROGRESS_STEPS)
+        self._conns.append(conn)
+
+    def _trace(self, sql):
+        now = time.perf_counter()
+        self._close_statement()
+        self._stmt = [sql, now, now, 0]
+
+    def _tick(self):
+        if self._stmt is not None:
+            self._stmt[2] = time.perf_counter()
+            self._stmt[3] += 1
+        return 0
+
+    def _close_statement(self):
+        if self._stmt is None or self._phase is None:
+            return
+        sql, start, last, ticks = self._stmt
+        self._stmt = None
+        shape = _shape(sql)
+        key = self._normalized.get(shape)
+        if key is None:
+            key = self._normalized[shape] = normalize_sql(sql)
+        s = self._phase["statements"].setdefault(key, [0, 0.0, 0])
+        s[0] += 1
+        s[1] += last - start
+        s[2] += ticks * PROGRESS_STEPS
+
+    def phase(self, name):
+        """End the running phase and start one called name."""
+        if not self.enabled:
+            return
+        self._end_phase()
+        if self.memory:
+            tracemalloc.reset_peak()
+        self._phase = {
+            "name": name,
+            "statements": {},
+            "_wall": time.perf_counter(),
+            "_cpu": time.process_time(),
+            "_children": _children_cpu(),
+        }
+
+    def _end_phase(self):
+        p = self._phase
+        if p is None:
+            return
+        self._close_statement()
+        current, peak = tracemalloc.get_traced_memory() if self.memory else (None, None)
+        stmts = sorted(({"sql": sql, "calls": c, "seconds": round(t, 6), "vm_steps": v}
+                        for sql, (c, t, v) in p["statements"].items()),
+                       key=lambda s: (-s["seconds"], -s["vm_steps"], s["sql"]))
+        self.phases.append({
+            "name": p["name"],
+            "wall_s": round(time.perf_counter() - p["_wall"], 6),
+            "cpu_s": round(time.process_time() - p["_cpu"], 6),
+            "child_cpu_s": round(_children_cpu() - p["_children"], 6),
+            "peak_bytes": peak,
+            "end_bytes": current,
+            "sql_s": round(sum(s["seconds"] for s in stmts), 6),
+            "sql_calls": sum(s["calls"] for s in stmts),
+            "statements": stmts,
+        })
+        self._phase = None
+
+    def finish(self):
+        """End the last phase, detach the connections and return the report."""
+        if not self.enabled:
+            return None
+        self._end_phase()
+        for conn in self._conns:
+            try:
+                conn.set_trace_callback(None)
+                conn.set_progress_handler(None, 0)
+            except sqlite3.ProgrammingError:
+                pass        # already closed
+        self._conns = []
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+            self._own_tracemalloc = False
+        self.enabled = False
+        return self.report()
+
+    def report(self):
+        return {
+            "build": self.name,
+            "wall_s": round(sum(p["wall_s"] for p in self.phases), 6),
+            "cpu_s": round(sum(p["cpu_s"] for p in self.phases), 6),
+            "peak_bytes": (max((p["peak_bytes"] for p in self.phases), default=0)
+                           if self.memory else None),
+            "progress_steps": PROGRESS_STEPS,
+            "phases": [dict(p, statements=p["statements"][:TOP_STATEMENTS])
+                       for p in self.phases],
+        }
+
+    def folded(self):
+        """Collapsed-stack lines: build;phase[;statement] microseconds."""
+        lines = []
+        for p in self.phases:
+            frame = f"{self.name};{_frame(p['name'])}"
+            for s in p["statements"]:
+                us = round(s["seconds"] * 1e6)
+                if us:
+                    lines.append(f"{frame};{_frame(s['sql'], 120)} {us}")
+            own = round((p["wall_s"] - p["sql_s"]) * 1e6)
+            if own > 0:
+                lines.append(f"{frame} {own}")
+        return lines
+
+    def write(self, db_path):
+        """finish() and write <db>.profile.json / .profile.folded; returns both paths."""
+        self.finish()
+        if not self.phases:
+            return None
+        db_path = Path(db_path)
+        json_path = db_path.with_suffix(".profile.json")
+        folded_path = db_path.with_suffix(".profile.folded")
+        json_path.write_text(json.dumps(self.report(), indent=2) + "\n")
+        folded_path.write_text("".join(line + "\n" for line in self.folded()))
+        return json_path, folded_path
+
+
+def _frame(text, limit=None):
+    """text as a single collapsed-stack frame (no ';', bounded length)."""
+    text = text.replace(";", ",")
+    if limit and len(text) > limit:
+        text = text[:limit - 3] + "..."
+    return text
@@ -0,0 +1,106 @@
+"""
+Up-to-date check for package rebuilds (--incremental).
+
+Every build records the SHA-256 of its inputs in a build_state table: the
+source files read by each classification profile, plus the build code (the
+builder script and the shared modules listed in BUILD_CODE) and the build
+options that shape the data (--merge-threshold), stored under profile_id 0.
+With --incremental a builder compares them with the files on disk and keeps
+the previous DB of the same version when nothing changed; any change means
+a full build.
+"""
+
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Shared modules whose changes invalidate every derived table
+BUILD_CODE = ("build_state.py", "db_path.py", "index_advisor.py", "name_reconcile.py",
+              "search_index.py", "staging.py", "tree_cache.py", "tsf_parser.py")
+
+BUILD_STATE_DDL = """
+CREATE TABLE IF NOT EXISTS build_state (
+    path TEXT NOT NULL,             -- input file, relative to the repo root
+    profile_id INTEGER NOT NULL,    -- 0 = build code
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (path, profile_id)
+) WITHOUT ROWID;
+"""
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _rel(path):
+    path = Path(path).resolve()
+    try:
+        return path.relative_to(ROOT).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def build_inputs(builder_file, profile_sources, options=None):
+    """{(path, profile_id): sha256} for a build.
+
+    profile_sources is {profile_id: [source paths]}; the builder script,
+    BUILD_CODE and the build options ({name: value}, recorded as
+    "option:<name>" with the hash of the JSON value) go under profile_id 0.
+    """
+    scripts = Path(builder_file).resolve().parent
+    inputs = {}
+    for path in [Path(builder_file)] + [scripts / name for name in BUILD_CODE]:
+        inputs[(_rel(path), 0)] = file_sha256(path)
+    for name, value in (options or {}).items():
+        inputs[(f"option:{name}", 0)] = hashlib.sha256(json.dumps(value).encode()).hexdigest()
+    for profile_id, paths in profile_sources.items():
+        for path in paths:
+            inputs[(_rel(path), profile_id)] = file_sha256(path)
+    return inputs
+
+
+def read_build_state(db_path):
+    """{(path, profile_id): sha256} of a previous build, or None."""
+    if not Path(db_path).exists():
+        return None
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT path, profile_id, sha256 FROM build_state").fetchall()
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        conn.close()
+    return {(path, pid): sha for path, pid, sha in rows} or None
+
+
+def stale_profiles(previous, inputs):
+    """Profile ids whose inputs changed, or None when a full build is needed.
+
+    An empty set means the previous build is up to date.
+    """
+    if previous is None:
+        return None
+    code = {key for key in set(previous) | set(inputs) if key[1] == 0}
+    if any(previous.get(key) != inputs.get(key) for key in code):
+        return None
+    if {pid for _, pid in previous} != {pid for _, pid in inputs}:
+        return None
+    return {key[1] for key in set(previous) | set(inputs)
+            if previous.get(key) != inputs.get(key)}
+
+
+def write_build_state(conn, inputs):
+    """Replace the build_state rows with inputs (from build_inputs())."""
+    conn.executescript(BUILD_STATE_DDL)
+    conn.execute("DELETE FROM build_state")
+    conn.executemany(
+        "INSERT INTO build_state (path, profile_id, sha256) VALUES (?, ?, ?)",
+        [(path, pid, sha) for (path, pid), sha in sorted(inputs.items())])
+    conn.commit()
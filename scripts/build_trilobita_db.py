@@ -27,7 +27,16 @@ from collections import defaultdict
 from datetime import datetime, timezone
 from pathlib import Path
 
+from build_profiler import BuildProfiler
+from build_state import build_inputs, read_build_state, stale_profiles, write_build_state
 from db_path import find_canonical_db, find_paleocore_db
+from index_advisor import QueryPlanError, check_query_plans
+from name_reconcile import reconcile_taxa
+from search_index import NAME_LOOKUP_PARAMS, NAME_LOOKUP_SQL, build_search_index
+from staging import open_build_db, persist_build_db
+from tree_cache import build_tree_caches
+from tree_engine import ProfileTree
+from tsf_parser import TSFDialect, load_placements, synonym_type
 
 ASSERTION_VERSION = "0.3.4"
 
@@ -45,189 +54,41 @@ TREATISE_1997_CH5_REF_ID = None
 
 
 # ---------------------------------------------------------------------------
-# Source file parser
+# Source file dialect (parser: tsf_parser.py)
 # ---------------------------------------------------------------------------
 
-def parse_source_header(text: str):
-    """Parse YAML-like header from a source file. Returns (header_dict, body_str)."""
-    if not text.startswith("---"):
-        return {}, text
-
-    end = text.index("---", 3)
-    header_text = text[3:end].strip()
-    body = text[end + 3:].strip()
-
-    header = {}
-    # Parse reference line
-    m = re.search(r'^reference:\s*(.+)$', header_text, re.MULTILINE)
-    if m:
-        header["reference"] = m.group(1).strip()
-
-    # Parse scope blocks
-    scopes = []
-    for sm in re.finditer(
-        r'-\s+taxon:\s*(\S+)\s+coverage:\s*(\S+)', header_text
-    ):
-        scopes.append({"taxon": sm.group(1), "coverage": sm.group(2)})
-    header["scope"] = scopes
-
-    return header, body
-
-
 RANK_KEYWORDS = {"Order", "Suborder", "Superfamily", "Family", "Subfamily"}
 RANK_ORDER = {"Phylum": 0, "Class": 1, "Order": 2, "Suborder": 3, "Superfamily": 4,
               "Family": 5, "Subfamily": 6, "Genus": 7}
 
 
-def parse_hierarchy_body(body: str, default_leaf_rank="Genus"):
-    """Parse hierarchy body into list of placement records.
+# Compound rank headers: "Order and Family UNCERTAIN",
+# "Superfamily and Family UNCERTAIN", "Order, Suborder, and Family UNCERTAIN"
+_COMPOUND_UNCERTAIN_RE = re.compile(
+    r'^(Order|Suborder|Superfamily|Family|Subfamily)'
+    r'(?:,\s*(?:Order|Suborder|Superfamily|Family|Subfamily))*'
+    r',?\s+and\s+(?:Order|Suborder|Superfamily|Family|Subfamily)'
+    r'\s+UNCERTAIN$',
+    re.IGNORECASE,
+)
 
-    Uses a hybrid strategy:
-    - For taxa with explicit rank keywords (Order, Family, etc.): parent is
-      determined by rank hierarchy (find nearest ancestor with higher rank),
-      regardless of indentation.
-    - For taxa without rank keywords (default_leaf_rank, typically Genus):
-      parent is the most recent taxon with a higher rank on the stack.
 
-    This makes parsing robust against mixed tabs/spaces in source files.
+def _compound_uncertain_header(state, line):
+    """Compound UNCERTAIN header → a taxon at the highest (first) rank named
+    after the whole header (e.g. "Order and family uncertain")."""
+    m = _COMPOUND_UNCERTAIN_RE.match(line)
+    if m:
+        return m.group(1), line[0] + line[1:].lower()
+    return None
 
-    Returns list of dicts:
-      {"name", "rank", "author", "year", "parent_name", "parent_rank",
-       "status", "synonyms": [...]}
-    """
-    placements = []
-    # Stack: [(rank_order, name, rank)]  — ordered by nesting depth
-    stack = []
-
-    for raw_line in body.splitlines():
-        # Skip empty lines and comments
-        stripped = raw_line.strip()
-        if not stripped or stripped.startswith("#"):
-            continue
 
-        # Handle synonym lines (= or ~)
-        syn_match = re.match(r'^\s*(=|~)\s+(.+)$', stripped)
-        if syn_match and placements:
-            marker = syn_match.group(1)
-            syn_text = syn_match.group(2).strip()
-            predicate = "SYNONYM_OF" if marker == "=" else "SPELLING_OF"
-            # Parse: "Target (j.s.s., fide AUTHOR, YEAR)"
-            sm = re.match(r'^(\S+)\s*\(([^)]+)\)$', syn_text)
-            if sm:
-                target = sm.group(1)
-                detail = sm.group(2)
-            else:
-                target = syn_text.split()[0] if syn_text else syn_text
-                detail = ""
-            placements[-1]["synonyms"].append({
-                "predicate": predicate,
-                "target": target,
-                "detail": detail,
-            })
-            continue
-
-        # Determine status from markers
-        status = "asserted"
-        line = stripped
-
-        # ? prefix = questionable
-        if line.startswith("?"):
-            status = "questionable"
-            line = line[1:].strip()
-
-        # [incertae sedis] suffix
-        if "[incertae sedis]" in line:
-            status = "incertae_sedis"
-            line = line.replace("[incertae sedis]", "").strip()
-
-        # Determine rank from keyword prefix
-        rank = None
-        has_explicit_rank = False
-
-        # Special case: compound rank headers like "Order and Family UNCERTAIN",
-        # "Superfamily and Family UNCERTAIN", "Order, Suborder, and Family UNCERTAIN"
-        compound_m = re.match(
-            r'^(Order|Suborder|Superfamily|Family|Subfamily)'
-            r'(?:,\s*(?:Order|Suborder|Superfamily|Family|Subfamily))*'
-            r',?\s+and\s+(?:Order|Suborder|Superfamily|Family|Subfamily)'
-            r'\s+UNCERTAIN$',
-            line, re.IGNORECASE
-        )
-        compound_rank_name = None
-        if compound_m:
-            rank = compound_m.group(1)  # use the highest (first) rank
-            has_explicit_rank = True
-            # Use entire header as the taxon name (e.g. "Order and family uncertain")
-            compound_rank_name = line[0] + line[1:].lower()
-        else:
-            for kw in RANK_KEYWORDS:
-                if line.startswith(kw + " "):
-                    rank = kw
-                    has_explicit_rank = True
-                    line = line[len(kw):].strip()
-                    break
-
-        if rank is None:
-            rank = default_leaf_rank
-
-        # Parse name and authority: "Agnostus Brongniart, 1822 [type species...]"
-        # Remove [...] blocks (type species, notes)
-        clean = re.sub(r'\[.*?\]', '', line).strip()
-        # Remove | separated fields (JA2002 format)
-        clean = clean.split("|")[0].strip()
-
-        # Extract name and authority
-        if compound_rank_name:
-            name = compound_rank_name
-            authority_str = ""
-        else:
-            parts = clean.split(None, 1)
-            if not parts:
-                continue
-            name = parts[0].strip()
-            authority_str = parts[1].strip() if len(parts) > 1 else ""
-
-        # Normalize casing: ALL CAPS family/subfamily names → title case
-        # e.g., CYCLOPAGNOSTIDAE → Cyclopagnostidae, OLENELLINAE → Olenellinae
-        if rank in ("Family", "Subfamily", "Superfamily", "Suborder") and name == name.upper() and len(name) > 1:
-            name = name[0] + name[1:].lower()
-
-        # Parse author, year from authority
-        author = ""
-        year = ""
-        if authority_str:
-            # Match "AUTHOR, YEAR" or "AUTHOR & AUTHOR, YEAR" etc.
-            ym = re.search(r',?\s*(\d{4}[a-z]?)\s*$', authority_str)
-            if ym:
-                year = ym.group(1)
-                author = authority_str[:ym.start()].strip().rstrip(",")
-            else:
-                author = authority_str
-
-        # Determine parent using rank hierarchy
-        cur_order = RANK_ORDER.get(rank, 6)
-
-        # Pop stack to find parent: nearest ancestor with strictly higher rank
-        while stack and stack[-1][0] >= cur_order:
-            stack.pop()
-
-        parent_name = stack[-1][1] if stack else None
-        parent_rank = stack[-1][2] if stack else None
-
-        stack.append((cur_order, name, rank))
-
-        placements.append({
-            "name": name,
-            "rank": rank,
-            "author": author,
-            "year": year,
-            "parent_name": parent_name,
-            "parent_rank": parent_rank,
-            "status": status,
-            "synonyms": [],
-        })
-
-    return placements
+TSF_DIALECT = TSFDialect(
+    RANK_KEYWORDS, RANK_ORDER,
+    caps_ranks=("Family", "Subfamily", "Superfamily", "Suborder"),
+    skip_unassigned=False,
+    pipe_fields=False,
+    entry_rules=(_compound_uncertain_header,),
+)
 
 
 # ---------------------------------------------------------------------------
@@ -553,9 +414,7 @@ def process_source_default(dst, taxon_index, name_index, new_taxa_cache):
         "Arthropoda", "Phylum", dst, taxon_index, name_index, new_taxa_cache)
 
     # --- Adrain 2011: suprafamilial hierarchy ---
-    adrain_text = (SOURCES / "adrain_2011.txt").read_text(encoding="utf-8")
-    _, adrain_body = parse_source_header(adrain_text)
-    adrain_placements = parse_hierarchy_body(adrain_body, default_leaf_rank="Family")
+    adrain_placements = load_placements(SOURCES / "adrain_2011.txt", "Family", TSF_DIALECT)
 
     # Resolve Trilobita (Class) as root for Orders
     trilobita_id = resolve_taxon(
@@ -594,9 +453,7 @@ def process_source_default(dst, taxon_index, name_index, new_taxa_cache):
                 print(f"     WARN: duplicate PLACED_IN for {p['name']} ({p['rank']}) id={child_id}")
 
     # --- JA2002: genus → family placements + synonyms ---
-    ja_text = (SOURCES / "jell_adrain_2002.txt").read_text(encoding="utf-8")
-    _, ja_body = parse_source_header(ja_text)
-    ja_placements = parse_hierarchy_body(ja_body, default_leaf_rank="Genus")
+    ja_placements = load_placements(SOURCES / "jell_adrain_2002.txt", "Genus", TSF_DIALECT)
 
     for p in ja_placements:
         if p["rank"] == "Family":
@@ -627,13 +484,9 @@ def process_source_default(dst, taxon_index, name_index, new_taxa_cache):
         for syn in p["synonyms"]:
             target_id = resolve_taxon(
                 syn["target"], "Genus", dst, taxon_index, name_index, new_taxa_cache)
-            syn_type = ""
-            if syn["detail"]:
-                # Extract synonym type from detail: "j.s.s., fide AUTHOR, YEAR"
-                st_match = re.match(r'(j\.s\.s\.|j\.o\.s\.)', syn["detail"])
-                if st_match:
-                    syn_type = st_match.group(1)
-                elif "unnecessary replacement" in syn["detail"]:
+            syn_type = synonym_type(syn["detail"])
+            if syn["detail"] and not syn_type:
+                if "unnecessary replacement" in syn["detail"]:
                     syn_type = "unnecessary replacement"
                 elif "inappropriate emendation" in syn["detail"]:
                     syn_type = "inappropriate emendation"
@@ -654,109 +507,93 @@ def process_source_default(dst, taxon_index, name_index, new_taxa_cache):
     return counts, default_edges, placed_children
 
 
-def fallback_canonical_parent_id(src, dst, placed_children, default_edges,
-                                 taxon_index, name_index, new_taxa_cache):
+def _temp_ids(dst, name, ids):
+    """(Re)create TEMP table `name` (taxon_id) holding ids for set-based joins."""
+    dst.execute(f"DROP TABLE IF EXISTS temp.{name}")
+    dst.execute(f"CREATE TEMP TABLE {name} (taxon_id INTEGER PRIMARY KEY)")
+    dst.executemany(f"INSERT OR IGNORE INTO temp.{name} VALUES (?)", [(i,) for i in ids])
+
+
+def fallback_canonical_parent_id(dst, placed_children, default_edges):
     """Fix 3: For taxa without default placement, fall back to canonical parent_id.
 
     Some taxa in canonical DB have parent_id but are not covered by source files
     (e.g., families not in Adrain 2011, genera without family in JA2002).
+    Reads the canonical DB attached as `canon`.
     """
-    # Find all taxa not yet placed in default profile (excluding Class which is root)
-    all_taxa = dst.execute(
-        "SELECT id, name, rank FROM taxon WHERE rank != 'Class'"
-    ).fetchall()
-
-    count = 0
-    for taxon_id, taxon_name, taxon_rank in all_taxa:
-        if taxon_id in placed_children:
-            continue
-
-        # Check canonical DB for parent_id
-        row = src.execute(
-            "SELECT parent_id FROM taxonomic_ranks WHERE id = ?", (taxon_id,)
-        ).fetchone()
-        if not row or not row[0]:
-            continue
-
-        parent_canonical_id = row[0]
-        # Verify the parent exists in assertion DB
-        parent_row = dst.execute(
-            "SELECT id, name, rank FROM taxon WHERE id = ?",
-            (parent_canonical_id,)
-        ).fetchone()
-        if not parent_row:
-            continue
-
-        try:
-            dst.execute("""
-                INSERT INTO assertion
-                    (subject_taxon_id, predicate, object_taxon_id,
-                     reference_id, assertion_status, curation_confidence)
-                VALUES (?, 'PLACED_IN', ?, ?, 'asserted', 'high')
-            """, (taxon_id, parent_canonical_id, JA2002_REF_ID))
-            count += 1
-            default_edges.append((taxon_id, parent_canonical_id))
-            placed_children.add(taxon_id)
-        except sqlite3.IntegrityError:
-            pass
-
-    return count
-
-
-def import_canonical_opinions(src, dst):
+    # Taxa not yet placed in default profile (excluding Class which is root)
+    # whose canonical parent exists in the assertion DB
+    _temp_ids(dst, "placed", placed_children)
+    dst.executescript("""
+        DROP TABLE IF EXISTS temp.fallback_edges;
+        CREATE TEMP TABLE fallback_edges AS
+        SELECT t.id AS child_id, r.parent_id
+        FROM taxon t
+        JOIN canon.taxonomic_ranks r ON r.id = t.id
+        JOIN taxon p ON p.id = r.parent_id
+        WHERE t.rank != 'Class'
+          AND t.id NOT IN (SELECT taxon_id FROM temp.placed)
+        ORDER BY t.id;
+    """)
+    # OR IGNORE skips rows failing a CHECK, as the per-row insert used to, but
+    # not foreign key errors: the SELECT leaves those rows out.  The edges are
+    # the assertions actually inserted (ids grow with AUTOINCREMENT).
+    last_id = dst.execute("SELECT COALESCE(MAX(id), 0) FROM assertion").fetchone()[0]
+    dst.execute("""
+        INSERT OR IGNORE INTO assertion
+            (subject_taxon_id, predicate, object_taxon_id,
+             reference_id, assertion_status, curation_confidence)
+        SELECT child_id, 'PLACED_IN', parent_id, :ref, 'asserted', 'high'
+        FROM temp.fallback_edges
+        WHERE EXISTS (SELECT 1 FROM reference WHERE id = :ref)
+        ORDER BY rowid
+    """, {"ref": JA2002_REF_ID})
+    edges = dst.execute("""
+        SELECT subject_taxon_id, object_taxon_id FROM assertion
+        WHERE id > ? ORDER BY id
+    """, (last_id,)).fetchall()
+    dst.executescript("DROP TABLE temp.placed; DROP TABLE temp.fallback_edges;")
+
+    default_edges.extend(edges)
+    placed_children.update(child_id for child_id, _ in edges)
+    return len(edges)
+
+
+def import_canonical_opinions(dst):
     """Fix 4: Import SYNONYM_OF/SPELLING_OF from canonical taxonomic_opinions.
 
     Recovers synonyms that exist in canonical DB but weren't in JA2002 source
     (i.e., synonyms from other sources imported into canonical DB).
+    Reads the canonical DB attached as `canon`.
     """
-    # Get existing synonym assertions (subject_taxon_id set)
-    existing = set()
-    for row in dst.execute(
-        "SELECT subject_taxon_id, predicate, object_taxon_id FROM assertion "
-        "WHERE predicate IN ('SYNONYM_OF', 'SPELLING_OF')"
-    ).fetchall():
-        existing.add((row[0], row[1], row[2]))
-
-    opinions = src.execute("""
-        SELECT taxon_id, opinion_type, related_taxon_id, bibliography_id,
-               assertion_status, curation_confidence,
-               synonym_type, notes
-        FROM taxonomic_opinions
-        WHERE opinion_type IN ('SYNONYM_OF', 'SPELLING_OF')
-        AND related_taxon_id IS NOT NULL
-    """).fetchall()
-
-    count = 0
-    for (taxon_id, opinion_type, related_id, bib_id,
-         status, confidence, syn_type, notes) in opinions:
-        # Skip if already exists
-        if (taxon_id, opinion_type, related_id) in existing:
-            continue
-
-        # Verify both taxa exist in assertion DB
-        subj = dst.execute("SELECT id FROM taxon WHERE id = ?", (taxon_id,)).fetchone()
-        obj = dst.execute("SELECT id FROM taxon WHERE id = ?", (related_id,)).fetchone()
-        if not subj or not obj:
-            continue
-
-        # Map bibliography_id → reference_id (same IDs since we copied bibliography)
-        ref_id = bib_id if bib_id else None
-
-        try:
-            dst.execute("""
-                INSERT INTO assertion
-                    (subject_taxon_id, predicate, object_taxon_id,
-                     reference_id, assertion_status, curation_confidence,
-                     synonym_type, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (taxon_id, opinion_type, related_id, ref_id,
-                  status or 'asserted', confidence or 'high',
-                  syn_type, notes))
-            count += 1
-        except sqlite3.IntegrityError:
-            pass
-
-    return count
+    # Skip opinions already asserted and those naming a taxon or reference
+    # missing from the assertion DB (bibliography_id maps to reference_id:
+    # same IDs since we copied bibliography).  OR IGNORE drops rows failing
+    # a CHECK, as the per-row insert used to.
+    cur = dst.execute("""
+        INSERT OR IGNORE INTO assertion
+            (subject_taxon_id, predicate, object_taxon_id,
+             reference_id, assertion_status, curation_confidence,
+             synonym_type, notes)
+        SELECT o.taxon_id, o.opinion_type, o.related_taxon_id,
+               NULLIF(o.bibliography_id, 0),
+               COALESCE(NULLIF(o.assertion_status, ''), 'asserted'),
+               COALESCE(NULLIF(o.curation_confidence, ''), 'high'),
+               o.synonym_type, o.notes
+        FROM canon.taxonomic_opinions o
+        JOIN taxon subj ON subj.id = o.taxon_id
+        JOIN taxon obj ON obj.id = o.related_taxon_id
+        WHERE o.opinion_type IN ('SYNONYM_OF', 'SPELLING_OF')
+          AND NOT EXISTS (
+              SELECT 1 FROM assertion a
+              WHERE a.subject_taxon_id = o.taxon_id
+                AND a.predicate = o.opinion_type
+                AND a.object_taxon_id = o.related_taxon_id)
+          AND (NULLIF(o.bibliography_id, 0) IS NULL
+               OR o.bibliography_id IN (SELECT id FROM reference))
+        ORDER BY o.id
+    """)
+    return cur.rowcount
 
 
 def process_source_treatise(dst, source_file, ref_id,
@@ -765,9 +602,7 @@ def process_source_treatise(dst, source_file, ref_id,
 
     Returns list of (child_id, parent_id) edges for profile building.
     """
-    text = source_file.read_text(encoding="utf-8")
-    _, body = parse_source_header(text)
-    placements = parse_hierarchy_body(body, default_leaf_rank="Genus")
+    placements = load_placements(source_file, "Genus", TSF_DIALECT)
 
     edges = []
     asserted_children = set()
@@ -892,11 +727,12 @@ def build_profiles(dst, default_edges, t1959_edges,
 
     # Replace: delete 1959 edges for taxa in scope, then insert 1997 edges
     # For comprehensive scope: remove all 1959 edges whose child is in the scope
-    for child_id in ch4_taxa | ch5_taxa:
-        dst.execute("""
-            DELETE FROM classification_edge_cache
-            WHERE profile_id = 3 AND child_id = ?
-        """, (child_id,))
+    _temp_ids(dst, "scope_children", ch4_taxa | ch5_taxa)
+    dst.execute("""
+        DELETE FROM classification_edge_cache
+        WHERE profile_id = 3 AND child_id IN (SELECT taxon_id FROM temp.scope_children)
+    """)
+    dst.execute("DROP TABLE temp.scope_children")
 
     # Also remove 1959-only taxa that were children under the scope subtrees
     # (comprehensive removal: taxa in 1959 under Agnostida/Redlichiida but not in 1997)
@@ -971,27 +807,18 @@ def build_profiles(dst, default_edges, t1959_edges,
 def _remove_comprehensive_scope(dst, profile_id, root_id, keep_set):
     """Remove edges in profile whose children are descendants of root_id
     but not in keep_set (comprehensive scope removal)."""
-    # Find all descendants of root_id in this profile via recursive query
-    descendants = dst.execute("""
-        WITH RECURSIVE subtree AS (
-            SELECT child_id FROM classification_edge_cache
-            WHERE profile_id = ? AND parent_id = ?
-            UNION ALL
-            SELECT e.child_id FROM classification_edge_cache e
-            JOIN subtree s ON e.parent_id = s.child_id
-            WHERE e.profile_id = ?
-        )
-        SELECT child_id FROM subtree
-    """, (profile_id, root_id, profile_id)).fetchall()
-
-    removed = 0
-    for (child_id,) in descendants:
-        if child_id not in keep_set:
-            dst.execute("""
-                DELETE FROM classification_edge_cache
-                WHERE profile_id = ? AND child_id = ?
-            """, (profile_id, child_id))
-            removed += 1
+    # Descendants of root_id in this profile (one pre-order slice of the
+    # profile tree), minus keep_set.
+    tree = ProfileTree.from_db(dst, profile_id)
+    if root_id not in tree:
+        return
+    _root, subtree, _depth = tree.descendants(root_id)
+    _temp_ids(dst, "scope_drop", (t for t in subtree.tolist() if t not in keep_set))
+    removed = dst.execute("""
+        DELETE FROM classification_edge_cache
+        WHERE profile_id = ? AND child_id IN (SELECT taxon_id FROM temp.scope_drop)
+    """, (profile_id,)).rowcount
+    dst.execute("DROP TABLE temp.scope_drop")
 
     if removed:
         root_name = dst.execute(
@@ -1092,32 +919,27 @@ def _build_queries():
          "FROM taxon t WHERE t.rank = 'Class'\n"
          "UNION ALL\n"
          "SELECT t.id, t.name, t.rank, e.parent_id, t.author\n"
-         "FROM taxon t\n"
-         "JOIN classification_edge_cache e ON e.child_id = t.id\n"
+         "FROM classification_edge_cache e\n"
+         "CROSS JOIN taxon t ON t.id = e.child_id\n"
          "WHERE e.profile_id = COALESCE(:profile_id, 1) AND t.rank != 'Genus'\n"
          "ORDER BY rank, name",
          '{"profile_id": "integer"}'),
 
         ("taxonomy_tree_genera_counts", "Count of genera per direct parent (profile-aware)",
-         "SELECT e.parent_id, COUNT(*) AS genera_count\n"
-         "FROM classification_edge_cache e\n"
-         "JOIN taxon g ON g.id = e.child_id AND g.rank = 'Genus'\n"
-         "WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
-         "GROUP BY e.parent_id",
+         "SELECT s.taxon_id AS parent_id, s.direct_genera AS genera_count\n"
+         "FROM profile_node_stats s\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.direct_genera > 0\n"
+         "ORDER BY s.taxon_id",
          '{"profile_id": "integer"}'),
 
-        ("family_genera", "Genera under a family/subfamily subtree (profile-aware, recursive)",
-         "WITH RECURSIVE subtree AS (\n"
-         "    SELECT child_id FROM classification_edge_cache\n"
-         "    WHERE parent_id = :family_id AND profile_id = COALESCE(:profile_id, 1)\n"
-         "    UNION ALL\n"
-         "    SELECT e.child_id FROM classification_edge_cache e\n"
-         "    JOIN subtree s ON e.parent_id = s.child_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
-         ")\n"
+        ("family_genera", "Genera under a family/subfamily subtree (profile-aware, nested-set range)",
          "SELECT t.id, t.name, t.author, t.year, t.type_species, t.location, t.is_valid\n"
-         "FROM taxon t JOIN subtree ON subtree.child_id = t.id\n"
-         "WHERE t.rank = 'Genus'\n"
+         "FROM profile_tree_index f\n"
+         "JOIN profile_tree_index d ON d.profile_id = f.profile_id\n"
+         "  AND d.lft BETWEEN f.lft + 1 AND f.rgt\n"
+         "JOIN taxon t ON t.id = d.taxon_id\n"
+         "WHERE f.profile_id = COALESCE(:profile_id, 1) AND f.taxon_id = :family_id\n"
+         "  AND t.rank = 'Genus'\n"
          "ORDER BY t.name",
          '{"family_id": "integer", "profile_id": "integer"}'),
 
@@ -1158,42 +980,38 @@ def _build_queries():
          "ORDER BY a.predicate, r.year",
          '{"taxon_id": "integer"}'),
 
-        ("taxon_children", "Children of a taxon (profile-aware via edge_cache)",
+        ("taxon_children", "Children of a taxon with direct genus counts (profile-aware)",
          "SELECT t.id, t.name, t.rank, t.author,\n"
-         "  (SELECT COUNT(*) FROM classification_edge_cache e2\n"
-         "   JOIN taxon g ON g.id = e2.child_id AND g.rank = 'Genus'\n"
-         "   WHERE e2.parent_id = t.id AND e2.profile_id = COALESCE(:profile_id, 1)\n"
-         "  ) AS genera_count\n"
+         "  COALESCE(s.direct_genera, 0) AS genera_count\n"
          "FROM taxon t\n"
          "JOIN classification_edge_cache e ON e.child_id = t.id\n"
+         "LEFT JOIN profile_node_stats s ON s.profile_id = e.profile_id AND s.taxon_id = t.id\n"
          "WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id = :taxon_id\n"
          "ORDER BY t.rank, t.name",
          '{"taxon_id": "integer", "profile_id": "integer"}'),
 
-        ("taxon_children_counts", "Child rank counts (profile-aware via edge_cache)",
-         "SELECT t.rank, COUNT(*) as count\n"
+        ("taxon_children_counts", "Child rank counts (profile-aware via profile_node_stats)",
+         "SELECT j.key AS rank, j.value AS count\n"
+         "FROM profile_node_stats s, json_each(s.child_rank_counts_json) j\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.taxon_id = :taxon_id",
+         '{"taxon_id": "integer", "profile_id": "integer"}'),
+
+        ("taxon_age_counts", "Valid genus count per temporal code within a taxon (from diversity_cube)",
+         "SELECT d.temporal_code AS age_label, d.age_order, d.genus_count AS count\n"
          "FROM taxon t\n"
-         "JOIN classification_edge_cache e ON e.child_id = t.id\n"
-         "WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id = :taxon_id\n"
-         "GROUP BY t.rank",
+         "JOIN diversity_cube d ON d.grouping_rank = t.rank AND d.group_id = t.id\n"
+         "WHERE t.id = :taxon_id AND d.profile_id = COALESCE(:profile_id, 1)\n"
+         "ORDER BY d.age_order",
          '{"taxon_id": "integer", "profile_id": "integer"}'),
 
         # --- Genus-specific ---
-        ("genus_hierarchy", "Ancestor chain for a taxon via edge_cache",
-         "WITH RECURSIVE ancestors AS (\n"
-         "  SELECT t.id, t.name, t.rank, t.author, 0 as depth\n"
-         "  FROM classification_edge_cache e\n"
-         "  JOIN taxon t ON e.parent_id = t.id\n"
-         "  WHERE e.child_id = :taxon_id\n"
-         "    AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "  UNION ALL\n"
-         "  SELECT t.id, t.name, t.rank, t.author, anc.depth + 1\n"
-         "  FROM ancestors anc\n"
-         "  JOIN classification_edge_cache e ON e.child_id = anc.id\n"
-         "    AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "  JOIN taxon t ON e.parent_id = t.id\n"
-         ")\n"
-         "SELECT id, name, rank, author FROM ancestors ORDER BY depth DESC",
+        ("genus_hierarchy", "Ancestor chain for a taxon via classification_closure",
+         "SELECT t.id, t.name, t.rank, t.author\n"
+         "FROM classification_closure c\n"
+         "JOIN taxon t ON t.id = c.ancestor_id\n"
+         "WHERE c.profile_id = COALESCE(:profile_id, 1) AND c.descendant_id = :taxon_id\n"
+         "  AND c.depth > 0\n"
+         "ORDER BY c.depth DESC",
          '{"taxon_id": "integer", "profile_id": "integer"}'),
 
         ("genus_synonyms", "Synonyms for a genus",
@@ -1251,6 +1069,30 @@ def _build_queries():
          "       reference_type\n"
          "FROM reference ORDER BY authors, year", None),
 
+        ("taxon_search", "Full-text taxon search (name, author, type species, locality, formation) ranked by bm25",
+         "SELECT t.id, t.name, t.rank, t.author, t.year, t.family, t.temporal_code, t.is_valid,\n"
+         "       bm25(taxon_fts, 10.0, 3.0, 1.0, 1.0, 1.0) AS score\n"
+         "FROM taxon_fts\n"
+         "JOIN taxon t ON t.id = taxon_fts.rowid\n"
+         "WHERE taxon_fts MATCH '\"' || replace(:q, '\"', '\"\"') || '\"'\n"
+         "  AND (:rank IS NULL OR t.rank = :rank)\n"
+         "ORDER BY score, t.name\n"
+         "LIMIT COALESCE(:limit, 50)",
+         '{"q": "text", "rank": "text", "limit": "integer"}'),
+
+        ("reference_search", "Full-text reference search (authors, title, journal) ranked by bm25",
+         "SELECT r.id, r.authors, r.year, r.year_suffix, r.title, r.journal,\n"
+         "       bm25(reference_fts, 3.0, 2.0, 1.0) AS score\n"
+         "FROM reference_fts\n"
+         "JOIN reference r ON r.id = reference_fts.rowid\n"
+         "WHERE reference_fts MATCH '\"' || replace(:q, '\"', '\"\"') || '\"'\n"
+         "ORDER BY score, r.authors, r.year\n"
+         "LIMIT COALESCE(:limit, 50)",
+         '{"q": "text", "limit": "integer"}'),
+
+        ("taxon_name_lookup", "Typo-tolerant taxon name lookup: closest names by edit distance (taxon_name_deletes)",
+         NAME_LOOKUP_SQL, NAME_LOOKUP_PARAMS),
+
         ("reference_detail", "Detail for a single reference",
          "SELECT * FROM reference WHERE id = :ref_id",
          '{"ref_id": "integer"}'),
@@ -1483,79 +1325,36 @@ def _build_queries():
          None),
 
         # --- Profile diff ---
-        ("profile_diff", "Compare edges between two classification profiles",
+        ("profile_diff", "Compare edges between two classification profiles (profile_diff_cache)",
          "SELECT\n"
-         "    COALESCE(a.child_id, b.child_id) AS taxon_id,\n"
+         "    d.child_id AS taxon_id,\n"
          "    t.name AS taxon_name,\n"
          "    t.rank AS taxon_rank,\n"
          "    pa.name AS parent_a,\n"
          "    pb.name AS parent_b,\n"
-         "    CASE\n"
-         "        WHEN b.child_id IS NULL THEN 'removed'\n"
-         "        WHEN a.child_id IS NULL THEN 'added'\n"
-         "        WHEN a.parent_id != b.parent_id THEN 'moved'\n"
-         "    END AS diff_status\n"
-         "FROM classification_edge_cache a\n"
-         "LEFT JOIN classification_edge_cache b\n"
-         "    ON a.child_id = b.child_id AND b.profile_id = :compare_profile_id\n"
-         "LEFT JOIN taxon t ON t.id = COALESCE(a.child_id, b.child_id)\n"
-         "LEFT JOIN taxon pa ON pa.id = a.parent_id\n"
-         "LEFT JOIN taxon pb ON pb.id = b.parent_id\n"
-         "WHERE a.profile_id = :profile_id\n"
-         "    AND (b.child_id IS NULL OR a.parent_id != b.parent_id)\n"
-         "\n"
-         "UNION ALL\n"
-         "\n"
-         "SELECT\n"
-         "    b.child_id AS taxon_id,\n"
-         "    t.name AS taxon_name,\n"
-         "    t.rank AS taxon_rank,\n"
-         "    NULL AS parent_a,\n"
-         "    pb.name AS parent_b,\n"
-         "    'added' AS diff_status\n"
-         "FROM classification_edge_cache b\n"
-         "LEFT JOIN classification_edge_cache a\n"
-         "    ON b.child_id = a.child_id AND a.profile_id = :profile_id\n"
-         "LEFT JOIN taxon t ON t.id = b.child_id\n"
-         "LEFT JOIN taxon pb ON pb.id = b.parent_id\n"
-         "WHERE b.profile_id = :compare_profile_id\n"
-         "    AND a.child_id IS NULL\n"
-         "\n"
+         "    d.diff_status\n"
+         "FROM profile_diff_cache d\n"
+         "LEFT JOIN taxon t ON t.id = d.child_id\n"
+         "LEFT JOIN taxon pa ON pa.id = d.parent_a\n"
+         "LEFT JOIN taxon pb ON pb.id = d.parent_b\n"
+         "WHERE d.profile_a = COALESCE(:profile_id, 0) AND d.profile_b = COALESCE(:compare_profile_id, 0)\n"
+         "    AND d.diff_status != 'same'\n"
          "ORDER BY diff_status, taxon_rank, taxon_name",
          '{"profile_id": "integer", "compare_profile_id": "integer"}'),
 
         # --- Diversity statistics (bar chart) ---
         ("diversity_by_age", "Genus count per temporal code grouped by a parent rank",
-         "WITH RECURSIVE ancestors AS (\n"
-         "    SELECT e.child_id AS genus_id, e.parent_id AS ancestor_id\n"
-         "    FROM classification_edge_cache e\n"
-         "    JOIN taxon t ON t.id = e.child_id AND t.rank = 'Genus'\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
-         "    UNION ALL\n"
-         "    SELECT a.genus_id, e.parent_id\n"
-         "    FROM ancestors a\n"
-         "    JOIN classification_edge_cache e ON e.child_id = a.ancestor_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
-         "),\n"
-         "genus_group AS (\n"
-         "    SELECT a.genus_id, grp.name AS group_name\n"
-         "    FROM ancestors a\n"
-         "    JOIN taxon grp ON grp.id = a.ancestor_id AND grp.rank = :grouping_rank\n"
-         ")\n"
-         "SELECT tcm.code AS age_label, -tcm.fad_mya AS age_order,\n"
-         "       COALESCE(gg.group_name, 'Unknown') AS group_name,\n"
-         "       COUNT(DISTINCT g.id) AS count\n"
-         "FROM taxon g\n"
-         "JOIN classification_edge_cache ge ON ge.child_id = g.id\n"
-         "  AND ge.profile_id = COALESCE(:profile_id, 1)\n"
-         "JOIN temporal_code_mya tcm ON g.temporal_code = tcm.code\n"
-         "LEFT JOIN genus_group gg ON gg.genus_id = g.id\n"
-         "WHERE g.rank = 'Genus' AND g.is_valid = 1\n"
-         "  AND tcm.code IN ('LCAM','MCAM','UCAM','LORD','MORD','UORD',\n"
-         "                    'LSIL','USIL','LDEV','MDEV','UDEV',\n"
-         "                    'MISS','PENN','LPERM','UPERM')\n"
-         "GROUP BY tcm.code, gg.group_name\n"
-         "HAVING count > 0\n"
+         "SELECT d.temporal_code AS age_label, d.age_order,\n"
+         "       d.group_name, SUM(d.genus_count) AS count\n"
+         "FROM diversity_cube d\n"
+         "WHERE d.profile_id = COALESCE(:profile_id, 1)\n"
+         "  AND d.grouping_rank = COALESCE((SELECT grouping_rank FROM diversity_cube\n"
+         "                                  WHERE profile_id = COALESCE(:profile_id, 1)\n"
+         "                                    AND grouping_rank = :grouping_rank LIMIT 1), '')\n"
+         "  AND d.temporal_code IN ('LCAM','MCAM','UCAM','LORD','MORD','UORD',\n"
+         "                           'LSIL','USIL','LDEV','MDEV','UDEV',\n"
+         "                           'MISS','PENN','LPERM','UPERM')\n"
+         "GROUP BY d.temporal_code, d.group_name\n"
          "ORDER BY age_order, count DESC",
          '{"profile_id": "integer", "grouping_rank": "text"}'),
 
@@ -1574,76 +1373,79 @@ def _build_queries():
 
         ("timeline_publication_years", "Distinct genus naming years for timeline axis",
          "SELECT DISTINCT CAST(t.year AS INTEGER) AS year, CAST(t.year AS INTEGER) AS label\n"
-         "FROM taxon t\n"
-         "JOIN classification_edge_cache e ON e.child_id = t.id\n"
-         "  AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "WHERE t.rank = 'Genus' AND t.year IS NOT NULL\n"
+         "FROM classification_edge_cache e\n"
+         "CROSS JOIN taxon t ON t.id = e.child_id\n"
+         "WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
+         "  AND t.rank = 'Genus' AND t.year IS NOT NULL\n"
          "ORDER BY year",
          '{"profile_id": "integer"}'),
 
-        ("taxonomy_tree_by_geologic", "Taxa filtered by geologic time (Mya snapshot)",
-         "WITH RECURSIVE filtered_genera AS (\n"
-         "    SELECT t.id\n"
-         "    FROM taxon t\n"
-         "    JOIN classification_edge_cache e ON e.child_id = t.id AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "    WHERE t.rank = 'Genus'\n"
-         "    AND (:timeline_value IS NULL OR t.temporal_code IN (\n"
+        ("taxonomy_tree_by_geologic", "Taxa at a geologic timeline stop (timeline_snapshot_nodes)",
+         "WITH ancestors AS (\n"
+         "    -- fallback for values that are not timeline_geologic_periods stops\n"
+         "    SELECT DISTINCT c.ancestor_id AS taxon_id\n"
+         "    FROM classification_edge_cache e\n"
+         "    CROSS JOIN taxon g ON g.id = e.child_id\n"
+         "    CROSS JOIN classification_closure c\n"
+         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND NOT EXISTS (\n"
+         "        SELECT 1 FROM timeline_snapshot_nodes s\n"
+         "        WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.stop_mya IS :timeline_value\n"
+         "    )\n"
+         "    AND g.rank = 'Genus'\n"
+         "    AND g.temporal_code IN (\n"
          "        SELECT tr.code FROM temporal_code_mya tr\n"
          "        WHERE tr.fad_mya >= :timeline_value AND tr.lad_mya <= :timeline_value\n"
-         "    ))\n"
-         "), ancestors AS (\n"
-         "    SELECT id AS taxon_id FROM filtered_genera\n"
-         "    UNION\n"
-         "    SELECT e.parent_id\n"
-         "    FROM classification_edge_cache e\n"
-         "    JOIN ancestors a ON e.child_id = a.taxon_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id IS NOT NULL\n"
+         "    )\n"
+         "    AND c.profile_id = e.profile_id AND c.descendant_id = g.id\n"
          ")\n"
          "SELECT t.id, t.name, t.rank, t.author, t.year, t.temporal_code, t.is_valid\n"
+         "FROM timeline_snapshot_nodes s\n"
+         "JOIN taxon t ON t.id = s.taxon_id\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.stop_mya IS :timeline_value\n"
+         "UNION ALL\n"
+         "SELECT t.id, t.name, t.rank, t.author, t.year, t.temporal_code, t.is_valid\n"
          "FROM taxon t\n"
          "WHERE t.id IN (SELECT taxon_id FROM ancestors)\n"
-         "ORDER BY t.id",
+         "ORDER BY id",
          '{"profile_id": "integer", "timeline_value": "real"}'),
 
-        ("taxonomy_tree_by_pubyear", "Taxa filtered by naming year (cumulative)",
-         "WITH RECURSIVE filtered_genera AS (\n"
-         "    SELECT t.id\n"
-         "    FROM taxon t\n"
-         "    JOIN classification_edge_cache e ON e.child_id = t.id AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "    WHERE t.rank = 'Genus'\n"
-         "    AND (:timeline_value IS NULL OR (t.year IS NOT NULL AND CAST(t.year AS INTEGER) <= :timeline_value))\n"
-         "), ancestors AS (\n"
-         "    SELECT id AS taxon_id FROM filtered_genera\n"
-         "    UNION\n"
-         "    SELECT e.parent_id\n"
-         "    FROM classification_edge_cache e\n"
-         "    JOIN ancestors a ON e.child_id = a.taxon_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id IS NOT NULL\n"
-         ")\n"
+        ("taxonomy_tree_by_pubyear", "Taxa named by a given year (cumulative, via min_desc_year)",
          "SELECT t.id, t.name, t.rank, t.author, t.year, t.temporal_code, t.is_valid\n"
-         "FROM taxon t\n"
-         "WHERE t.id IN (SELECT taxon_id FROM ancestors)\n"
-         "ORDER BY t.id",
+         "FROM profile_node_stats s\n"
+         "JOIN taxon t ON t.id = s.taxon_id\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.min_desc_year <= :timeline_value\n"
+         "UNION ALL\n"
+         "-- no year filter: every genus of the profile plus its ancestors\n"
+         "SELECT t.id, t.name, t.rank, t.author, t.year, t.temporal_code, t.is_valid\n"
+         "FROM profile_node_stats s\n"
+         "CROSS JOIN taxon t ON t.id = s.taxon_id\n"
+         "WHERE :timeline_value IS NULL AND s.profile_id = COALESCE(:profile_id, 1)\n"
+         "  AND (s.total_genera > 0 OR t.rank = 'Genus')\n"
+         "ORDER BY id",
          '{"profile_id": "integer", "timeline_value": "integer"}'),
 
-        ("tree_edges_by_geologic", "Edges filtered by geologic time (Mya snapshot)",
-         "WITH RECURSIVE filtered_genera AS (\n"
-         "    SELECT t.id\n"
-         "    FROM taxon t\n"
-         "    JOIN classification_edge_cache e ON e.child_id = t.id AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "    WHERE t.rank = 'Genus'\n"
-         "    AND (:timeline_value IS NULL OR t.temporal_code IN (\n"
+        ("tree_edges_by_geologic", "Edges at a geologic timeline stop (timeline_snapshot_edges)",
+         "WITH ancestors AS (\n"
+         "    -- fallback for values that are not timeline_geologic_periods stops\n"
+         "    SELECT DISTINCT c.ancestor_id AS taxon_id\n"
+         "    FROM classification_edge_cache e\n"
+         "    CROSS JOIN taxon g ON g.id = e.child_id\n"
+         "    CROSS JOIN classification_closure c\n"
+         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND NOT EXISTS (\n"
+         "        SELECT 1 FROM timeline_snapshot_nodes s\n"
+         "        WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.stop_mya IS :timeline_value\n"
+         "    )\n"
+         "    AND g.rank = 'Genus'\n"
+         "    AND g.temporal_code IN (\n"
          "        SELECT tr.code FROM temporal_code_mya tr\n"
          "        WHERE tr.fad_mya >= :timeline_value AND tr.lad_mya <= :timeline_value\n"
-         "    ))\n"
-         "), ancestors AS (\n"
-         "    SELECT id AS taxon_id FROM filtered_genera\n"
-         "    UNION\n"
-         "    SELECT e.parent_id\n"
-         "    FROM classification_edge_cache e\n"
-         "    JOIN ancestors a ON e.child_id = a.taxon_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id IS NOT NULL\n"
+         "    )\n"
+         "    AND c.profile_id = e.profile_id AND c.descendant_id = g.id\n"
          ")\n"
+         "SELECT s.child_id, s.parent_id\n"
+         "FROM timeline_snapshot_edges s\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.stop_mya IS :timeline_value\n"
+         "UNION ALL\n"
          "SELECT e.child_id, e.parent_id\n"
          "FROM classification_edge_cache e\n"
          "WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
@@ -1651,57 +1453,52 @@ def _build_queries():
          "AND e.parent_id IN (SELECT taxon_id FROM ancestors)",
          '{"profile_id": "integer", "timeline_value": "real"}'),
 
-        ("tree_edges_by_pubyear", "Edges filtered by naming year (cumulative)",
-         "WITH RECURSIVE filtered_genera AS (\n"
-         "    SELECT t.id\n"
-         "    FROM taxon t\n"
-         "    JOIN classification_edge_cache e ON e.child_id = t.id AND e.profile_id = COALESCE(:profile_id, 1)\n"
-         "    WHERE t.rank = 'Genus'\n"
-         "    AND (:timeline_value IS NULL OR (t.year IS NOT NULL AND CAST(t.year AS INTEGER) <= :timeline_value))\n"
-         "), ancestors AS (\n"
-         "    SELECT id AS taxon_id FROM filtered_genera\n"
-         "    UNION\n"
-         "    SELECT e.parent_id\n"
-         "    FROM classification_edge_cache e\n"
-         "    JOIN ancestors a ON e.child_id = a.taxon_id\n"
-         "    WHERE e.profile_id = COALESCE(:profile_id, 1) AND e.parent_id IS NOT NULL\n"
-         ")\n"
+        ("tree_edges_by_pubyear", "Edges present by a given naming year (cumulative, via min_desc_year)",
          "SELECT e.child_id, e.parent_id\n"
-         "FROM classification_edge_cache e\n"
-         "WHERE e.profile_id = COALESCE(:profile_id, 1)\n"
-         "AND e.child_id IN (SELECT taxon_id FROM ancestors)\n"
-         "AND e.parent_id IN (SELECT taxon_id FROM ancestors)",
+         "FROM profile_node_stats s\n"
+         "JOIN classification_edge_cache e ON e.profile_id = s.profile_id AND e.child_id = s.taxon_id\n"
+         "WHERE s.profile_id = COALESCE(:profile_id, 1) AND s.min_desc_year <= :timeline_value\n"
+         "  AND e.parent_id IS NOT NULL\n"
+         "UNION ALL\n"
+         "SELECT e.child_id, e.parent_id\n"
+         "FROM profile_node_stats s\n"
+         "CROSS JOIN taxon t ON t.id = s.taxon_id\n"
+         "JOIN classification_edge_cache e ON e.profile_id = s.profile_id AND e.child_id = s.taxon_id\n"
+         "WHERE :timeline_value IS NULL AND s.profile_id = COALESCE(:profile_id, 1)\n"
+         "  AND (s.total_genera > 0 OR t.rank = 'Genus') AND e.parent_id IS NOT NULL",
          '{"profile_id": "integer", "timeline_value": "integer"}'),
 
-        ("profile_diff_edges", "Diff edges: base profile structure with change status vs compare",
+        ("timeline_frames", "Frame list for a timeline axis ('geologic' or 'pubyear') with tree sizes",
+         "SELECT f.frame, f.stop_value, f.n_nodes, f.n_edges\n"
+         "FROM timeline_frames f\n"
+         "WHERE f.profile_id = COALESCE(:profile_id, 1) AND f.axis = :axis\n"
+         "ORDER BY f.frame",
+         '{"profile_id": "integer", "axis": "text"}'),
+
+        ("timeline_node_delta", "Taxa added/removed going from frame - 1 to frame (invert ops to step back)",
+         "SELECT t.id, d.op, t.name, t.rank, t.author, t.year, t.temporal_code, t.is_valid\n"
+         "FROM timeline_node_deltas d\n"
+         "JOIN taxon t ON t.id = d.taxon_id\n"
+         "WHERE d.profile_id = COALESCE(:profile_id, 1) AND d.axis = :axis AND d.frame = :frame\n"
+         "ORDER BY d.op, t.id",
+         '{"profile_id": "integer", "axis": "text", "frame": "integer"}'),
+
+        ("timeline_edge_delta", "Edges added/removed going from frame - 1 to frame (invert ops to step back)",
+         "SELECT d.child_id, d.parent_id, d.op\n"
+         "FROM timeline_edge_deltas d\n"
+         "WHERE d.profile_id = COALESCE(:profile_id, 1) AND d.axis = :axis AND d.frame = :frame\n"
+         "ORDER BY d.op, d.child_id",
+         '{"profile_id": "integer", "axis": "text", "frame": "integer"}'),
+
+        ("profile_diff_edges", "Diff edges: base profile structure with change status vs compare (profile_diff_cache)",
          "SELECT\n"
-         "    a.child_id,\n"
-         "    a.parent_id,\n"
-         "    a.parent_id AS parent_id_a,\n"
-         "    b.parent_id AS parent_id_b,\n"
-         "    CASE\n"
-         "        WHEN b.child_id IS NULL THEN 'removed'\n"
-         "        WHEN a.parent_id != b.parent_id THEN 'moved'\n"
-         "        ELSE 'same'\n"
-         "    END AS diff_status\n"
-         "FROM classification_edge_cache a\n"
-         "LEFT JOIN classification_edge_cache b\n"
-         "    ON a.child_id = b.child_id AND b.profile_id = :compare_profile_id\n"
-         "WHERE a.profile_id = :profile_id\n"
-         "\n"
-         "UNION ALL\n"
-         "\n"
-         "SELECT\n"
-         "    b.child_id,\n"
-         "    b.parent_id,\n"
-         "    NULL AS parent_id_a,\n"
-         "    b.parent_id AS parent_id_b,\n"
-         "    'added' AS diff_status\n"
-         "FROM classification_edge_cache b\n"
-         "LEFT JOIN classification_edge_cache a\n"
-         "    ON b.child_id = a.child_id AND a.profile_id = :profile_id\n"
-         "WHERE b.profile_id = :compare_profile_id\n"
-         "    AND a.child_id IS NULL",
+         "    d.child_id,\n"
+         "    CASE WHEN d.diff_status = 'added' THEN d.parent_b ELSE d.parent_a END AS parent_id,\n"
+         "    d.parent_a AS parent_id_a,\n"
+         "    d.parent_b AS parent_id_b,\n"
+         "    d.diff_status\n"
+         "FROM profile_diff_cache d\n"
+         "WHERE d.profile_a = COALESCE(:profile_id, 0) AND d.profile_b = COALESCE(:compare_profile_id, 0)",
          '{"profile_id": "integer", "compare_profile_id": "integer"}'),
     ]
 
@@ -2062,6 +1859,7 @@ def _build_manifest():
                 },
                 "sub_queries": {
                     "children_counts": {"query": "taxon_children_counts", "params": {"taxon_id": "id"}},
+                    "age_counts": {"query": "taxon_age_counts", "params": {"taxon_id": "id"}},
                     "children": {"query": "taxon_children", "params": {"taxon_id": "id"}},
                     "assertions": {"query": "taxon_assertions", "params": {"taxon_id": "id"}},
                 },
@@ -2842,6 +2640,20 @@ def create_scoda_metadata(dst, version):
         ("assertion", "predicate+reference", "Same subject can have multiple PLACED_IN from different references"),
         ("classification_profile", None, "Named classification profiles for building different trees"),
         ("classification_edge_cache", None, "Materialized parent-child edges for a given profile"),
+        ("classification_closure", None, "Transitive closure of classification_edge_cache (ancestor, descendant, depth) per profile"),
+        ("profile_tree_index", None, "Nested-set numbering (lft, rgt, depth) of each profile tree from a pre-order walk"),
+        ("profile_node_stats", None, "Per-node genus rollups (direct, subtree total, valid) and child rank counts per profile"),
+        ("profile_node_stats", "min_desc_year", "Earliest naming year of any genus at or below the node in this profile (indexed)"),
+        ("diversity_cube", None, "Valid genus counts per (profile, grouping rank, temporal code, group taxon); backs diversity_by_age"),
+        ("profile_diff_cache", None, "Per-child edge diff (removed/added/moved/same) for every ordered pair of profiles"),
+        ("timeline_snapshot_nodes", None, "Taxa visible at each timeline_geologic_periods stop per profile (NULL stop = unfiltered)"),
+        ("timeline_snapshot_edges", None, "Parent-child edges visible at each geologic timeline stop per profile"),
+        ("timeline_frames", None, "Ordered timeline frames per profile and axis (geologic, pubyear) with node/edge counts"),
+        ("timeline_node_deltas", None, "Taxa added or removed at each timeline frame relative to the previous frame"),
+        ("timeline_edge_deltas", None, "Edges added or removed at each timeline frame relative to the previous frame"),
+        ("taxon_fts", None, "Full-text (FTS5, trigram) index of taxon name, author, type species, location and formation"),
+        ("reference_fts", None, "Full-text (FTS5, trigram) index of reference authors, title and journal"),
+        ("taxon_name_deletes", None, "Symmetric-delete keys: each lower-cased taxon name with zero or one character removed"),
         ("genus_formations", None, "Genus-Formation many-to-many junction table"),
         ("genus_locations", None, "Genus-Country/Region many-to-many junction table"),
         ("taxon_reference", None, "Taxon-Reference FK links (renamed from taxon_bibliography)"),
@@ -2928,7 +2740,19 @@ def main():
     parser.add_argument(
         "--version", default=ASSERTION_VERSION,
         help=f"Version string (default: {ASSERTION_VERSION})")
+    parser.add_argument(
+        "--merge-threshold", type=float, default=None,
+        help="Auto-merge near-duplicate taxon names scoring at or above this "
+             "similarity (0-1); default: report only")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Keep the previous DB of this version if none of its inputs changed")
+    parser.add_argument(
+        "--profile", nargs="?", const="all", choices=BuildProfiler.MODES,
+        help="Write per-phase wall/CPU/peak memory and per-statement SQL timings "
+             "next to the DB; --profile=time skips tracemalloc")
     args = parser.parse_args()
+    prof = BuildProfiler("trilobita", args.profile)
 
     version = args.version
 
@@ -2948,28 +2772,41 @@ def main():
 
     DST_DIR.mkdir(parents=True, exist_ok=True)
     dst_db = DST_DIR / f"trilobita-{version}.db"
-    if dst_db.exists():
-        dst_db.unlink()
+
+    # Every profile here mixes the canonical DB with several sources (the
+    # default profile alone reads JA2002, Adrain 2011 and canonical opinions),
+    # so all inputs are recorded as whole-build inputs: --incremental skips
+    # an up-to-date DB and otherwise falls back to a full build.
+    inputs = build_inputs(__file__, {0: [SRC_DB] + [SOURCES / f for f in required]},
+                          options={"merge_threshold": args.merge_threshold})
+    if args.incremental and stale_profiles(read_build_state(dst_db), inputs) == set():
+        print(f"trilobita v{version} is up to date: {dst_db}")
+        return
 
     src = sqlite3.connect(str(SRC_DB))
-    dst = sqlite3.connect(str(dst_db))
-    dst.execute("PRAGMA journal_mode=WAL")
+    # Built in memory; written to dst_db once the build has succeeded
+    dst = open_build_db()
     dst.execute("PRAGMA foreign_keys=ON")
+    prof.attach(src)
+    prof.attach(dst)
 
     print(f"=== Build Assertion DB v{version} (from sources) ===\n")
 
     # 1. Schema
+    prof.phase("1. schema")
     print("1. Creating schema...")
     create_schema(dst.cursor())
     dst.commit()
 
     # 2. Copy taxon
+    prof.phase("2. copy taxon")
     print("2. Copying taxon data from canonical DB...")
     n_taxon = copy_taxon(src, dst)
     dst.commit()
     print(f"   → {n_taxon} taxon records")
 
     # 3. Copy references
+    prof.phase("3. copy references")
     print("3. Copying references + inserting source references...")
     n_ref = copy_references(src, dst)
     dst.commit()
@@ -2980,12 +2817,14 @@ def main():
     print(f"     Treatise 1997 ch5 ref_id={TREATISE_1997_CH5_REF_ID}")
 
     # 4. Build taxon index
+    prof.phase("4. taxon index")
     print("4. Building taxon index...")
     taxon_index, name_index = build_taxon_index(dst)
     new_taxa_cache = {}
     print(f"   → {len(taxon_index)} indexed taxa")
 
     # 5. Process default profile sources (JA2002 + Adrain 2011)
+    prof.phase("5. default profile sources")
     print("5. Processing default profile sources...")
     default_counts, default_edges, placed_children = process_source_default(
         dst, taxon_index, name_index, new_taxa_cache)
@@ -2993,21 +2832,26 @@ def main():
     for k, v in default_counts.items():
         print(f"   → {k}: {v}")
 
+    # 5b/5c read the canonical DB set-based, attached to the assertion DB
+    dst.execute("ATTACH DATABASE ? AS canon", (str(SRC_DB),))
+
     # 5b. Fallback: canonical parent_id for genera without PLACED_IN
+    prof.phase("5b. canonical fallback")
     print("   Fallback: canonical parent_id for unplaced genera...")
-    n_fallback = fallback_canonical_parent_id(
-        src, dst, placed_children, default_edges,
-        taxon_index, name_index, new_taxa_cache)
+    n_fallback = fallback_canonical_parent_id(dst, placed_children, default_edges)
     dst.commit()
     print(f"   → {n_fallback} genera placed via canonical parent_id")
 
     # 5c. Import canonical opinions (SYNONYM_OF/SPELLING_OF)
+    prof.phase("5c. canonical opinions")
     print("   Importing canonical DB opinions...")
-    n_opinions = import_canonical_opinions(src, dst)
+    n_opinions = import_canonical_opinions(dst)
     dst.commit()
+    dst.execute("DETACH DATABASE canon")
     print(f"   → {n_opinions} additional synonym/spelling assertions")
 
     # 6. Process Treatise sources
+    prof.phase("6. treatise sources")
     print("6. Processing Treatise 1959...")
     t1959_edges = process_source_treatise(
         dst, SOURCES / "treatise_1959.txt", TREATISE_1959_REF_ID,
@@ -3034,12 +2878,14 @@ def main():
         print(f"\n   New taxa created: {len(new_taxa_cache)}")
 
     # 8. Build profiles
+    prof.phase("7. classification profiles")
     print("\n7. Building classification profiles...")
     profile_counts = build_profiles(dst, default_edges, t1959_edges,
                                     t1997_ch4_edges, t1997_ch5_edges)
     dst.commit()
 
     # 9. Junction tables
+    prof.phase("8. junction tables")
     print("\n8. Copying junction tables...")
     jcounts = copy_junction_tables(src, dst)
     dst.commit()
@@ -3047,11 +2893,13 @@ def main():
         print(f"   → {tbl}: {cnt}")
 
     # 10. Views
+    prof.phase("9. views")
     print("\n9. Creating compatibility views...")
     create_views(dst.cursor())
     dst.commit()
 
     # 10b. Build temporal_code_mya mapping table
+    prof.phase("9. temporal_code_mya")
     print("   Building temporal_code_mya table...")
     pc_db = Path(find_paleocore_db())
     dst.execute(f"ATTACH DATABASE '{pc_db}' AS pc")
@@ -3070,11 +2918,42 @@ def main():
     dst.commit()
     print(f"   → {n_tcm} temporal_code_mya mappings")
 
+    # 10c. Fuzzy name reconciliation (OCR / spelling-variant duplicates)
+    prof.phase("9. reconcile names")
+    print("   Reconciling taxon names...")
+    rec = reconcile_taxa(dst, merge_threshold=args.merge_threshold,
+                         report_path=dst_db.with_suffix(".reconcile.json"))
+    print(f"   → {rec['candidates']} near-duplicate pairs "
+          f"({rec['merged']} merged, {rec['review']} for review)")
+
+    # 10d. Materialized tree caches (read by ui_queries instead of recursive CTEs)
+    prof.phase("9. tree caches")
+    print("   Building tree caches...")
+    for tbl, cnt in build_tree_caches(dst, _build_queries()).items():
+        print(f"   → {tbl}: {cnt}")
+
+    # 10e. Full-text search indexes (read by taxon_search / reference_search)
+    prof.phase("9. search indexes")
+    print("   Building search indexes...")
+    for tbl, cnt in build_search_index(dst).items():
+        print(f"   → {tbl}: {cnt}")
+
     # 11. SCODA metadata
+    prof.phase("10. scoda metadata")
     print("10. Creating SCODA metadata...")
     create_scoda_metadata(dst, version=version)
     n_queries = dst.execute("SELECT COUNT(*) FROM ui_queries").fetchone()[0]
     print(f"   → {n_queries} ui_queries, 1 ui_manifest")
+    write_build_state(dst, inputs)
+
+    # 11b. Index policy + EXPLAIN QUERY PLAN audit (fails the build on table scans)
+    prof.phase("10. query plans")
+    print("   Checking ui_queries plans...")
+    try:
+        check_query_plans(dst, attach={"pc": find_paleocore_db()})
+    except QueryPlanError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
     # Summary
     total_assertions = dst.execute("SELECT COUNT(*) FROM assertion").fetchone()[0]
@@ -3105,6 +2984,11 @@ def main():
         print(f"    {name}: {count}")
     print(f"\nOutput: {dst_db}")
 
+    prof.phase("persist")
+    persist_build_db(dst, dst_db)
+    if args.profile:
+        for report in prof.write(dst_db):
+            print(f"Profile: {report}")
     src.close()
     dst.close()
 
@@ -5,11 +5,18 @@ All canonical DBs use {name}-{version}.db naming:
   db/trilobita-canonical-{version}.db   (legacy canonical DB, source for builds)
   db/trilobita-{version}.db             (assertion-centric DB, primary)
   db/paleocore-{version}.db
+
+as do the package DBs (db/brachiopoda-{version}.db, ...) that package_dbs(),
+previous_version() and resolve_package_dbs() look up for the scripts that
+read them (benchmarks, taxon_distance).  package_version() parses these names,
+and the dist/{name}-{version}.scoda names of the built packages alike.
 """
 
 import glob
 import os
 import re
+import sqlite3
+from pathlib import Path
 
 _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 _DB_DIR = os.path.join(_SCRIPT_DIR, '..', 'db')
@@ -17,6 +24,7 @@ _DB_DIR = os.path.join(_SCRIPT_DIR, '..', 'db')
 _TRILOBITA_RE = re.compile(r'^trilobita-(\d+\.\d+\.\d+)\.db$')
 _CANONICAL_RE = re.compile(r'^trilobita-canonical-(\d+\.\d+\.\d+)\.db$')
 _PALEOCORE_RE = re.compile(r'^paleocore-(\d+\.\d+\.\d+)\.db$')
+_PACKAGE_RE = re.compile(r'^([a-z]+)-(\d+\.\d+\.\d+)\.(?:db|scoda)$')
 
 
 def _find_latest(pattern: str, regex: re.Pattern, label: str) -> str:
@@ -66,3 +74,68 @@ def find_paleocore_db() -> str:
     return _find_latest(
         os.path.join(_DB_DIR, 'paleocore-*.db'),
         _PALEOCORE_RE, 'db/paleocore-*.db')
+
+
+# ---------------------------------------------------------------------------
+# Package DBs
+# ---------------------------------------------------------------------------
+
+def _version_key(version: str) -> tuple:
+    return tuple(int(x) for x in version.split('.'))
+
+
+def package_version(path):
+    """(package, version tuple) of a {name}-{version}.db or .scoda path, or None."""
+    m = _PACKAGE_RE.match(Path(path).name)
+    return (m.group(1), _version_key(m.group(2))) if m else None
+
+
+def package_dbs(db_dir=_DB_DIR, suffix='.db') -> dict:
+    """{package: [paths, oldest version first]} for the {name}-{version}{suffix} files."""
+    found = {}
+    for path in Path(db_dir).glob(f'*{suffix}'):
+        parsed = package_version(path)
+        if parsed:
+            found.setdefault(parsed[0], []).append((parsed[1], path))
+    return {pkg: [p for _, p in sorted(versions)] for pkg, versions in found.items()}
+
+
+def previous_version(path, db_dir=_DB_DIR):
+    """The file of the same package and suffix one version before path, or None."""
+    parsed = package_version(path)
+    if not parsed:
+        return None
+    package, version = parsed
+    older = [p for p in package_dbs(db_dir, Path(path).suffix).get(package, [])
+             if package_version(p)[1] < version]
+    return older[-1] if older else None
+
+
+def resolve_package_dbs(names, db_dir=_DB_DIR) -> list:
+    """DB paths for package names or paths (default: the latest of every package)."""
+    dbs = package_dbs(db_dir)
+    if not names:
+        return [versions[-1] for _pkg, versions in sorted(dbs.items())]
+    paths = []
+    for name in names:
+        if name in dbs:
+            paths.append(dbs[name][-1])
+        elif Path(name).exists():
+            paths.append(Path(name))
+        else:
+            raise FileNotFoundError(f"no package or DB named {name!r} in {db_dir}")
+    return paths
+
+
+def open_package(path) -> sqlite3.Connection:
+    """Read-only connection to a package DB with paleocore attached as pc.
+
+    Both are opened immutable: the package DBs are in WAL mode, and even a
+    read-only connection would leave -wal/-shm files next to them.
+    """
+    path = Path(path).resolve()
+    conn = sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True)
+    if not path.name.startswith('paleocore-'):
+        pc = Path(find_paleocore_db()).resolve()
+        conn.execute('ATTACH DATABASE ? AS pc', (f'file:{pc}?mode=ro&immutable=1',))
+    return conn
@@ -0,0 +1,303 @@
+"""
+Index advisor for package ui_queries.
+
+Every package builder calls check_query_plans() after its ui_queries table
+is written.  The stage
+
+  1. creates the covering indexes declared in INDEX_POLICY (only where the
+     table and columns exist in that package),
+  2. runs EXPLAIN QUERY PLAN on every ui_queries entry with representative
+     parameters,
+  3. reports every full table scan and temp B-tree, raising QueryPlanError
+     when a query scans a table that the policy does not allow,
+  4. runs ANALYZE so the shipped database carries planner statistics, and
+  5. times every query against a copy taken before step 1 and raises
+     QueryPlanError when the indexes and statistics made one slower.
+
+Small lookup tables (SCAN_OK_TABLES) and whole-table listing queries
+(ALLOWED_SCANS) are the only accepted scans; anything else is a regression.
+"""
+
+import json
+import re
+import sqlite3
+import time
+
+
+class QueryPlanError(RuntimeError):
+    """A ui_query plan scans a table the policy does not allow, or got slower."""
+
+
+# A query fails the latency check only when it is both MAX_SLOWDOWN times
+# slower and MIN_SLOWDOWN_MS slower than before the policy was applied, so
+# sub-millisecond timer noise on tiny packages never fails a build.
+MAX_SLOWDOWN = 1.5
+MIN_SLOWDOWN_MS = 0.5
+
+
+# (table, columns) — created as idx_<table>_<col1>_<col2>...; the column order
+# puts equality filters first and the remaining selected columns last so the
+# hot lookups are answered from the index alone.
+INDEX_POLICY = [
+    ("classification_edge_cache", ("profile_id", "parent_id", "child_id")),
+    ("classification_edge_cache", ("child_id", "profile_id", "parent_id")),
+    ("assertion", ("reference_id",)),
+    ("assertion", ("object_taxon_id", "predicate")),
+    ("assertion", ("subject_taxon_id", "predicate", "object_taxon_id")),
+    ("taxon", ("rank", "name")),
+    ("taxon", ("name",)),
+    ("taxon", ("temporal_code", "rank")),
+    ("taxon_reference", ("reference_id", "taxon_id")),
+    ("geographic_regions", ("parent_id", "level", "name")),
+]
+
+# Tables with at most a few hundred rows; scanning them is cheaper than an
+# index probe and never worth flagging.
+SCAN_OK_TABLES = {
+    "classification_profile", "temporal_code_mya", "temporal_ranges",
+    "artifact_metadata", "provenance", "schema_descriptions",
+    "ui_display_intent", "ui_queries", "ui_manifest", "editable_entities",
+    "countries", "geographic_regions", "ics_chronostrat", "cow_states",
+    "country_cow_mapping", "temporal_ics_mapping",
+    "pc.countries", "pc.geographic_regions", "pc.ics_chronostrat",
+    "pc.temporal_ranges", "pc.temporal_ics_mapping",
+}
+
+# Listing queries that return (almost) a whole table by design.
+ALLOWED_SCANS = {
+    "assertion_list": {"assertion"},
+    "formations_list": {"formations", "pc.formations"},
+    "radial_tree_nodes": {"taxon"},
+    "reference_list": {"reference"},
+    "taxonomy_tree": {"taxon"},
+}
+
+# Defaults by parameter name, then by declared type
+_PARAM_DEFAULTS = {
+    "profile_id": 1, "compare_profile_id": 2,
+    "grouping_rank": "Order", "rank": "Genus", "axis": "geologic",
+    "timeline_value": 500.0, "frame": 1, "temporal_code": "LCAM",
+    "q": "ab", "query": "ab", "name": "ab", "k": 10, "limit": 20,
+}
+_TYPE_DEFAULTS = {"integer": 1, "real": 1.0, "text": "a"}
+
+_PARAM_RE = re.compile(r"(?<!:):([A-Za-z_]\w*)")
+_FROM_RE = re.compile(
+    r"\b(?:FROM|JOIN)\s+([\w.]+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|LEFT\b|INNER\b|CROSS\b"
+    r"|GROUP\b|ORDER\b|USING\b|NATURAL\b|UNION\b|LIMIT\b)(\w+))?", re.IGNORECASE)
+_CTE_RE = re.compile(r"\b(\w+)\s*(?:\([\w\s,]*\))?\s+AS\s*\(", re.IGNORECASE)
+
+
+# ---------------------------------------------------------------------------
+# Index policy
+# ---------------------------------------------------------------------------
+
+def table_columns(conn, table):
+    """Column names of table ('schema.table' allowed); empty when it does not exist."""
+    schema, _, name = table.rpartition(".")
+    prefix = f"{schema}." if schema else ""
+    return {r[1] for r in conn.execute(f"PRAGMA {prefix}table_info({name})")}
+
+
+def apply_index_policy(conn, policy=INDEX_POLICY):
+    """Create the policy indexes this package's schema supports. Returns names created."""
+    created = []
+    for table, cols in policy:
+        have = table_columns(conn, f"main.{table}")
+        if not have or not set(cols) <= have:
+            continue
+        name = f"idx_{table}_{'_'.join(cols)}"
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+            (name,)).fetchone()
+        if exists:
+            continue
+        conn.execute(f"CREATE INDEX {name} ON {table}({', '.join(cols)})")
+        created.append(name)
+    conn.commit()
+    return created
+
+
+# ---------------------------------------------------------------------------
+# Plan audit
+# ---------------------------------------------------------------------------
+
+def query_params(sql):
+    """Names of the :params in sql, each once, in order of appearance."""
+    return list(dict.fromkeys(_PARAM_RE.findall(sql)))
+
+
+def representative_params(sql, params_json=None):
+    """Bind every :param in sql to a plausible value (plans do not depend on it)."""
+    declared = {}
+    if params_json:
+        spec = json.loads(params_json)
+        if isinstance(spec, dict):
+            declared = spec
+    params = {}
+    for name in _PARAM_RE.findall(sql):
+        if name in _PARAM_DEFAULTS:
+            params[name] = _PARAM_DEFAULTS[name]
+        else:
+            params[name] = _TYPE_DEFAULTS.get(declared.get(name), 1)
+    return params
+
+
+def alias_map(sql):
+    """{alias_or_name: table} for the FROM/JOIN items of sql."""
+    aliases = {}
+    for table, alias in _FROM_RE.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def explain_query(conn, name, sql, params_json=None):
+    """Return [(kind, table, detail)] findings for one query.
+
+    kind is 'scan' for a full scan of a base table and 'temp_btree' for a
+    sort or DISTINCT that needs a temporary B-tree.
+    """
+    ctes = {c.lower() for c in _CTE_RE.findall(sql)}
+    aliases = alias_map(sql)
+    findings = []
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql,
+                        representative_params(sql, params_json)).fetchall()
+    for _id, _parent, _notused, detail in plan:
+        if detail.startswith("USE TEMP B-TREE"):
+            findings.append(("temp_btree", None, detail))
+            continue
+        m = re.match(r"SCAN (\S+)", detail)
+        if not m or detail.startswith("SCAN CONSTANT ROW"):
+            continue
+        obj = m.group(1)
+        if obj.startswith("(") or obj.lower() in ctes or "VIRTUAL TABLE" in detail:
+            continue
+        table = aliases.get(obj, obj)
+        if table.lower() in ctes:
+            continue
+        findings.append(("scan", table, detail))
+    return findings
+
+
+def audit_ui_queries(conn):
+    """EXPLAIN every ui_queries entry. Returns {query_name: findings}."""
+    report = {}
+    for name, sql, params_json in conn.execute(
+            "SELECT name, sql, params_json FROM ui_queries ORDER BY name").fetchall():
+        findings = explain_query(conn, name, sql, params_json)
+        if findings:
+            report[name] = findings
+    return report
+
+
+def time_ui_queries(conns, runs=3, names=None):
+    """Best-of-runs latency in ms of the ui_queries entries on each connection.
+
+    The connections take turns on every run so a load spike on the machine
+    hits them alike.  Uses representative_params(); queries that fail with
+    those parameters are left out.  Returns one {name: ms} per connection.
+    """
+    timings = [{} for _ in conns]
+    for name, sql, params_json in conns[0].execute(
+            "SELECT name, sql, params_json FROM ui_queries ORDER BY name").fetchall():
+        if names is not None and name not in names:
+            continue
+        params = representative_params(sql, params_json)
+        try:
+            for _ in range(runs):
+                for conn, best in zip(conns, timings):
+                    t0 = time.perf_counter()
+                    conn.execute(sql, params).fetchall()
+                    elapsed = (time.perf_counter() - t0) * 1000
+                    best[name] = min(best.get(name, elapsed), elapsed)
+        except sqlite3.Error:
+            for best in timings:
+                best.pop(name, None)
+    return timings
+
+
+def slower_queries(before, after):
+    """{name: (before_ms, after_ms)} for queries beyond the slowdown limits."""
+    return {name: (before[name], ms) for name, ms in after.items()
+            if name in before
+            and ms > before[name] * MAX_SLOWDOWN
+            and ms - before[name] > MIN_SLOWDOWN_MS}
+
+
+def latency_regressions(before, after, runs=3):
+    """slower_queries() of the ui_queries on connection after vs before.
+
+    Queries that look slower are timed again with three times the runs, and
+    only those still slower are returned.
+    """
+    slow = slower_queries(*time_ui_queries([before, after], runs))
+    if slow:
+        slow = slower_queries(*time_ui_queries([before, after], runs * 3, set(slow)))
+    return slow
+
+
+def disallowed_scans(report):
+    """Filter an audit report down to the scans the policy does not accept."""
+    bad = {}
+    for name, findings in report.items():
+        allowed = ALLOWED_SCANS.get(name, set())
+        scans = [f for f in findings
+                 if f[0] == "scan" and f[1] not in SCAN_OK_TABLES and f[1] not in allowed]
+        if scans:
+            bad[name] = scans
+    return bad
+
+
+def check_query_plans(conn, attach=None, verbose=True):
+    """Apply INDEX_POLICY, audit all ui_queries and fail on scans or slowdowns.
+
+    attach maps schema aliases to database paths (e.g. {"pc": paleocore_db})
+    for queries that read an attached package.  Every query is also timed
+    on a copy taken before the indexes were created; a query that got slower
+    raises QueryPlanError.  Returns the audit report.
+    """
+    # The pre-policy copy that the latency check compares against; backup()
+    # waits forever on a source with an open write transaction.
+    conn.commit()
+    baseline = sqlite3.connect(":memory:")
+    conn.backup(baseline)
+    attached = []
+    for alias, path in (attach or {}).items():
+        for c in (conn, baseline):
+            c.execute(f"ATTACH DATABASE '{path}' AS {alias}")
+        attached.append(alias)
+    try:
+        created = apply_index_policy(conn)
+        report = audit_ui_queries(conn)
+        # Statistics are gathered only after the audit: the check is against
+        # the schema, so a single-profile package cannot hide a missing index
+        # behind a cheap-looking scan, while the shipped DB still gets
+        # planner stats.
+        conn.execute("ANALYZE main")
+        conn.commit()
+        slow = latency_regressions(baseline, conn)
+    finally:
+        baseline.close()
+        for alias in attached:
+            conn.execute(f"DETACH DATABASE {alias}")
+
+    if verbose:
+        n_scan = sum(1 for f in report.values() for k, _, _ in f if k == "scan")
+        n_tmp = sum(1 for f in report.values() for k, _, _ in f if k == "temp_btree")
+        print(f"  Index policy: {len(created)} indexes created")
+        print(f"  Query plans: {n_scan} table scans, {n_tmp} temp B-trees "
+              f"in {len(report)} queries")
+    bad = disallowed_scans(report)
+    if bad:
+        lines = [f"    {name}: {detail}" for name, scans in sorted(bad.items())
+                 for _, _, detail in scans]
+        raise QueryPlanError(
+            "ui_queries regressed to full table scans:\n" + "\n".join(lines))
+    if slow:
+        lines = [f"    {name}: {b:.2f} ms -> {a:.2f} ms"
+                 for name, (b, a) in sorted(slow.items())]
+        raise QueryPlanError(
+            "ui_queries got slower with the index policy:\n" + "\n".join(lines))
+    return report
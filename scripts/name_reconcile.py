@@ -0,0 +1,268 @@
+"""
+Build-time fuzzy reconciliation of taxon names.
+
+resolve_taxon() in the builders only matches on exact name.lower(), so an
+OCR-damaged or variant spelling in one source volume silently becomes a
+second taxon.  Every package builder calls reconcile_taxa() once all sources
+are loaded (before the tree caches are derived):
+
+  1. Blocking — each taxon gets a phonetic key (Latin-aware consonant
+     skeleton) and MINHASH_BANDS band keys from a MinHash signature of its
+     name trigrams.  Only taxa of the same rank that share a block are
+     compared, so the work grows with the block sizes, not n².
+  2. Scoring — 1 - OSA edit distance / longer name length, lowered by
+     AUTHOR_MISMATCH_PENALTY when both taxa carry different authors.
+     Pairs already linked by an assertion (SPELLING_OF, SYNONYM_OF, ...)
+     are known variants and are never proposed.
+  3. Resolution — pairs scoring >= merge_threshold are merged (every column
+     that REFERENCES taxon(id) is re-pointed to the kept taxon); pairs
+     >= review_threshold are written to a JSON review report.
+
+Auto-merge is off unless a threshold is given: genera legitimately differ
+by a single letter (Spirifer / Spirifera), so the report is the default.
+"""
+
+import json
+import re
+import zlib
+from collections import defaultdict
+
+REVIEW_THRESHOLD = 0.85
+AUTHOR_MISMATCH_PENALTY = 0.1
+MIN_NAME_LENGTH = 4
+
+# MinHash over name trigrams: MINHASH_BANDS band keys of MINHASH_ROWS hashes
+MINHASH_BANDS = 4
+MINHASH_ROWS = 3
+# (a, b) of the universal hash family (a*h + b) mod p, one pair per MinHash row
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_PARAMS = [((i + 1) * 0x9E3779B97F4A7C15 % _MINHASH_PRIME,
+                    (i + 7) * 0xC2B2AE3D27D4EB4F % _MINHASH_PRIME)
+                   for i in range(MINHASH_BANDS * MINHASH_ROWS)]
+# Blocks larger than this are skipped (a degenerate key would go quadratic)
+MAX_BLOCK_SIZE = 100
+
+# Latin/Greek orthographic variants folded by the phonetic key
+_PHONETIC_FOLDS = (
+    ("ae", "e"), ("oe", "e"), ("ph", "f"), ("th", "t"), ("ch", "c"),
+    ("rh", "r"), ("k", "c"), ("y", "i"), ("j", "i"), ("z", "s"),
+)
+_NON_ALPHA_RE = re.compile(r"[^a-z]")
+_DOUBLE_RE = re.compile(r"(.)\1+")
+_VOWEL_RE = re.compile(r"[aeiou]")
+
+
+def phonetic_key(name):
+    """Consonant skeleton of a name after folding Latin spelling variants."""
+    s = _NON_ALPHA_RE.sub("", name.lower())
+    for a, b in _PHONETIC_FOLDS:
+        s = s.replace(a, b)
+    s = _DOUBLE_RE.sub(r"\1", s)
+    return s[:1] + _VOWEL_RE.sub("", s[1:])
+
+
+def trigrams(name):
+    s = f"  {name.lower()} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def minhash_bands(name):
+    """Band keys of the MinHash signature of the name's trigram set."""
+    hashes = [zlib.crc32(g.encode()) for g in trigrams(name)]
+    sig = [min((a * h + b) % _MINHASH_PRIME for h in hashes)
+           for a, b in _MINHASH_PARAMS]
+    return [tuple(sig[b * MINHASH_ROWS:(b + 1) * MINHASH_ROWS])
+            for b in range(MINHASH_BANDS)]
+
+
+def osa_distance(a, b, limit=None):
+    """Optimal string alignment distance (Levenshtein + adjacent swaps).
+
+    With limit, gives up and returns limit + 1 once every alignment of the
+    current row already costs more than limit.
+    """
+    if a == b:
+        return 0
+    if limit is not None and abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2]
+                    and a[i - 2] == b[j - 1]):
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if limit is not None and min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[len(b)]
+
+
+def name_similarity(a, b, min_score=0.0):
+    """1 - edit distance / longer length; anything below min_score may come back as 0."""
+    a, b = a.lower(), b.lower()
+    longest = max(len(a), len(b), 1)
+    limit = int((1.0 - min_score) * longest)
+    d = osa_distance(a, b, limit)
+    return 0.0 if d > limit else 1.0 - d / longest
+
+
+def _norm_author(author):
+    return _NON_ALPHA_RE.sub("", (author or "").lower())
+
+
+# ---------------------------------------------------------------------------
+# Candidate search
+# ---------------------------------------------------------------------------
+
+def candidate_pairs(taxa, review_threshold=REVIEW_THRESHOLD, linked=frozenset()):
+    """Score same-rank taxa sharing a block.
+
+    taxa is [(id, name, rank, author)]; linked holds frozenset({a, b}) pairs to
+    skip.  Returns ([(score, id_a, id_b)] sorted best first, stats dict).
+    """
+    by_id = {t[0]: t for t in taxa}
+    grams = {}
+    blocks = defaultdict(list)
+    for taxon_id, name, rank, _author in taxa:
+        if not name or len(name) < MIN_NAME_LENGTH:
+            continue
+        grams[taxon_id] = trigrams(name)
+        blocks[(rank, "p", phonetic_key(name))].append(taxon_id)
+        for band, key in enumerate(minhash_bands(name)):
+            blocks[(rank, band, key)].append(taxon_id)
+
+    seen = set()
+    scored = []
+    skipped = 0
+    for members in blocks.values():
+        if len(members) < 2:
+            continue
+        if len(members) > MAX_BLOCK_SIZE:
+            skipped += 1
+            continue
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                pair = (a, b) if a < b else (b, a)
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                if frozenset(pair) in linked:
+                    continue
+                ta, tb = by_id[pair[0]], by_id[pair[1]]
+                # q-gram lemma: k edits change at most 3k trigrams
+                ga, gb = grams[pair[0]], grams[pair[1]]
+                k = int((1.0 - review_threshold) * max(len(ta[1]), len(tb[1])))
+                if len(ga & gb) < max(len(ga), len(gb)) - 3 * k:
+                    continue
+                score = name_similarity(ta[1], tb[1], review_threshold)
+                auth_a, auth_b = _norm_author(ta[3]), _norm_author(tb[3])
+                if auth_a and auth_b and auth_a != auth_b:
+                    score -= AUTHOR_MISMATCH_PENALTY
+                if score >= review_threshold:
+                    scored.append((round(score, 4), pair[0], pair[1]))
+    scored.sort(key=lambda s: (-s[0], s[1], s[2]))
+    stats = {"blocks": sum(1 for m in blocks.values() if len(m) > 1),
+             "compared": len(seen), "oversized_blocks": skipped}
+    return scored, stats
+
+
+# ---------------------------------------------------------------------------
+# Merge
+# ---------------------------------------------------------------------------
+
+def _taxon_references(conn):
+    """[(table, column)] of every column declared REFERENCES taxon(id)."""
+    refs = []
+    for (table,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%'").fetchall():
+        for fk in conn.execute(f"PRAGMA foreign_key_list([{table}])"):
+            if fk[2] == "taxon" and fk[4] in ("id", None):
+                refs.append((table, fk[3]))
+    return refs
+
+
+def merge_taxa(conn, keep_id, drop_id, refs=None):
+    """Fold taxon drop_id into keep_id and delete it.
+
+    References are re-pointed with UPDATE OR IGNORE; rows that would then
+    duplicate an existing row, or point a taxon at itself, are dropped.
+    Empty columns of the kept taxon are filled from the dropped one.
+    """
+    refs = _taxon_references(conn) if refs is None else refs
+    by_table = defaultdict(list)
+    for table, col in refs:
+        by_table[table].append(col)
+    for table, cols in by_table.items():
+        for col in cols:
+            conn.execute(f"UPDATE OR IGNORE [{table}] SET {col} = ? WHERE {col} = ?",
+                         (keep_id, drop_id))
+            conn.execute(f"DELETE FROM [{table}] WHERE {col} = ?", (drop_id,))
+        for i, a in enumerate(cols):
+            for b in cols[i + 1:]:
+                conn.execute(f"DELETE FROM [{table}] WHERE {a} = ? AND {b} = ?",
+                             (keep_id, keep_id))
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(taxon)")
+            if r[1] not in ("id", "name", "rank", "created_at")]
+    sets = ", ".join(
+        f"{c} = COALESCE(NULLIF({c}, ''), (SELECT {c} FROM taxon WHERE id = :drop))"
+        for c in cols)
+    conn.execute(f"UPDATE taxon SET {sets} WHERE id = :keep",
+                 {"keep": keep_id, "drop": drop_id})
+    conn.execute("DELETE FROM taxon WHERE id = ?", (drop_id,))
+
+
+def reconcile_taxa(conn, merge_threshold=None, review_threshold=REVIEW_THRESHOLD,
+                   report_path=None):
+    """Find near-duplicate taxa; merge the strongest, report the rest.
+
+    Returns a summary dict (candidates, merged, review, blocks, compared).
+    """
+    taxa = conn.execute(
+        "SELECT id, name, rank, author FROM taxon "
+        "WHERE COALESCE(is_placeholder, 0) = 0").fetchall()
+    linked = {frozenset((s, o)) for s, o in conn.execute(
+        "SELECT subject_taxon_id, object_taxon_id FROM assertion "
+        "WHERE object_taxon_id IS NOT NULL")}
+    pairs, stats = candidate_pairs(taxa, review_threshold, linked)
+
+    by_id = {t[0]: t for t in taxa}
+    refs = _taxon_references(conn)
+    weight = defaultdict(int)
+    for table, col in refs:
+        for taxon_id, n in conn.execute(
+                f"SELECT {col}, COUNT(*) FROM [{table}] WHERE {col} IS NOT NULL GROUP BY {col}"):
+            weight[taxon_id] += n
+
+    merged, review, gone = [], [], set()
+    for score, a, b in pairs:
+        entry = {"score": score,
+                 "a": {"id": a, "name": by_id[a][1], "author": by_id[a][3]},
+                 "b": {"id": b, "name": by_id[b][1], "author": by_id[b][3]},
+                 "rank": by_id[a][2]}
+        if merge_threshold is not None and score >= merge_threshold \
+                and a not in gone and b not in gone:
+            # keep a name without a '?' qualifier, then the better-attested
+            # taxon (more references), then the older id
+            keep, drop = sorted((a, b), key=lambda t: (
+                by_id[t][1].startswith("?"), -weight[t], t))
+            merge_taxa(conn, keep, drop, refs)
+            gone.add(drop)
+            weight[keep] += weight.pop(drop, 0)
+            entry["kept"] = keep
+            merged.append(entry)
+        else:
+            review.append(entry)
+    conn.commit()
+
+    if report_path is not None:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump({"merge_threshold": merge_threshold,
+                       "review_threshold": review_threshold,
+                       "stats": stats, "merged": merged, "review": review},
+                      f, ensure_ascii=False, indent=2)
+    return {"candidates": len(pairs), "merged": len(merged),
+            "review": len(review), **stats}
@@ -0,0 +1,186 @@
+"""
+Full-text search indexes over taxon and reference.
+
+Every package builder calls build_search_index() once its taxon and
+reference rows are final.  The search ui_queries MATCH against these FTS5
+tables and rank by bm25() instead of scanning taxon with LIKE '%...%'.
+
+Tables (external-content FTS5 with the trigram tokenizer, so any substring
+of three or more characters matches, case-insensitively):
+  taxon_fts      (name, author, type_species, location, formation)  rowid = taxon.id
+  reference_fts  (authors, title, journal)                           rowid = reference.id
+
+AFTER INSERT/UPDATE/DELETE triggers on taxon and reference keep them in
+step with rows edited after the build (both are editable entities).
+
+plus a symmetric-delete (SymSpell) table for typo-tolerant name lookup:
+  taxon_name_deletes  (del_key, taxon_id, n_deleted)
+
+taxon_name_deletes holds every lower-cased taxon.name with up to
+NAME_DELETE_DISTANCE characters removed.  taxon_name_lookup (NAME_LOOKUP_SQL)
+deletes up to two characters from the typed name in SQL and joins on
+del_key, so a lookup is a few dozen index probes instead of Levenshtein
+against every name.  That finds every name within one edit (insertion,
+deletion, substitution, adjacent swap) and two-edit variants where the
+typed name has an extra letter, while keeping the table to ~12 rows per
+name.  Shared delete keys only bound the distance from below ('abcd' and
+'cdab' share 'ab'), so each candidate is then scored by its true optimal
+string alignment (Damerau-Levenshtein without repeated edits) distance,
+and only those within LOOKUP_DISTANCE are returned.
+"""
+
+# fts table -> (content table, indexed columns)
+SEARCH_TABLES = {
+    "taxon_fts": ("taxon", ("name", "author", "type_species", "location", "formation")),
+    "reference_fts": ("reference", ("authors", "title", "journal")),
+}
+
+# Deletions stored per name; the lookup query adds up to two on its side.
+NAME_DELETE_DISTANCE = 1
+
+# Largest edit distance taxon_name_lookup returns
+LOOKUP_DISTANCE = 2
+
+# ui_query taxon_name_lookup (:q, :rank, :limit) of every package
+NAME_LOOKUP_SQL = (
+    "WITH RECURSIVE\n"
+    "pos(i) AS (\n"
+    "    SELECT 1 UNION ALL SELECT i + 1 FROM pos WHERE i < length(:q)\n"
+    "),\n"
+    "typed(del_key, n_deleted) AS (\n"
+    "    SELECT lower(:q), 0\n"
+    "    UNION\n"
+    "    SELECT substr(y.del_key, 1, p.i - 1) || substr(y.del_key, p.i + 1), y.n_deleted + 1\n"
+    "    FROM typed y JOIN pos p ON p.i <= length(y.del_key)\n"
+    "    WHERE y.n_deleted < 2\n"
+    "),\n"
+    "hits(taxon_id, deletes) AS (\n"
+    "    SELECT d.taxon_id, MIN(y.n_deleted + d.n_deleted)\n"
+    "    FROM typed y\n"
+    "    JOIN taxon_name_deletes d ON d.del_key = y.del_key\n"
+    "    GROUP BY d.taxon_id\n"
+    "),\n"
+    "-- Optimal string alignment distance of each candidate, one DP cell per step;\n"
+    "-- rows are strings of cell values as digits (capped at 9)\n"
+    "osa(taxon_id, s, t, i, j, row2, row1, cur) AS (\n"
+    "    SELECT h.taxon_id, lower(:q), lower(t.name), 1, 1, '',\n"
+    "           substr('0123456789' || replace(hex(zeroblob(length(t.name))), '00', '9'),\n"
+    "                  1, length(t.name) + 1), '1'\n"
+    "    FROM hits h JOIN taxon t ON t.id = h.taxon_id\n"
+    "    -- rank filter here, not on the final join: there it makes SQLite build\n"
+    "    -- a bloom filter over the whole taxon table once ANALYZE stats exist\n"
+    "    WHERE :rank IS NULL OR t.rank = :rank\n"
+    "    UNION ALL\n"
+    "    SELECT taxon_id, s, t,\n"
+    "           CASE WHEN j > length(t) THEN i + 1 ELSE i END,\n"
+    "           CASE WHEN j > length(t) THEN 1 ELSE j + 1 END,\n"
+    "           CASE WHEN j > length(t) THEN row1 ELSE row2 END,\n"
+    "           CASE WHEN j > length(t) THEN cur ELSE row1 END,\n"
+    "           CASE WHEN j > length(t) THEN char(48 + min(i + 1, 9))\n"
+    "           ELSE cur || char(48 + min(9,\n"
+    "               unicode(substr(row1, j + 1, 1)) - 47,\n"
+    "               unicode(substr(cur, j, 1)) - 47,\n"
+    "               unicode(substr(row1, j, 1)) - 48 + (substr(s, i, 1) <> substr(t, j, 1)),\n"
+    "               CASE WHEN i > 1 AND j > 1 AND substr(s, i, 1) = substr(t, j - 1, 1)\n"
+    "                         AND substr(s, i - 1, 1) = substr(t, j, 1)\n"
+    "                    THEN unicode(substr(row2, j - 1, 1)) - 47 ELSE 9 END)) END\n"
+    "    FROM osa\n"
+    "    WHERE i < length(s) OR j <= length(t)\n"
+    "),\n"
+    "scored(taxon_id, distance) AS (\n"
+    "    SELECT taxon_id, unicode(substr(cur, length(t) + 1, 1)) - 48\n"
+    "    FROM osa WHERE i = length(s) AND j > length(t)\n"
+    ")\n"
+    "SELECT t.id, t.name, t.rank, t.author, t.year, t.is_valid, sc.distance\n"
+    "FROM scored sc\n"
+    "JOIN hits h ON h.taxon_id = sc.taxon_id\n"
+    "JOIN taxon t ON t.id = sc.taxon_id\n"
+    f"WHERE sc.distance <= {LOOKUP_DISTANCE}\n"
+    "ORDER BY sc.distance, h.deletes, abs(length(t.name) - length(:q)), t.name\n"
+    "LIMIT COALESCE(:limit, 10)")
+NAME_LOOKUP_PARAMS = '{"q": "text", "rank": "text", "limit": "integer"}'
+
+
+def name_deletes(name, max_deletes=NAME_DELETE_DISTANCE):
+    """{variant: n_deleted} for name with up to max_deletes characters removed."""
+    variants = {name: 0}
+    frontier = [name]
+    for n in range(1, max_deletes + 1):
+        nxt = []
+        for word in frontier:
+            for i in range(len(word)):
+                key = word[:i] + word[i + 1:]
+                if key not in variants:
+                    variants[key] = n
+                    nxt.append(key)
+        frontier = nxt
+    return variants
+
+
+def build_name_deletes(conn):
+    """(Re)create taxon_name_deletes from taxon.name. Returns the row count."""
+    conn.execute("DROP TABLE IF EXISTS taxon_name_deletes")
+    conn.execute("""
+        CREATE TABLE taxon_name_deletes (
+            del_key TEXT NOT NULL,
+            taxon_id INTEGER NOT NULL,
+            n_deleted INTEGER NOT NULL,
+            PRIMARY KEY (del_key, taxon_id)
+        ) WITHOUT ROWID
+    """)
+    rows = []
+    for taxon_id, name in conn.execute("SELECT id, name FROM taxon WHERE name IS NOT NULL"):
+        for key, n in name_deletes(name.lower()).items():
+            rows.append((key, taxon_id, n))
+    conn.executemany("INSERT INTO taxon_name_deletes VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+def _sync_triggers(fts, table, cols):
+    """DDL of the triggers mirroring writes to table into its external-content fts table."""
+    names = ", ".join(cols)
+    new = ", ".join(f"new.{c}" for c in cols)
+    old = ", ".join(f"old.{c}" for c in cols)
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+        INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});
+    END;
+    CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});
+    END;
+    CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF id, {names} ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});
+        INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});
+    END;
+    """
+
+
+def drop_search_triggers(conn):
+    """Stop mirroring taxon/reference writes into the FTS tables."""
+    for fts in SEARCH_TABLES:
+        for suffix in ("ai", "ad", "au"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+
+
+def create_search_triggers(conn):
+    """(Re)install the sync triggers of the FTS tables that exist."""
+    for fts, (table, cols) in SEARCH_TABLES.items():
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone():
+            conn.executescript(_sync_triggers(fts, table, cols))
+
+
+def build_search_index(conn):
+    """(Re)create the FTS5 and name-delete tables from the current rows. Returns {table: rows}."""
+    counts = {}
+    drop_search_triggers(conn)
+    for fts, (table, cols) in SEARCH_TABLES.items():
+        conn.execute(f"DROP TABLE IF EXISTS {fts}")
+        conn.execute(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({', '.join(cols)}, "
+            f"content='{table}', content_rowid='id', tokenize='trigram')")
+        conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        counts[fts] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    create_search_triggers(conn)
+    counts["taxon_name_deletes"] = build_name_deletes(conn)
+    conn.commit()
+    return counts
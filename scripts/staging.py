@@ -0,0 +1,132 @@
+"""
+In-memory build staging for the package builders.
+
+process_source() used to round-trip every placement through SQLite: an
+INSERT for each new taxon, up to four fill-if-empty UPDATEs and one or more
+assertion INSERTs.  The builders now stage that work in a BuildStage:
+
+  - add_taxon() hands out taxon ids locally (same sequence AUTOINCREMENT
+    would produce) and keeps the new row in memory,
+  - fill()/set() apply the old UPDATE semantics to the in-memory row
+    (a fill only lands while the column is NULL or blank),
+  - add_assertion() queues the row,
+
+and flush() writes the lot with three executemany batches.  A builder must
+flush before SQL reads or references the staged taxa (the edge cache has
+foreign keys to taxon).
+
+The whole build runs against an in-memory database (open_build_db()) that
+persist_build_db() writes out with the backup API once the build succeeded,
+so a failed build no longer leaves a half-written DB behind.
+"""
+
+import os
+import sqlite3
+from pathlib import Path
+
+# Columns process_source() fills after a taxon is created
+STAGED_COLUMNS = ("author", "year", "temporal_code", "location", "type_species", "is_valid")
+
+
+class BuildStage:
+    """Staged taxa and assertions of a build, written by flush()."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        have = {r[1] for r in conn.execute("PRAGMA table_info(taxon)")}
+        self.columns = [c for c in STAGED_COLUMNS if c in have]
+        self.rows = {}          # taxon id -> {column: value}
+        self.new_taxa = []      # (id, name, rank, is_placeholder) not yet written
+        self.changed = set()    # ids of written taxa with changed columns
+        self.assertions = []
+        self._next_id = None
+        for row in conn.execute(f"SELECT id, {', '.join(self.columns)} FROM taxon"):
+            self.rows[row[0]] = dict(zip(self.columns, row[1:]))
+
+    def _row(self, taxon_id):
+        row = self.rows.get(taxon_id)
+        if row is None:
+            # inserted by plain SQL since the stage was loaded
+            values = self.conn.execute(
+                f"SELECT {', '.join(self.columns)} FROM taxon WHERE id = ?",
+                (taxon_id,)).fetchone()
+            row = self.rows[taxon_id] = dict(zip(self.columns, values))
+        return row
+
+    def add_taxon(self, name, rank, is_placeholder=0):
+        """Stage a new taxon (is_valid = 1) and return its id."""
+        if self._next_id is None:
+            seq = self.conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'taxon'").fetchone()
+            top = self.conn.execute("SELECT MAX(id) FROM taxon").fetchone()[0]
+            self._next_id = max(seq[0] if seq else 0, top or 0) + 1
+        taxon_id = self._next_id
+        self._next_id += 1
+        self.new_taxa.append((taxon_id, name, rank, is_placeholder))
+        row = self.rows[taxon_id] = dict.fromkeys(self.columns)
+        if "is_valid" in row:
+            row["is_valid"] = 1
+        return taxon_id
+
+    def fill(self, taxon_id, column, value, blank=("",)):
+        """UPDATE ... SET column = value WHERE column IS NULL (or one of blank)."""
+        current = self._row(taxon_id)[column]
+        if current is None or current in blank:
+            self.set(taxon_id, column, value)
+
+    def set(self, taxon_id, column, value):
+        self._row(taxon_id)[column] = value
+        self.changed.add(taxon_id)
+
+    def add_assertion(self, subject_id, predicate, object_id, reference_id,
+                      status="asserted", synonym_type=None, notes=None):
+        self.assertions.append((subject_id, predicate, object_id, reference_id,
+                                status, synonym_type, notes))
+
+    def flush(self):
+        """Write staged taxa, column changes and assertions. Returns the row counts."""
+        cols = ", ".join(self.columns)
+        marks = ", ".join("?" * len(self.columns))
+        new_ids = {t[0] for t in self.new_taxa}
+        self.conn.executemany(f"""
+            INSERT INTO taxon (id, name, rank, is_placeholder, {cols}, created_at)
+            VALUES (?, ?, ?, ?, {marks}, CURRENT_TIMESTAMP)
+        """, [(*t, *(self.rows[t[0]][c] for c in self.columns)) for t in self.new_taxa])
+        updated = sorted(self.changed - new_ids)
+        self.conn.executemany(
+            f"UPDATE taxon SET {', '.join(f'{c} = ?' for c in self.columns)} WHERE id = ?",
+            [(*(self.rows[t][c] for c in self.columns), t) for t in updated])
+        self.conn.executemany("""
+            INSERT OR IGNORE INTO assertion
+                (subject_taxon_id, predicate, object_taxon_id, reference_id,
+                 assertion_status, curation_confidence, synonym_type, notes)
+            VALUES (?, ?, ?, ?, ?, 'high', ?, ?)
+        """, self.assertions)
+        self.conn.commit()
+        counts = {"taxon": len(self.new_taxa), "updated": len(updated),
+                  "assertion": len(self.assertions)}
+        self.new_taxa, self.changed, self.assertions = [], set(), []
+        # plain SQL may insert taxa between flushes; re-read the next id
+        self._next_id = None
+        return counts
+
+
+def open_build_db():
+    """In-memory connection for a build (see persist_build_db())."""
+    return sqlite3.connect(":memory:")
+
+
+def persist_build_db(conn, dst_path):
+    """Write the in-memory build DB to dst_path, replacing it atomically."""
+    dst_path = Path(dst_path)
+    tmp = dst_path.with_name(dst_path.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    out = sqlite3.connect(str(tmp))
+    try:
+        conn.backup(out)
+        out.execute("PRAGMA journal_mode=WAL")
+    finally:
+        out.close()
+    for suffix in ("-wal", "-shm"):
+        Path(f"{dst_path}{suffix}").unlink(missing_ok=True)
+    os.replace(tmp, dst_path)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Pairwise taxonomic distances between sets of genera.
+
+A genus set is the `id` column of any ui_query of the package (formation_genera,
+family_genera, country_genera, chronostrat_genera, ...) or an explicit id list,
+so every list the viewer can show can be compared.  For one profile it gives
+the lowest common ancestor and the path length (edges via that ancestor) of
+every pair, as len(rows) x len(columns) matrices from tree_engine's Euler-tour
+RMQ: a 10k x 10k matrix takes seconds and no per-pair SQL.  Taxa in different
+trees of the profile get -1; set members the profile does not place are
+dropped and reported.
+
+Output: CSV pairs (default, to stdout; a single set gives each unordered pair
+once), .json, or .npz (ids, names, lca and distance matrices; use it for large
+sets).
+
+Usage:
+  python scripts/taxon_distance.py trilobita formation_genera formation_id=12
+  python scripts/taxon_distance.py brachiopoda family_genera family_id=40 --profile 2 -o fam.npz
+  python scripts/taxon_distance.py trilobita --ids 101,102,230 --vs formation_genera formation_id=3
+"""
+
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from db_path import open_package, resolve_package_dbs
+from index_advisor import query_params
+from tree_engine import ProfileTree
+
+ROOT = Path(__file__).resolve().parent.parent
+DB_DIR = ROOT / "db"
+
+_TYPES = {"integer": int, "real": float, "text": str}
+
+
+def query_genera(conn, query, params=None):
+    """Taxon ids of a ui_query's `id` column, de-duplicated in row order.
+
+    Params are coerced to the types in the query's params_json; params the
+    query takes but that are not given bind NULL (its COALESCE defaults apply).
+    """
+    row = conn.execute("SELECT sql, params_json FROM ui_queries WHERE name = ?",
+                       (query,)).fetchone()
+    if row is None:
+        raise ValueError(f"no ui_query named {query!r}")
+    sql, params_json = row
+    spec = json.loads(params_json) if params_json else {}
+    bound = {}
+    for name in query_params(sql):
+        value = (params or {}).get(name)
+        if value is not None and isinstance(spec, dict) and spec.get(name) in _TYPES:
+            value = _TYPES[spec[name]](value)
+        bound[name] = value
+    cur = conn.execute(sql, bound)
+    columns = [d[0] for d in cur.description]
+    if "id" not in columns:
+        raise ValueError(f"ui_query {query!r} has no id column: {columns}")
+    at = columns.index("id")
+    return list(dict.fromkeys(r[at] for r in cur if r[at] is not None))
+
+
+def genus_distances(conn, genus_ids, other_ids=None, profile_id=1, tree=None):
+    """LCA and distance matrices of genus_ids x other_ids (default: genus_ids).
+
+    Returns {"rows", "columns": taxon id arrays, "lca": taxon id matrix,
+    "distance": int32 matrix, "missing": ids the profile does not place}.
+    """
+    if tree is None:
+        tree = ProfileTree.from_db(conn, profile_id)
+    result = {"missing": []}
+    for key, ids in (("rows", genus_ids), ("columns", other_ids)):
+        if ids is None:
+            result[key] = result["rows"]
+            continue
+        ids = np.asarray(list(ids), dtype=np.int64)
+        placed = tree.contains(ids)
+        result[key] = ids[placed]
+        result["missing"] += ids[~placed].tolist()
+    columns = None if other_ids is None else result["columns"]
+    result["lca"], result["distance"] = tree.lca_distance_matrices(result["rows"], columns)
+    result["missing"] = sorted(set(result["missing"]))
+    return result
+
+
+def taxon_names(conn, ids):
+    """{taxon_id: name} for ids."""
+    ids = sorted({int(i) for i in ids})
+    names = {}
+    for start in range(0, len(ids), 900):
+        chunk = ids[start:start + 900]
+        names.update(conn.execute(
+            f"SELECT id, name FROM taxon WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+    return names
+
+
+def _pairs(result, square):
+    """(i, j) index arrays of the pairs to list: i < j for a single set."""
+    if square:
+        return np.triu_indices(len(result["rows"]), k=1)
+    n, m = result["distance"].shape
+    return np.divmod(np.arange(n * m), m)
+
+
+def write_csv(result, names, out, square):
+    i, j = _pairs(result, square)
+    rows, cols = result["rows"][i], result["columns"][j]
+    lca, dist = result["lca"][i, j], result["distance"][i, j]
+    writer = csv.writer(out)
+    writer.writerow(["taxon_a_id", "taxon_a", "taxon_b_id", "taxon_b",
+                     "lca_id", "lca", "distance"])
+    for a, b, c, d in zip(rows.tolist(), cols.tolist(), lca.tolist(), dist.tolist()):
+        writer.writerow([a, names.get(a), b, names.get(b),
+                         c if c >= 0 else None, names.get(c), d])
+
+
+def write_json(result, names, path):
+    data = {
+        "rows": [{"id": t, "name": names.get(t)} for t in result["rows"].tolist()],
+        "columns": [{"id": t, "name": names.get(t)} for t in result["columns"].tolist()],
+        "lca": result["lca"].tolist(),
+        "distance": result["distance"].tolist(),
+        "missing": result["missing"],
+    }
+    Path(path).write_text(json.dumps(data) + "\n")
+
+
+def write_npz(result, names, path):
+    np.savez_compressed(
+        path, rows=result["rows"], columns=result["columns"],
+        row_names=np.array([names.get(t, "") for t in result["rows"].tolist()]),
+        column_names=np.array([names.get(t, "") for t in result["columns"].tolist()]),
+        lca=result["lca"], distance=result["distance"],
+        missing=np.asarray(result["missing"], dtype=np.int64))
+
+
+def _genus_set(conn, spec, ids, profile_id):
+    """Ids from --ids or from [query, name=value, ...]."""
+    if ids:
+        return [int(x) for x in ids.split(",") if x.strip()]
+    if not spec:
+        raise SystemExit("Error: give a ui_query name or --ids")
+    query, params = spec[0], {"profile_id": profile_id}
+    for item in spec[1:]:
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"Error: query parameter {item!r} is not name=value")
+        params[name] = value
+    try:
+        return query_genera(conn, query, params)
+    except (ValueError, sqlite3.Error) as e:
+        raise SystemExit(f"Error: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="LCA / taxonomic distance matrices between sets of genera")
+    parser.add_argument("target", help="Package name or DB path")
+    parser.add_argument("query", nargs="*",
+                        help="ui_query giving the genus set, then its name=value params")
+    parser.add_argument("--ids", default=None, help="Comma-separated taxon ids instead of a query")
+    parser.add_argument("--vs", nargs="+", default=None, metavar="QUERY",
+                        help="Second set for the columns: a ui_query and name=value params")
+    parser.add_argument("--vs-ids", default=None, help="Comma-separated taxon ids for the columns")
+    parser.add_argument("--profile", type=int, default=1,
+                        help="Classification profile (default: 1)")
+    parser.add_argument("--db-dir", type=Path, default=DB_DIR,
+                        help=f"Package DB directory (default: {DB_DIR.relative_to(ROOT)})")
+    parser.add_argument("-o", "--output", type=Path, default=None,
+                        help="Write .csv, .json or .npz (default: CSV to stdout)")
+    args = parser.parse_args()
+
+    try:
+        conn = open_package(resolve_package_dbs([args.target], args.db_dir)[0])
+    except FileNotFoundError as e:
+        raise SystemExit(f"Error: {e}")
+    rows = _genus_set(conn, args.query, args.ids, args.profile)
+    columns = (_genus_set(conn, args.vs, args.vs_ids, args.profile)
+               if args.vs or args.vs_ids else None)
+    tree = ProfileTree.from_db(conn, args.profile)
+    result = genus_distances(conn, rows, columns, args.profile, tree)
+    # Every LCA is one of the genera or an ancestor of one
+    names = taxon_names(conn, tree.with_ancestors(
+        np.concatenate([result["rows"], result["columns"]])).tolist())
+    conn.close()
+
+    n, m = result["distance"].shape
+    print(f"{n} x {m} genera, profile {args.profile}", file=sys.stderr)
+    if result["missing"]:
+        print(f"  not in profile {args.profile}: {len(result['missing'])} "
+              f"({', '.join(map(str, result['missing'][:10]))}"
+              f"{', ...' if len(result['missing']) > 10 else ''})", file=sys.stderr)
+
+    suffix = args.output.suffix if args.output else ".csv"
+    if suffix == ".npz":
+        write_npz(result, names, args.output)
+    elif suffix == ".json":
+        write_json(result, names, args.output)
+    elif args.output:
+        with open(args.output, "w", newline="") as f:
+            write_csv(result, names, f, columns is None)
+    else:
+        write_csv(result, names, sys.stdout, columns is None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,539 @@
+"""
+Materialized tree caches derived from classification_edge_cache.
+
+Every package builder calls build_tree_caches() once its classification
+profiles are final.  The hot ui_queries then read these precomputed tables
+instead of running a WITH RECURSIVE walk over the edge cache per request.
+The closures, intervals, rollups and timeline trees are computed on
+tree_engine.ProfileTree arrays, one per profile.
+
+Tables:
+  classification_closure   (profile_id, ancestor_id, descendant_id, depth)
+  profile_tree_index       (profile_id, taxon_id, lft, rgt, depth) — nested set
+  profile_node_stats       (profile_id, taxon_id, direct/total/valid genera, child rank counts,
+                            min_desc_year)
+  diversity_cube           (profile_id, grouping_rank, temporal_code, group_id) -> group_name,
+                            genus count
+  timeline_snapshot_nodes  (profile_id, stop_mya, taxon_id)           — per geologic slider stop
+  timeline_snapshot_edges  (profile_id, stop_mya, child_id, parent_id)
+  timeline_frames          (profile_id, axis, frame, stop_value, n_nodes, n_edges)
+  timeline_node_deltas     (profile_id, axis, frame, taxon_id, op)    — add/remove vs frame - 1
+  timeline_edge_deltas     (profile_id, axis, frame, child_id, parent_id, op)
+  profile_diff_cache       (profile_a, profile_b, child_id, parent_a, parent_b, diff_status)
+"""
+
+import json
+from collections import Counter, defaultdict
+from itertools import repeat
+
+import numpy as np
+
+from tree_engine import load_profile_trees
+
+# Grouping ranks always present in diversity_cube, even when a package has
+# no taxon of that rank (every genus is then 'Unknown' for it).
+GROUPING_RANKS = ("Phylum", "Class", "Subclass", "Order", "Suborder",
+                  "Superfamily", "Family", "Subfamily")
+
+# diversity_cube grouping_rank of the ungrouped rows (every genus 'Unknown'),
+# served for a NULL or unknown :grouping_rank
+NO_GROUPING = ""
+
+
+# ---------------------------------------------------------------------------
+# Transitive closure
+# ---------------------------------------------------------------------------
+
+def build_classification_closure(conn, trees):
+    """Materialize (ancestor, descendant, depth) pairs for every profile.
+
+    Each taxon gets a depth-0 self row, so "taxon plus all its ancestors"
+    and "taxon plus its whole subtree" are single indexed lookups.  Taxa
+    caught in a cycle of the edge cache have no root and get no rows.
+    """
+    conn.executescript("""
+    DROP TABLE IF EXISTS classification_closure;
+    CREATE TABLE classification_closure (
+        profile_id INTEGER NOT NULL,
+        ancestor_id INTEGER NOT NULL,
+        descendant_id INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (profile_id, ancestor_id, descendant_id)
+    ) WITHOUT ROWID;
+    """)
+
+    n_rows = 0
+    for profile_id, tree in trees.items():
+        ancestor, descendant, depth = tree.closure()
+        conn.executemany(
+            "INSERT INTO classification_closure (profile_id, ancestor_id, descendant_id, depth) "
+            "VALUES (?, ?, ?, ?)",
+            zip(repeat(profile_id), ancestor.tolist(), descendant.tolist(), depth.tolist()))
+        n_rows += len(ancestor)
+    conn.execute(
+        "CREATE INDEX idx_closure_descendant "
+        "ON classification_closure(profile_id, descendant_id, depth)")
+    return n_rows
+
+
+# ---------------------------------------------------------------------------
+# Nested-set (pre-order interval) index
+# ---------------------------------------------------------------------------
+
+def build_profile_tree_index(conn, trees):
+    """Number every profile node with lft/rgt/depth from a pre-order walk.
+
+    A node's descendants are exactly the nodes with lft BETWEEN lft + 1 AND rgt,
+    so subtree queries become one range scan on (profile_id, lft).  Roots and
+    siblings are visited in taxon id order, which keeps the numbering stable
+    across rebuilds of the same data.
+    """
+    conn.executescript("""
+    DROP TABLE IF EXISTS profile_tree_index;
+    CREATE TABLE profile_tree_index (
+        profile_id INTEGER NOT NULL,
+        taxon_id INTEGER NOT NULL,
+        lft INTEGER NOT NULL,
+        rgt INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (profile_id, taxon_id)
+    ) WITHOUT ROWID;
+    """)
+
+    n_rows = 0
+    for profile_id, tree in trees.items():
+        lft, rgt = tree.nested_set()
+        conn.executemany(
+            "INSERT INTO profile_tree_index (profile_id, taxon_id, lft, rgt, depth) "
+            "VALUES (?, ?, ?, ?, ?)",
+            zip(repeat(profile_id), tree.ids.tolist(), lft.tolist(), rgt.tolist(),
+                tree.depth.tolist()))
+        n_rows += len(tree)
+    conn.execute(
+        "CREATE UNIQUE INDEX idx_tree_index_lft "
+        "ON profile_tree_index(profile_id, lft, rgt, depth, taxon_id)")
+    return n_rows
+
+
+# ---------------------------------------------------------------------------
+# Per-node genus and rank rollups
+# ---------------------------------------------------------------------------
+
+def _min_desc_years(conn, trees):
+    """{profile_id: node-aligned list of the earliest naming year of a genus
+    at or below each node, None where there is none}.
+
+    Uses the same CAST(year AS INTEGER) as the pubyear ui_queries; genera
+    without a year do not contribute.
+    """
+    genus_years = defaultdict(list)
+    for profile_id, genus_id, year in conn.execute("""
+        SELECT e.profile_id, t.id, CAST(t.year AS INTEGER)
+        FROM classification_edge_cache e
+        JOIN taxon t ON t.id = e.child_id
+        WHERE t.rank = 'Genus' AND t.year IS NOT NULL
+    """):
+        genus_years[profile_id].append((genus_id, year))
+    no_year = np.iinfo(np.int64).max
+    years = {}
+    for profile_id, tree in trees.items():
+        values = np.full(len(tree), no_year, dtype=np.int64)
+        pairs = np.array(genus_years.get(profile_id, []), dtype=np.int64).reshape(-1, 2)
+        pairs = pairs[tree.contains(pairs[:, 0])]
+        np.minimum.at(values, tree.nodes(pairs[:, 0]), pairs[:, 1])
+        best = tree.subtree_min(values)
+        years[profile_id] = [None if y == no_year else y for y in best.tolist()]
+    return years
+
+
+def build_profile_node_stats(conn, trees):
+    """Roll genus counts and child rank counts up each profile tree.
+
+    direct_genera counts the genus children of a node, total_genera and
+    valid_genera the (valid) genera anywhere below it: pre-order prefix sums
+    over the subtree intervals.
+
+    min_desc_year is the earliest naming year of any genus at or below the
+    node, so "tree as of year Y" is simply min_desc_year <= Y.
+    """
+    conn.executescript("""
+    DROP TABLE IF EXISTS profile_node_stats;
+    CREATE TABLE profile_node_stats (
+        profile_id INTEGER NOT NULL,
+        taxon_id INTEGER NOT NULL,
+        direct_genera INTEGER NOT NULL DEFAULT 0,
+        total_genera INTEGER NOT NULL DEFAULT 0,
+        valid_genera INTEGER NOT NULL DEFAULT 0,
+        child_rank_counts_json TEXT NOT NULL DEFAULT '{}',
+        min_desc_year INTEGER,
+        PRIMARY KEY (profile_id, taxon_id)
+    ) WITHOUT ROWID;
+    """)
+
+    min_years = _min_desc_years(conn, trees)
+    taxa = {tid: (rank, is_valid) for tid, rank, is_valid in conn.execute(
+        "SELECT id, rank, is_valid FROM taxon")}
+
+    rows = []
+    for profile_id, tree in trees.items():
+        ranks = [taxa.get(t, (None, 0)) for t in tree.ids.tolist()]
+        genus = np.array([rank == "Genus" for rank, _ in ranks], dtype=np.int64)
+        valid = genus * np.array([bool(v) for _, v in ranks], dtype=np.int64)
+        placed = np.flatnonzero(tree.parent >= 0)
+        direct = np.bincount(tree.parent[placed], weights=genus[placed],
+                             minlength=len(tree)).astype(np.int64)
+        total = tree.subtree_sum(genus) - genus
+        total_valid = tree.subtree_sum(valid) - valid
+        child_ranks = defaultdict(Counter)
+        for node, parent in zip(placed.tolist(), tree.parent[placed].tolist()):
+            child_ranks[parent][ranks[node][0]] += 1
+        rows.extend(
+            (profile_id, taxon_id, d, t, v, json.dumps(dict(sorted(child_ranks[node].items()))), y)
+            for node, (taxon_id, d, t, v, y) in enumerate(zip(
+                tree.ids.tolist(), direct.tolist(), total.tolist(), total_valid.tolist(),
+                min_years[profile_id])))
+
+    conn.executemany(
+        "INSERT INTO profile_node_stats (profile_id, taxon_id, direct_genera, total_genera, "
+        "valid_genera, child_rank_counts_json, min_desc_year) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.execute(
+        "CREATE INDEX idx_node_stats_year "
+        "ON profile_node_stats(profile_id, min_desc_year, taxon_id)")
+    return len(rows)
+
+
+# ---------------------------------------------------------------------------
+# Diversity cube
+# ---------------------------------------------------------------------------
+
+def build_diversity_cube(conn):
+    """Pre-aggregate valid genus counts per temporal code and higher-taxon group.
+
+    One row per (profile, grouping rank, temporal code, group taxon) for every
+    non-genus rank in the taxon table plus GROUPING_RANKS and NO_GROUPING;
+    genera without an ancestor of the grouping rank fall into group_id 0,
+    'Unknown'.  Homonymous groups keep separate rows (diversity_by_age sums
+    them by name).  Must run after build_classification_closure().
+    """
+    conn.execute("DROP TABLE IF EXISTS temp.cube_ranks")
+    conn.execute("CREATE TEMP TABLE cube_ranks (rank TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.executemany("INSERT INTO temp.cube_ranks VALUES (?)",
+                     [(r,) for r in GROUPING_RANKS + (NO_GROUPING,)])
+    conn.execute(
+        "INSERT OR IGNORE INTO temp.cube_ranks SELECT DISTINCT rank FROM taxon "
+        "WHERE rank IS NOT NULL AND rank != 'Genus'")
+    conn.executescript("""
+    DROP TABLE IF EXISTS diversity_cube;
+    CREATE TABLE diversity_cube (
+        profile_id INTEGER NOT NULL,
+        grouping_rank TEXT NOT NULL,
+        temporal_code TEXT NOT NULL,
+        group_id INTEGER NOT NULL,
+        group_name TEXT NOT NULL,
+        age_order REAL,
+        genus_count INTEGER NOT NULL,
+        PRIMARY KEY (profile_id, grouping_rank, temporal_code, group_id)
+    ) WITHOUT ROWID;
+
+    INSERT INTO diversity_cube
+        (profile_id, grouping_rank, temporal_code, group_id, group_name, age_order, genus_count)
+    SELECT ge.profile_id, r.rank, tcm.code, COALESCE(grp.id, 0), COALESCE(grp.name, 'Unknown'),
+           -tcm.fad_mya, COUNT(DISTINCT g.id)
+    FROM taxon g
+    JOIN classification_edge_cache ge ON ge.child_id = g.id
+    JOIN temporal_code_mya tcm ON tcm.code = g.temporal_code
+    CROSS JOIN temp.cube_ranks r
+    LEFT JOIN (classification_closure c
+               JOIN taxon grp ON grp.id = c.ancestor_id)
+      ON c.profile_id = ge.profile_id AND c.descendant_id = g.id
+         AND c.depth > 0 AND grp.rank = r.rank
+    WHERE g.rank = 'Genus' AND g.is_valid = 1
+    GROUP BY ge.profile_id, r.rank, tcm.code, COALESCE(grp.id, 0);
+
+    DROP TABLE temp.cube_ranks;
+    """)
+    return conn.execute("SELECT COUNT(*) FROM diversity_cube").fetchone()[0]
+
+
+# ---------------------------------------------------------------------------
+# Geologic timeline snapshots
+# ---------------------------------------------------------------------------
+
+def _geologic_genera(conn, stop):
+    """Ids of the genera the geologic timeline shows at stop (all for None),
+    by the same filter as the on-the-fly query."""
+    return np.array([r[0] for r in conn.execute("""
+        SELECT t.id FROM taxon t
+        WHERE t.rank = 'Genus'
+          AND (:stop IS NULL OR t.temporal_code IN (
+              SELECT tr.code FROM temporal_code_mya tr
+              WHERE tr.fad_mya >= :stop AND tr.lad_mya <= :stop))
+    """, {"stop": stop})], dtype=np.int64)
+
+
+def _shown_nodes(tree, genera):
+    """Node mask of the genera placed in tree plus all their ancestors."""
+    found = tree.nodes(genera[tree.contains(genera)])
+    return tree.ancestor_mask(tree.ids[found[tree.placed[found]]])
+
+
+def _shown_edges(tree, nodes):
+    """Child-node mask of the edges between shown nodes (one parent per child)."""
+    return nodes & (tree.parent >= 0) & nodes[np.maximum(tree.parent, 0)]
+
+
+def build_timeline_snapshots(conn, trees, axis_sql):
+    """Materialize the tree shown at every stop of the geologic timeline slider.
+
+    axis_sql is the package's timeline_geologic_periods query; its id column
+    gives the stops (Mya).  A NULL stop row set holds the unfiltered tree, so
+    `stop_mya IS :timeline_value` covers the "no filter" case too.  Returns
+    (node_rows, edge_rows).
+    """
+    conn.executescript("""
+    DROP TABLE IF EXISTS timeline_snapshot_nodes;
+    DROP TABLE IF EXISTS timeline_snapshot_edges;
+    CREATE TABLE timeline_snapshot_nodes (
+        profile_id INTEGER NOT NULL,
+        stop_mya REAL,
+        taxon_id INTEGER NOT NULL
+    );
+    CREATE TABLE timeline_snapshot_edges (
+        profile_id INTEGER NOT NULL,
+        stop_mya REAL,
+        child_id INTEGER NOT NULL,
+        parent_id INTEGER NOT NULL
+    );
+    """)
+
+    stops = list(dict.fromkeys(r[0] for r in conn.execute(axis_sql))) + [None]
+    for stop in stops:
+        genera = _geologic_genera(conn, stop)
+        for profile_id, tree in sorted(trees.items()):
+            nodes = _shown_nodes(tree, genera)
+            edges = _shown_edges(tree, nodes)
+            conn.executemany(
+                "INSERT INTO timeline_snapshot_nodes (profile_id, stop_mya, taxon_id) "
+                "VALUES (?, ?, ?)", zip(repeat(profile_id), repeat(stop), tree.ids[nodes].tolist()))
+            conn.executemany(
+                "INSERT INTO timeline_snapshot_edges (profile_id, stop_mya, child_id, parent_id) "
+                "VALUES (?, ?, ?, ?)",
+                zip(repeat(profile_id), repeat(stop), tree.ids[edges].tolist(),
+                    tree.ids[tree.parent[edges]].tolist()))
+    conn.execute(
+        "CREATE UNIQUE INDEX idx_snapshot_nodes "
+        "ON timeline_snapshot_nodes(profile_id, stop_mya, taxon_id)")
+    conn.execute(
+        "CREATE UNIQUE INDEX idx_snapshot_edges "
+        "ON timeline_snapshot_edges(profile_id, stop_mya, child_id, parent_id)")
+
+    n_nodes = conn.execute("SELECT COUNT(*) FROM timeline_snapshot_nodes").fetchone()[0]
+    n_edges = conn.execute("SELECT COUNT(*) FROM timeline_snapshot_edges").fetchone()[0]
+    return n_nodes, n_edges
+
+
+# ---------------------------------------------------------------------------
+# Delta-encoded timeline frames
+# ---------------------------------------------------------------------------
+
+def _frame_deltas(tree, frames):
+    """Yield (frame, stop, nodes, edges, node_ops, edge_ops) for ordered frames.
+
+    frames is a list of (stop_value, node_mask, edge_mask) over tree's nodes,
+    an edge being marked at its child.  Frame 0 is sent in full as
+    additions; every later frame only lists what changed.
+    """
+    ids, parent_ids = tree.ids, tree.parents(tree.ids)
+    prev_nodes = prev_edges = np.zeros(len(tree), dtype=bool)
+    for frame, (stop, nodes, edges) in enumerate(frames):
+        node_ops = ([(n, "add") for n in ids[nodes & ~prev_nodes].tolist()]
+                    + [(n, "remove") for n in ids[prev_nodes & ~nodes].tolist()])
+        edge_ops = []
+        for op, changed in (("add", edges & ~prev_edges), ("remove", prev_edges & ~edges)):
+            edge_ops += [(e, op) for e in zip(ids[changed].tolist(), parent_ids[changed].tolist())]
+        yield frame, stop, int(nodes.sum()), int(edges.sum()), node_ops, edge_ops
+        prev_nodes, prev_edges = nodes, edges
+
+
+def _geologic_frames(conn, tree, axis_sql):
+    """Frames along the Mya axis: the trees of build_timeline_snapshots()."""
+    frames = []
+    for stop in dict.fromkeys(r[0] for r in conn.execute(axis_sql)):
+        nodes = _shown_nodes(tree, _geologic_genera(conn, stop))
+        frames.append((stop, nodes, _shown_edges(tree, nodes)))
+    return frames
+
+
+def _pubyear_frames(conn, profile_id, axis_sql, tree):
+    """Cumulative frames along the publication-year axis (from min_desc_year)."""
+    rows = conn.execute(
+        "SELECT taxon_id, min_desc_year FROM profile_node_stats "
+        "WHERE profile_id = ? AND min_desc_year IS NOT NULL", (profile_id,)).fetchall()
+    dated = tree.nodes([taxon_id for taxon_id, _ in rows])
+    years = np.array([year for _, year in rows], dtype=np.int64)
+    frames = []
+    for stop in dict.fromkeys(r[0] for r in conn.execute(axis_sql, {"profile_id": profile_id})):
+        nodes = np.zeros(len(tree), dtype=bool)
+        nodes[dated[years <= stop]] = True
+        frames.append((stop, nodes, _shown_edges(tree, nodes)))
+    return frames
+
+
+def build_timeline_frames(conn, trees, geologic_sql=None, pubyear_sql=None):
+    """Store per-profile frame deltas for the geologic and pubyear timelines.
+
+    Stepping the slider from frame k - 1 to k applies frame k's rows; stepping
+    back applies them inverted.  Needs profile_node_stats.min_desc_year.
+    Returns (node_rows, edge_rows).
+    """
+    conn.executescript("""
+    DROP TABLE IF EXISTS timeline_frames;
+    DROP TABLE IF EXISTS timeline_node_deltas;
+    DROP TABLE IF EXISTS timeline_edge_deltas;
+    CREATE TABLE timeline_frames (
+        profile_id INTEGER NOT NULL,
+        axis TEXT NOT NULL,
+        frame INTEGER NOT NULL,
+        stop_value REAL,
+        n_nodes INTEGER NOT NULL,
+        n_edges INTEGER NOT NULL,
+        PRIMARY KEY (profile_id, axis, frame)
+    ) WITHOUT ROWID;
+    CREATE TABLE timeline_node_deltas (
+        profile_id INTEGER NOT NULL,
+        axis TEXT NOT NULL,
+        frame INTEGER NOT NULL,
+        taxon_id INTEGER NOT NULL,
+        op TEXT NOT NULL CHECK (op IN ('add', 'remove')),
+        PRIMARY KEY (profile_id, axis, frame, taxon_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE timeline_edge_deltas (
+        profile_id INTEGER NOT NULL,
+        axis TEXT NOT NULL,
+        frame INTEGER NOT NULL,
+        child_id INTEGER NOT NULL,
+        parent_id INTEGER NOT NULL,
+        op TEXT NOT NULL CHECK (op IN ('add', 'remove')),
+        PRIMARY KEY (profile_id, axis, frame, child_id, parent_id)
+    ) WITHOUT ROWID;
+    """)
+
+    frame_rows, node_rows, edge_rows = [], [], []
+    for profile_id, tree in sorted(trees.items()):
+        axes = []
+        if geologic_sql:
+            axes.append(("geologic", _geologic_frames(conn, tree, geologic_sql)))
+        if pubyear_sql:
+            axes.append(("pubyear", _pubyear_frames(
+                conn, profile_id, pubyear_sql, tree)))
+        for axis, frames in axes:
+            for frame, stop, n_nodes, n_edges, node_ops, edge_ops in _frame_deltas(tree, frames):
+                frame_rows.append((profile_id, axis, frame, stop, n_nodes, n_edges))
+                node_rows.extend((profile_id, axis, frame, n, op) for n, op in node_ops)
+                edge_rows.extend((profile_id, axis, frame, c, p, op) for (c, p), op in edge_ops)
+
+    conn.executemany("INSERT INTO timeline_frames VALUES (?, ?, ?, ?, ?, ?)", frame_rows)
+    conn.executemany("INSERT INTO timeline_node_deltas VALUES (?, ?, ?, ?, ?)", node_rows)
+    conn.executemany("INSERT INTO timeline_edge_deltas VALUES (?, ?, ?, ?, ?, ?)", edge_rows)
+    return len(node_rows), len(edge_rows)
+
+
+# ---------------------------------------------------------------------------
+# Pairwise profile diffs
+# ---------------------------------------------------------------------------
+
+def build_profile_diff_cache(conn):
+    """Precompute the edge diff for every ordered pair of profiles.
+
+    diff_status follows the profile_diff / profile_diff_edges queries:
+    'removed' (only in profile_a), 'added' (only in profile_b), 'moved'
+    (parents differ) or 'same'.  Profiles are few, so all pairs, including
+    a profile against itself, stay small.  Profile id 0 stands for "no
+    profile" (a NULL query parameter): against it every edge is added or
+    removed, as in the on-the-fly queries.
+    """
+    conn.executescript("""
+    DROP TABLE IF EXISTS profile_diff_cache;
+    CREATE TABLE profile_diff_cache (
+        profile_a INTEGER NOT NULL,
+        profile_b INTEGER NOT NULL,
+        child_id INTEGER NOT NULL,
+        parent_a INTEGER,
+        parent_b INTEGER,
+        diff_status TEXT NOT NULL,
+        PRIMARY KEY (profile_a, profile_b, child_id)
+    ) WITHOUT ROWID;
+
+    DROP TABLE IF EXISTS temp.diff_profiles;
+    CREATE TEMP TABLE diff_profiles AS
+        SELECT DISTINCT profile_id AS id FROM classification_edge_cache
+        UNION ALL SELECT 0;
+
+    INSERT INTO profile_diff_cache
+        (profile_a, profile_b, child_id, parent_a, parent_b, diff_status)
+    SELECT pa.id, pb.id, a.child_id, a.parent_id, b.parent_id,
+           CASE
+               WHEN b.child_id IS NULL THEN 'removed'
+               WHEN a.parent_id != b.parent_id THEN 'moved'
+               ELSE 'same'
+           END
+    FROM temp.diff_profiles pa
+    CROSS JOIN temp.diff_profiles pb
+    JOIN classification_edge_cache a ON a.profile_id = pa.id
+    LEFT JOIN classification_edge_cache b
+        ON b.profile_id = pb.id AND b.child_id = a.child_id
+    UNION ALL
+    SELECT pa.id, pb.id, b.child_id, NULL, b.parent_id, 'added'
+    FROM temp.diff_profiles pa
+    CROSS JOIN temp.diff_profiles pb
+    JOIN classification_edge_cache b ON b.profile_id = pb.id
+    LEFT JOIN classification_edge_cache a
+        ON a.profile_id = pa.id AND a.child_id = b.child_id
+    WHERE a.child_id IS NULL;
+
+    DROP TABLE temp.diff_profiles;
+
+    CREATE INDEX idx_diff_changed
+        ON profile_diff_cache(profile_a, profile_b, diff_status)
+        WHERE diff_status != 'same';
+    """)
+    return conn.execute("SELECT COUNT(*) FROM profile_diff_cache").fetchone()[0]
+
+
+# ---------------------------------------------------------------------------
+# Entry point
+# ---------------------------------------------------------------------------
+
+def _query_sql(queries, name):
+    """SQL text of a named ui_query from a builder's _build_queries() list."""
+    for q_name, _desc, sql, _params in queries:
+        if q_name == name:
+            return sql
+    return None
+
+
+def build_tree_caches(conn, queries=()):
+    """(Re)build all materialized tree caches. Returns {table_name: row_count}.
+
+    queries is the package's ui_queries list; it supplies the timeline axes
+    used for the snapshot and frame tables (skipped when the package has none).
+    """
+    trees = load_profile_trees(conn)
+    counts = {}
+    counts["classification_closure"] = build_classification_closure(conn, trees)
+    counts["profile_tree_index"] = build_profile_tree_index(conn, trees)
+    counts["profile_node_stats"] = build_profile_node_stats(conn, trees)
+    counts["diversity_cube"] = build_diversity_cube(conn)
+    counts["profile_diff_cache"] = build_profile_diff_cache(conn)
+    axis_sql = _query_sql(queries, "timeline_geologic_periods")
+    if axis_sql:
+        (counts["timeline_snapshot_nodes"],
+         counts["timeline_snapshot_edges"]) = build_timeline_snapshots(
+            conn, trees, axis_sql)
+    pubyear_sql = _query_sql(queries, "timeline_publication_years")
+    if axis_sql or pubyear_sql:
+        (counts["timeline_node_deltas"],
+         counts["timeline_edge_deltas"]) = build_timeline_frames(
+            conn, trees, axis_sql, pubyear_sql)
+    conn.commit()
+    return counts
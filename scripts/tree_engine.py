@@ -0,0 +1,400 @@
+"""
+In-memory NumPy tree engine over classification_edge_cache.
+
+ProfileTree loads one profile's edges into flat integer arrays and answers
+tree questions for whole batches of taxa per call.  Nodes are numbered
+0..n-1 in taxon id order, so a taxon id maps to its node by searchsorted:
+
+  ids          taxon id of each node (ascending)
+  parent       parent node, -1 for a root
+  child_ptr,   CSR children: the children of node v are
+  children       children[child_ptr[v]:child_ptr[v + 1]], in taxon id order
+  depth        0 for a root
+  size         subtree size, the node itself included
+  pre, order   pre-order position of each node and its inverse (roots and
+               siblings in taxon id order, the numbering of
+               profile_tree_index); v's descendants are
+               order[pre[v] + 1 : pre[v] + size[v]]
+  root         the root node of each node's tree
+  placed       True for nodes with an edge cache row of their own (a
+               parent-only node, e.g. a bridged root, has none)
+  euler,       Euler tour of the forest (each tree's tour, roots in id order)
+  first          and each node's first position in it
+
+LCAs are range-minimum queries over the Euler tour's depths, answered in
+O(1) per pair from a sparse table, so lca_matrix()/distance_matrix() fill
+whole genus x genus matrices (10k x 10k in seconds) block by block.
+
+Construction and every query are vectorized: loops run over tree levels
+(a dozen ranks at most), never over taxa, so a query for 5,000 genera
+costs about as much as one for 5.  Queries take taxon ids (a scalar or any
+array-like) and return NumPy arrays of taxon ids.
+
+A taxon caught in a cycle of the edge cache never reaches a root; it is
+left out of the tree and listed in `unrooted` (for the validators).
+"""
+
+import numpy as np
+
+# Pairs per block of lca_matrix()/distance_matrix(): bounds the temporaries
+MATRIX_BLOCK = 1 << 22
+
+
+def _ranges(starts, lengths):
+    """Concatenation of arange(s, s + k) for every (s, k), without a Python loop."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    if not len(ends) or not ends[-1]:
+        return np.empty(0, dtype=np.int64)
+    return np.repeat(np.asarray(starts, dtype=np.int64) - (ends - lengths), lengths) \
+        + np.arange(ends[-1])
+
+
+def _csr(parent):
+    """(child_ptr, children) of a parent array, children sorted by node."""
+    n = len(parent)
+    kids = np.flatnonzero(parent >= 0)
+    kids = kids[np.argsort(parent[kids], kind="stable")]
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum(np.bincount(parent[kids], minlength=n))
+    return ptr, kids
+
+
+class ProfileTree:
+    """One classification profile as parent/CSR/pre-order/Euler arrays."""
+
+    def __init__(self, parents):
+        """parents: {child_id: parent_id or None}, one profile's edge cache rows."""
+        child = np.fromiter(parents.keys(), dtype=np.int64, count=len(parents))
+        par = np.fromiter((-1 if p is None else p for p in parents.values()),
+                          dtype=np.int64, count=len(parents))
+        ids = np.unique(np.concatenate([child, par[par >= 0]]))
+        parent = np.full(len(ids), -1, dtype=np.int64)
+        parent[np.searchsorted(ids, child)] = np.where(
+            par >= 0, np.searchsorted(ids, np.maximum(par, 0)), -1)
+
+        levels = self._levels(parent)
+        reached = np.zeros(len(ids), dtype=bool)
+        for level in levels:
+            reached[level] = True
+        placed = np.zeros(len(ids), dtype=bool)
+        placed[np.searchsorted(ids, child)] = True
+        self.unrooted = ids[~reached]
+        if len(self.unrooted):
+            # A reachable node's parent is reachable too, so the kept nodes
+            # form a forest of their own once renumbered.
+            renumber = np.cumsum(reached) - 1
+            kept = parent[reached]
+            parent = np.where(kept >= 0, renumber[np.maximum(kept, 0)], -1)
+            ids = ids[reached]
+            placed = placed[reached]
+            levels = self._levels(parent)
+
+        n = len(ids)
+        self.ids = ids
+        self.parent = parent
+        self.placed = placed
+        self.child_ptr, self.children = _csr(parent)
+        self.levels = levels
+        self.roots = levels[0] if levels else np.empty(0, dtype=np.int64)
+
+        self.depth = np.zeros(n, dtype=np.int64)
+        self.root = np.arange(n, dtype=np.int64)
+        for d, level in enumerate(levels[1:], 1):
+            self.depth[level] = d
+            self.root[level] = self.root[parent[level]]
+
+        self.size = np.ones(n, dtype=np.int64)
+        for level in reversed(levels[1:]):
+            self.size += np.bincount(parent[level], weights=self.size[level],
+                                     minlength=n).astype(np.int64)
+
+        # Pre-order: a root starts after the earlier trees; a child after its
+        # parent and the subtrees of its earlier siblings.  Each level comes
+        # out of _levels() grouped by parent, siblings in id order.
+        self.pre = np.zeros(n, dtype=np.int64)
+        if n:
+            self.pre[self.roots] = np.cumsum(self.size[self.roots]) - self.size[self.roots]
+        for level in levels[1:]:
+            sizes = self.size[level]
+            before = np.cumsum(sizes) - sizes
+            p = parent[level]
+            group = np.r_[True, p[1:] != p[:-1]]
+            start = np.maximum.accumulate(np.where(group, np.arange(len(level)), 0))
+            self.pre[level] = self.pre[p] + 1 + before - before[start]
+        self.order = np.empty(n, dtype=np.int64)
+        self.order[self.pre] = np.arange(n)
+
+        # Euler tour: within a tree, v is entered at 2 * pre - depth and its
+        # parent is revisited 2 * size - 1 steps later; each earlier tree's
+        # tour is one step shorter than its nested-set span.
+        tree_no = np.searchsorted(self.roots, self.root)
+        self.first = 2 * self.pre - self.depth - tree_no
+        self.euler = np.empty(2 * n - len(self.roots), dtype=np.int64)
+        self.euler[self.first] = np.arange(n)
+        child = parent >= 0
+        self.euler[self.first[child] + 2 * self.size[child] - 1] = parent[child]
+        self._up = None
+        self._table = None
+
+    @staticmethod
+    def _levels(parent):
+        """Nodes by depth, top-down; each level grouped by parent in the
+        previous level's order, siblings in node order."""
+        ptr, kids = _csr(parent)
+        levels = []
+        frontier = np.flatnonzero(parent < 0)
+        while len(frontier):
+            levels.append(frontier)
+            frontier = kids[_ranges(ptr[frontier], ptr[frontier + 1] - ptr[frontier])]
+        return levels
+
+    @classmethod
+    def from_db(cls, conn, profile_id):
+        """Tree of one profile read straight from classification_edge_cache."""
+        return cls(dict(conn.execute(
+            "SELECT child_id, parent_id FROM classification_edge_cache WHERE profile_id = ?",
+            (profile_id,))))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, taxon_id):
+        i = np.searchsorted(self.ids, taxon_id)
+        return bool(i < len(self.ids) and self.ids[i] == taxon_id)
+
+    @property
+    def height(self):
+        return len(self.levels) - 1
+
+    # -- ids <-> nodes ------------------------------------------------------
+
+    def nodes(self, taxon_ids):
+        """Node numbers of taxon ids; KeyError for ids not in the tree."""
+        taxon_ids = np.atleast_1d(np.asarray(taxon_ids, dtype=np.int64))
+        missing = ~self.contains(taxon_ids)
+        if missing.any():
+            raise KeyError(f"taxa not in profile tree: {taxon_ids[missing][:10].tolist()}")
+        return np.searchsorted(self.ids, taxon_ids)
+
+    def contains(self, taxon_ids):
+        """Boolean mask: which taxon ids are nodes of the tree."""
+        taxon_ids = np.atleast_1d(np.asarray(taxon_ids, dtype=np.int64))
+        if not len(self.ids):
+            return np.zeros(len(taxon_ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.ids, taxon_ids), len(self.ids) - 1)
+        return self.ids[pos] == taxon_ids
+
+    def _taxa(self, nodes):
+        """Taxon ids of nodes, -1 where the node is -1."""
+        return np.where(nodes >= 0, self.ids[np.maximum(nodes, 0)], -1)
+
+    # -- ancestors / descendants --------------------------------------------
+
+    def parents(self, taxon_ids):
+        """Parent taxon id of each taxon, -1 for roots."""
+        return self._taxa(self.parent[self.nodes(taxon_ids)])
+
+    def ancestors(self, taxon_ids, include_self=False):
+        """(taxon_id, ancestor_id, distance) rows for every ancestor of each taxon."""
+        nodes = self.nodes(taxon_ids)
+        owner = np.arange(len(nodes))
+        cur = nodes if include_self else self.parent[nodes]
+        dist = 0 if include_self else 1
+        out_owner, out_anc, out_dist = [], [], []
+        while True:
+            keep = cur >= 0
+            owner, cur = owner[keep], cur[keep]
+            if not len(cur):
+                break
+            out_owner.append(owner)
+            out_anc.append(cur)
+            out_dist.append(np.full(len(cur), dist, dtype=np.int64))
+            cur = self.parent[cur]
+            dist += 1
+        if not out_owner:
+            return (np.empty(0, dtype=np.int64),) * 3
+        owner = np.concatenate(out_owner)
+        return (self.ids[nodes[owner]], self.ids[np.concatenate(out_anc)],
+                np.concatenate(out_dist))
+
+    def ancestor_mask(self, taxon_ids):
+        """Node mask of the given taxa plus all their ancestors."""
+        mark = np.zeros(len(self.ids), dtype=bool)
+        cur = np.unique(self.nodes(taxon_ids))
+        while len(cur):
+            mark[cur] = True
+            cur = self.parent[cur]
+            cur = np.unique(cur[cur >= 0])
+            cur = cur[~mark[cur]]
+        return mark
+
+    def with_ancestors(self, taxon_ids):
+        """Sorted taxon ids of the given taxa plus all their ancestors."""
+        return self.ids[self.ancestor_mask(taxon_ids)]
+
+    def descendants(self, taxon_ids, include_self=False):
+        """(taxon_id, descendant_id, distance) rows for every descendant of each taxon,
+        in pre-order per taxon."""
+        nodes = self.nodes(taxon_ids)
+        skip = 0 if include_self else 1
+        lengths = self.size[nodes] - skip
+        desc = self.order[_ranges(self.pre[nodes] + skip, lengths)]
+        owner = np.repeat(nodes, lengths)
+        return self.ids[owner], self.ids[desc], self.depth[desc] - self.depth[owner]
+
+    def closure(self):
+        """(ancestor_id, descendant_id, depth) for every pair, depth-0 self rows included."""
+        return self.descendants(self.ids, include_self=True)
+
+    def subtree_sizes(self, taxon_ids):
+        """Number of taxa in each taxon's subtree, the taxon itself included."""
+        return self.size[self.nodes(taxon_ids)]
+
+    def is_ancestor(self, ancestor_ids, taxon_ids):
+        """Elementwise: is ancestor_ids[i] an ancestor of (or equal to) taxon_ids[i]?"""
+        a, b = self.nodes(ancestor_ids), self.nodes(taxon_ids)
+        return (self.pre[a] <= self.pre[b]) & (self.pre[b] < self.pre[a] + self.size[a])
+
+    def nested_set(self):
+        """(lft, rgt) per node, as stored in profile_tree_index."""
+        lft = 2 * self.pre - self.depth + 1
+        return lft, lft + 2 * self.size - 1
+
+    # -- per-node rollups ---------------------------------------------------
+
+    def subtree_sum(self, values):
+        """Per-node sum of a node-aligned array over the node's subtree."""
+        values = np.asarray(values)
+        acc = np.zeros(len(values) + 1, dtype=np.result_type(values, np.int64))
+        np.cumsum(values[self.order], out=acc[1:])
+        return acc[self.pre + self.size] - acc[self.pre]
+
+    def subtree_min(self, values):
+        """Per-node minimum of a node-aligned array over the node's subtree."""
+        out = np.array(values, copy=True)
+        for level in reversed(self.levels[1:]):
+            np.minimum.at(out, self.parent[level], out[level])
+        return out
+
+    # -- LCA and paths ------------------------------------------------------
+
+    def _lifting(self):
+        """Binary-lifting table: _up[k][v] is v's 2**k-th ancestor (roots map to themselves)."""
+        if self._up is None:
+            up = [np.where(self.parent >= 0, self.parent, np.arange(len(self.ids)))]
+            while (1 << len(up)) <= self.height:
+                up.append(up[-1][up[-1]])
+            self._up = up
+        return self._up
+
+    def _kth_ancestor(self, nodes, k):
+        for j, table in enumerate(self._lifting()):
+            nodes = np.where((k >> j) & 1, table[nodes], nodes)
+        return nodes
+
+    def _sparse(self):
+        """Sparse table over the Euler tour: _table[k, i] is the shallowest node of
+        euler[i : i + 2**k] (rows past the tour's end are padding)."""
+        if self._table is None:
+            m = len(self.euler)
+            dtype = np.int32 if len(self.ids) < 2 ** 31 else np.int64
+            table = np.empty((max(1, int(m).bit_length()), m), dtype=dtype)
+            table[0] = self.euler
+            for k in range(1, len(table)):
+                half, width = 1 << (k - 1), m - (1 << k) + 1
+                x, y = table[k - 1, :width], table[k - 1, half:half + width]
+                table[k, :width] = np.where(self.depth[y] < self.depth[x], y, x)
+                table[k, width:] = table[k - 1, width:]
+            self._table = table
+        return self._table
+
+    def _rmq(self, fa, fb):
+        """The two sparse-table candidates for the shallowest node between Euler
+        positions fa and fb (broadcastable arrays)."""
+        table = self._sparse()
+        lo, hi = np.minimum(fa, fb), np.maximum(fa, fb)
+        k = np.frexp(hi - lo + 1)[1] - 1
+        return table[k, lo], table[k, hi - np.left_shift(1, k) + 1]
+
+    def _lca_nodes(self, a, b):
+        x, y = self._rmq(self.first[a], self.first[b])
+        lca = np.where(self.depth[y] < self.depth[x], y, x)
+        return np.where(self.root[a] == self.root[b], lca, -1)
+
+    def lca(self, a_ids, b_ids):
+        """Elementwise lowest common ancestor, -1 for taxa in different trees."""
+        return self._taxa(self._lca_nodes(self.nodes(a_ids), self.nodes(b_ids)))
+
+    def distance(self, a_ids, b_ids):
+        """Elementwise number of edges on the tree path, -1 across trees."""
+        a, b = self.nodes(a_ids), self.nodes(b_ids)
+        lca = self._lca_nodes(a, b)
+        dist = self.depth[a] + self.depth[b] - 2 * self.depth[np.maximum(lca, 0)]
+        return np.where(lca >= 0, dist, -1)
+
+    def lca_matrix(self, a_ids, b_ids=None):
+        """len(a) x len(b) matrix of LCA taxon ids, -1 across trees (b defaults to a)."""
+        return self._pair_matrices(a_ids, b_ids, lca=True, distance=False)[0]
+
+    def distance_matrix(self, a_ids, b_ids=None):
+        """len(a) x len(b) int32 matrix of path lengths, -1 across trees
+        (b defaults to a)."""
+        return self._pair_matrices(a_ids, b_ids, lca=False, distance=True)[1]
+
+    def lca_distance_matrices(self, a_ids, b_ids=None):
+        """(lca_matrix, distance_matrix) from a single RMQ pass over the pairs."""
+        return self._pair_matrices(a_ids, b_ids, lca=True, distance=True)
+
+    def _pair_matrices(self, a_ids, b_ids, lca, distance):
+        a = self.nodes(a_ids)
+        b = a if b_ids is None else self.nodes(b_ids)
+        lca_out = np.empty((len(a), len(b)), dtype=np.int64) if lca else None
+        dist_out = np.empty((len(a), len(b)), dtype=np.int32) if distance else None
+        # Node-sized int32 copies keep the per-pair temporaries small
+        dtype = self._sparse().dtype
+        depth = self.depth.astype(np.int32)
+        first, root = self.first.astype(dtype), self.root.astype(dtype)
+        fb, rb, db = first[b][None, :], root[b][None, :], depth[b][None, :]
+        rows = max(1, MATRIX_BLOCK // max(len(b), 1))
+        for start in range(0, len(a), rows):
+            block = a[start:start + rows, None]
+            x, y = self._rmq(first[block], fb)
+            dx, dy = depth[x], depth[y]
+            same = root[block] == rb
+            if lca:
+                lca_out[start:start + rows] = np.where(
+                    same, self.ids[np.where(dy < dx, y, x)], -1)
+            if distance:
+                dist_out[start:start + rows] = np.where(
+                    same, depth[block] + db - 2 * np.minimum(dx, dy), -1)
+        return lca_out, dist_out
+
+    def path(self, a_ids, b_ids):
+        """(pair, taxon_id) rows of each a -> lca -> b path, in walking order.
+
+        Pairs in different trees have no path and no rows.
+        """
+        a, b = self.nodes(a_ids), self.nodes(b_ids)
+        lca = self._lca_nodes(a, b)
+        pairs = np.flatnonzero(lca >= 0)
+        a, b, lca = a[pairs], b[pairs], lca[pairs]
+        up = self.depth[a] - self.depth[lca]
+        lengths = up + self.depth[b] - self.depth[lca] + 1
+        pair = np.repeat(np.arange(len(pairs)), lengths)
+        step = _ranges(np.zeros(len(pairs), dtype=np.int64), lengths)
+        rising = step <= up[pair]
+        nodes = np.where(rising,
+                         self._kth_ancestor(a[pair], np.where(rising, step, 0)),
+                         self._kth_ancestor(b[pair], np.where(rising, 0,
+                                                              lengths[pair] - 1 - step)))
+        return pairs[pair], self.ids[nodes]
+
+
+def load_profile_trees(conn):
+    """{profile_id: ProfileTree} for every profile of the edge cache."""
+    by_profile = {}
+    for profile_id, child_id, parent_id in conn.execute(
+            "SELECT profile_id, child_id, parent_id FROM classification_edge_cache"):
+        by_profile.setdefault(profile_id, {})[child_id] = parent_id
+    return {p: ProfileTree(parents) for p, parents in by_profile.items()}
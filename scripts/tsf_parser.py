@@ -0,0 +1,516 @@
+"""
+Streaming parser for the Taxonomic Source Format (TSF) files in data/sources.
+
+Every package builder used to carry its own copy of parse_hierarchy_body();
+they now share this module and differ only in a TSFDialect:
+
+  dialect = TSFDialect(RANK_KEYWORDS, RANK_ORDER, caps_ranks=(...), ...)
+  header, lines = read_source(path)
+  for p in iter_placements(lines, "Genus", dialect):
+      ...
+
+read_source() parses the YAML-like header and returns the body as a lazy
+line iterator, and iter_placements() is a generator of slotted Placement
+records, so parsing never holds a source's text in memory.  A placement is
+yielded once the next entry (or the end of the body) shows that no more
+synonym lines follow it.
+
+Package quirks are pluggable rules on the dialect:
+  line_rules   rule(state, stripped) -> bool    run on every non-synonym
+               line; True consumes it (section headers, stack resets)
+  entry_rules  rule(state, line) -> None | False | (rank, name)
+               run after the status markers are stripped; False skips the
+               line, (rank, name) makes it a header taxon without authority
+Rules see the ParseState: the rank stack [(order, name, rank)], the
+validity given to new placements, and (with track_known) every name seen.
+
+Builders call load_placements(), which caches each source's placements in
+CACHE_DIR as a marshal file of row tuples.  An entry is used only while
+the source's SHA-256 and PARSER_VERSION match and the dialect (its options
+and rule code) is unchanged, so an unchanged Treatise volume is never
+re-parsed.  Bump PARSER_VERSION whenever iter_placements() output changes.
+load_all_placements() does the same for a list of sources and parses the
+cache misses in a process pool, one source per worker.
+
+Both return lists, not generators: a cache entry is read (and written) as
+one marshal blob and a worker sends back a whole source, so the rows are in
+memory either way.  That costs one source's placements in load_placements()
+and a whole profile's in load_all_placements() (about 3.5 MB for the largest,
+mollusca's 1957-1971 Treatise); iter_placements() stays the streaming path.
+"""
+
+import hashlib
+import marshal
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+
+PARSER_VERSION = 1
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache" / "tsf"
+
+# "= Target (detail)" / "~ Target"
+_SYNONYM_RE = re.compile(r'^(=|~)\s+(.+)$')
+_SYN_TARGET_RE = re.compile(r'^(\S+)\s*\(([^)]+)\)$')
+# "j.s.s., fide AUTHOR, YEAR" -> junior subjective / objective synonym
+_SYNONYM_TYPE_RE = re.compile(r'(j\.s\.s\.|j\.o\.s\.)')
+_BRACKET_RE = re.compile(r'\[.*?\]')
+_TYPE_SPECIES_RE = re.compile(r'\[\*(.+?)\]')
+_YEAR_RE = re.compile(r',?\s*(\d{4}[a-z]?)\s*$')
+_TEMPORAL_RE = re.compile(r'^[A-Z]{2,}')
+_TEMPORAL_QMARK_RE = re.compile(r'^[?A-Z]{2,}')
+
+_HEADER_REFERENCE_RE = re.compile(r'^reference:\s*(.+)$', re.MULTILINE)
+_HEADER_SCOPE_RE = re.compile(r'-\s+taxon:\s*(\S+)\s+coverage:\s*(\S+)')
+
+
+# ---------------------------------------------------------------------------
+# Source header
+# ---------------------------------------------------------------------------
+
+def _parse_header_text(header_text):
+    header = {}
+    m = _HEADER_REFERENCE_RE.search(header_text)
+    if m:
+        header["reference"] = m.group(1).strip()
+    header["scope"] = [{"taxon": sm.group(1), "coverage": sm.group(2)}
+                       for sm in _HEADER_SCOPE_RE.finditer(header_text)]
+    return header
+
+
+def parse_source_header(text: str):
+    """Parse YAML-like header from a source text. Returns (header_dict, body_str)."""
+    if not text.startswith("---"):
+        return {}, text
+
+    end = text.index("---", 3)
+    return _parse_header_text(text[3:end].strip()), text[end + 3:].strip()
+
+
+def _body_lines(f, first):
+    try:
+        if first:
+            yield first
+        yield from f
+    finally:
+        f.close()
+
+
+def read_source(path):
+    """Open a source file. Returns (header_dict, lazy iterator over body lines).
+
+    Only the header is read up front; the file is closed when the iterator
+    is exhausted (or garbage-collected).
+    """
+    f = open(path, encoding="utf-8")
+    first = f.readline()
+    if not first.startswith("---"):
+        return {}, _body_lines(f, first)
+
+    parts = []
+    buf = first[3:]
+    while True:
+        end = buf.find("---")
+        if end >= 0:
+            parts.append(buf[:end])
+            rest = buf[end + 3:]
+            break
+        parts.append(buf)
+        buf = f.readline()
+        if not buf:
+            f.close()
+            raise ValueError(f"{path}: unterminated source header")
+    return _parse_header_text("".join(parts).strip()), _body_lines(f, rest)
+
+
+# ---------------------------------------------------------------------------
+# Placements
+# ---------------------------------------------------------------------------
+
+class Placement:
+    """One taxon line of a source body.
+
+    Supports p["name"] and p.get("name") so placements read like the
+    dicts the builders used before.
+    """
+
+    __slots__ = ("name", "rank", "author", "year", "parent_name", "parent_rank",
+                 "status", "synonyms", "location", "temporal_code",
+                 "type_species", "is_valid")
+
+    def __init__(self, name, rank, author, year, parent_name, parent_rank,
+                 status, location="", temporal_code="", type_species="", is_valid=1):
+        self.name = name
+        self.rank = rank
+        self.author = author
+        self.year = year
+        self.parent_name = parent_name
+        self.parent_rank = parent_rank
+        self.status = status
+        self.synonyms = []
+        self.location = location
+        self.temporal_code = temporal_code
+        self.type_species = type_species
+        self.is_valid = is_valid
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def as_row(self):
+        """Tuple of slot values (synonyms as (predicate, target, detail))."""
+        return (self.name, self.rank, self.author, self.year, self.parent_name,
+                self.parent_rank, self.status,
+                tuple((s["predicate"], s["target"], s["detail"]) for s in self.synonyms),
+                self.location, self.temporal_code, self.type_species, self.is_valid)
+
+    @classmethod
+    def from_row(cls, row):
+        p = cls(*row[:7], *row[8:])
+        p.synonyms = [{"predicate": pr, "target": t, "detail": d} for pr, t, d in row[7]]
+        return p
+
+    def __repr__(self):
+        return f"Placement({self.rank} {self.name!r} <- {self.parent_name!r})"
+
+
+class ParseState:
+    """Mutable parser state handed to dialect rules."""
+
+    __slots__ = ("stack", "known", "is_valid")
+
+    def __init__(self):
+        self.stack = []     # [(rank_order, name, rank)], outermost first
+        self.known = {}     # name.lower() -> (rank_order, rank), with track_known
+        self.is_valid = 1   # is_valid given to placements from here on
+
+    def pop_to_root(self):
+        del self.stack[1:]
+
+
+class TSFDialect:
+    """Per-package parsing rules.
+
+    rank_keywords     line prefixes that set an explicit rank ("Family ...")
+    rank_order        rank -> depth; the parent is the nearest shallower taxon
+    default_order     depth of ranks missing from rank_order
+    caps_ranks        ranks whose ALL CAPS names are title-cased (None = all)
+    skip_unassigned   drop "... UNASSIGNED" header lines
+    pipe_fields       read "name author | location | temporal" fields
+    temporal_qmark    accept a '?'-prefixed temporal code and strip the '?'
+    type_species      take type_species from a "[*...]" block
+    misspelling       "= X (misspelling ...)" becomes SPELLING_OF
+    stop_re           a matching line ends the body (e.g. an addendum)
+    noise_names       parsed names that are not taxa
+    track_known       record every name in ParseState.known
+    line_rules, entry_rules   see the module docstring
+    """
+
+    def __init__(self, rank_keywords, rank_order, *, default_order=6,
+                 caps_ranks=None, skip_unassigned=True, pipe_fields=True,
+                 temporal_qmark=False, type_species=False, misspelling=False,
+                 stop_re=None, noise_names=(), track_known=False,
+                 line_rules=(), entry_rules=()):
+        keywords = sorted(rank_keywords, key=lambda kw: (-len(kw), kw))
+        self.rank_re = re.compile("(%s) " % "|".join(map(re.escape, keywords)))
+        self.rank_order = dict(rank_order)
+        self.default_order = default_order
+        self.caps_ranks = None if caps_ranks is None else frozenset(caps_ranks)
+        self.skip_unassigned = skip_unassigned
+        self.pipe_fields = pipe_fields
+        self.temporal_re = _TEMPORAL_QMARK_RE if temporal_qmark else _TEMPORAL_RE
+        self.strip_temporal_qmark = temporal_qmark
+        self.type_species = type_species
+        self.misspelling = misspelling
+        self.stop_re = stop_re
+        self.noise_names = frozenset(noise_names)
+        self.track_known = track_known
+        self.line_rules = tuple(line_rules)
+        self.entry_rules = tuple(entry_rules)
+        self._cache_key = None
+
+    @property
+    def cache_key(self):
+        """Digest of everything that shapes this dialect's output, rule code included."""
+        if self._cache_key is None:
+            h = hashlib.sha256()
+            h.update(repr((
+                self.rank_re.pattern, sorted(self.rank_order.items()), self.default_order,
+                sorted(self.caps_ranks) if self.caps_ranks is not None else None,
+                self.skip_unassigned, self.pipe_fields, self.strip_temporal_qmark,
+                self.type_species, self.misspelling,
+                self.stop_re.pattern if self.stop_re is not None else None,
+                sorted(self.noise_names), self.track_known)).encode())
+            for rule in self.line_rules + self.entry_rules:
+                code = rule.__code__
+                h.update(marshal.dumps(code))
+                # module-level patterns the rule matches against
+                for name in code.co_names:
+                    g = rule.__globals__.get(name)
+                    if isinstance(g, re.Pattern):
+                        h.update(g.pattern.encode())
+            self._cache_key = h.hexdigest()
+        return self._cache_key
+
+
+def _synonym(marker, syn_text, misspelling_rule):
+    predicate = "SYNONYM_OF" if marker == "=" else "SPELLING_OF"
+    sm = _SYN_TARGET_RE.match(syn_text)
+    if sm:
+        target, detail = sm.group(1), sm.group(2)
+    else:
+        target, detail = syn_text.split()[0], ""
+    if misspelling_rule and "misspelling" in detail.lower():
+        predicate = "SPELLING_OF"
+    return {"predicate": predicate, "target": target, "detail": detail}
+
+
+def synonym_type(detail):
+    """'j.s.s.' or 'j.o.s.' when a synonym detail starts with one, else ''."""
+    m = _SYNONYM_TYPE_RE.match(detail) if detail else None
+    return m.group(1) if m else ""
+
+
+def iter_placements(body, default_leaf_rank, dialect):
+    """Yield a Placement for every taxon line of a source body.
+
+    body is the body text or any iterable of lines (see read_source()).
+    Taxa with a rank keyword get their parent from the rank hierarchy, so
+    indentation (mixed tabs/spaces in the sources) is never relied on;
+    other lines get default_leaf_rank.  "= X" / "~ X" lines attach to the
+    preceding placement as SYNONYM_OF / SPELLING_OF.
+    """
+    if isinstance(body, str):
+        body = body.splitlines()
+
+    d = dialect
+    state = ParseState()
+    stack = state.stack
+    rank_re = d.rank_re
+    rank_order = d.rank_order
+    caps_ranks = d.caps_ranks
+    pending = None
+
+    for raw_line in body:
+        stripped = raw_line.strip()
+        if not stripped or stripped[0] == "#":
+            continue
+        if d.stop_re is not None and d.stop_re.match(stripped):
+            break
+
+        # Synonym lines belong to the preceding placement
+        if pending is not None and stripped[0] in "=~":
+            sm = _SYNONYM_RE.match(stripped)
+            if sm:
+                pending.synonyms.append(
+                    _synonym(sm.group(1), sm.group(2).strip(), d.misspelling))
+                continue
+
+        if any(rule(state, stripped) for rule in d.line_rules):
+            continue
+
+        # Status markers
+        status = "asserted"
+        line = stripped
+        if line[0] == "?":
+            status = "questionable"
+            line = line[1:].strip()
+        if "[incertae sedis]" in line:
+            status = "incertae_sedis"
+            line = line.replace("[incertae sedis]", "").strip()
+
+        if d.skip_unassigned and "UNASSIGNED" in line.upper():
+            continue
+
+        header = None
+        for rule in d.entry_rules:
+            header = rule(state, line)
+            if header is not None:
+                break
+        if header is False:
+            continue
+
+        location = temporal_code = type_species = ""
+        if header:
+            rank, name = header
+            authority_str = ""
+        else:
+            rank = default_leaf_rank
+            m = rank_re.match(line)
+            if m:
+                rank = m.group(1)
+                line = line[m.end():].strip()
+
+            if d.type_species and "[*" in line:
+                ts = _TYPE_SPECIES_RE.search(line)
+                if ts:
+                    type_species = ts.group(1)
+            clean = _BRACKET_RE.sub("", line).strip() if "[" in line else line
+            if "|" in clean:
+                fields = clean.split("|")
+                clean = fields[0].strip()
+                if d.pipe_fields:
+                    if len(fields) == 2:
+                        # A lone second field is a temporal code if it looks like one
+                        field = fields[1].strip()
+                        if d.temporal_re.match(field):
+                            temporal_code = field
+                        else:
+                            location = field
+                    else:
+                        location = fields[1].strip()
+                        temporal_code = fields[2].strip()
+                    if d.strip_temporal_qmark and temporal_code.startswith("?"):
+                        temporal_code = temporal_code[1:]
+
+            parts = clean.split(None, 1)
+            if not parts:
+                continue
+            name = parts[0]
+            authority_str = parts[1].strip() if len(parts) > 1 else ""
+            if name in d.noise_names:
+                continue
+
+            # ALL CAPS rank names in the sources -> title case
+            if (len(name) > 1 and name == name.upper()
+                    and (caps_ranks is None or rank in caps_ranks)):
+                name = name[0] + name[1:].lower()
+
+        author = year = ""
+        if authority_str:
+            ym = _YEAR_RE.search(authority_str)
+            if ym:
+                year = ym.group(1)
+                author = authority_str[:ym.start()].strip().rstrip(",")
+            else:
+                author = authority_str
+
+        # Parent: nearest ancestor with a strictly higher rank
+        cur_order = rank_order.get(rank, d.default_order)
+        while stack and stack[-1][0] >= cur_order:
+            stack.pop()
+        parent_name, parent_rank = (stack[-1][1], stack[-1][2]) if stack else (None, None)
+        stack.append((cur_order, name, rank))
+        if d.track_known:
+            state.known[name.lower()] = (cur_order, rank)
+
+        if pending is not None:
+            yield pending
+        pending = Placement(name, rank, author, year, parent_name, parent_rank,
+                            status, location, temporal_code, type_species,
+                            state.is_valid)
+
+    if pending is not None:
+        yield pending
+
+
+# ---------------------------------------------------------------------------
+# Parse cache
+# ---------------------------------------------------------------------------
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _cache_entry(path, default_leaf_rank, dialect, cache_dir):
+    """(cache file, key) of a source's placements."""
+    cache_file = Path(cache_dir) / (
+        f"{path.stem}.{default_leaf_rank}.{dialect.cache_key[:16]}.marshal")
+    return cache_file, (_file_sha256(path), PARSER_VERSION, dialect.cache_key)
+
+
+def _read_cache(cache_file, key):
+    """Cached row tuples, or None when missing or stale."""
+    try:
+        with open(cache_file, "rb") as f:
+            cached_key, rows = marshal.loads(f.read())
+        if tuple(cached_key) == key:
+            return rows
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    return None
+
+
+def _write_cache(cache_file, key, rows):
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(marshal.dumps((key, tuple(rows))))
+        os.replace(tmp, cache_file)
+    except OSError:
+        pass  # read-only checkout: the cache is only an optimization
+
+
+def _parse_rows(path, default_leaf_rank, dialect):
+    """Row tuples of a parsed source (also the worker of load_all_placements)."""
+    _, lines = read_source(path)
+    return [p.as_row() for p in iter_placements(lines, default_leaf_rank, dialect)]
+
+
+def load_placements(path, default_leaf_rank, dialect, cache_dir=CACHE_DIR):
+    """Placements of a source file, from the parse cache when it is current.
+
+    Returns a list of Placement.  cache_dir=None parses without caching.
+    """
+    path = Path(path)
+    if cache_dir is None:
+        _, lines = read_source(path)
+        return list(iter_placements(lines, default_leaf_rank, dialect))
+
+    cache_file, key = _cache_entry(path, default_leaf_rank, dialect, cache_dir)
+    rows = _read_cache(cache_file, key)
+    if rows is not None:
+        return [Placement.from_row(r) for r in rows]
+
+    _, lines = read_source(path)
+    placements = list(iter_placements(lines, default_leaf_rank, dialect))
+    _write_cache(cache_file, key, (p.as_row() for p in placements))
+    return placements
+
+
+def load_all_placements(paths, default_leaf_rank, dialect, jobs=None, cache_dir=CACHE_DIR):
+    """load_placements() for several sources, parsing them in parallel.
+
+    Sources missing from the parse cache are parsed one per worker process
+    (at most jobs, default: CPU count) and come back as row tuples; the
+    result is a list of placement lists in the order of paths, so the
+    caller's name resolution and id assignment stay serial and
+    deterministic.  A single miss, or jobs=1, is parsed in-process.
+    """
+    paths = [Path(p) for p in paths]
+    rows, misses = [None] * len(paths), []
+    for i, path in enumerate(paths):
+        if cache_dir is not None:
+            entry = _cache_entry(path, default_leaf_rank, dialect, cache_dir)
+            rows[i] = _read_cache(*entry)
+        else:
+            entry = None
+        if rows[i] is None:
+            misses.append((i, entry))
+
+    jobs = min(jobs or os.cpu_count() or 1, len(misses))
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            parsed = list(pool.map(_parse_rows, [paths[i] for i, _ in misses],
+                                   repeat(default_leaf_rank), repeat(dialect)))
+    else:
+        parsed = [_parse_rows(paths[i], default_leaf_rank, dialect) for i, _ in misses]
+    for (i, entry), result in zip(misses, parsed):
+        rows[i] = result
+        if entry is not None:
+            _write_cache(*entry, result)
+    return [[Placement.from_row(r) for r in source_rows] for source_rows in rows]
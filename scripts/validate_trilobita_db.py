@@ -4,7 +4,7 @@
 Validates db/trilobita-{version}.db against db/trilobita-canonical-{version}.db:
   1. Tree equivalence (parent_id vs v_taxonomic_ranks)
   2. Count verification
-  3. CTE tree traversal (all valid genera reachable)
+  3. Profile tree traversal (all valid genera reachable, no cycles)
 """
 
 import argparse
@@ -14,6 +14,7 @@ import sys
 from pathlib import Path
 
 from db_path import find_canonical_db
+from tree_engine import ProfileTree
 
 ROOT = Path(__file__).resolve().parent.parent
 SRC_DB = Path(find_canonical_db())
@@ -155,12 +156,15 @@ def main():
     # --- 3. Profile checks ---
     print("\n3. Profile checks")
 
-    # Count reachable taxa via v_taxonomy_tree (edge_cache based, should be fast)
-    n_reachable = dst.execute(
-        "SELECT COUNT(*) FROM v_taxonomy_tree"
-    ).fetchone()[0]
-    check("tree reachable taxa", n_reachable > 4800,
-          f"{n_reachable} reachable via default profile tree")
+    # Taxa reachable from the Class root(s) of the default profile tree
+    tree = ProfileTree.from_db(dst, 1)
+    class_ids = [r[0] for r in dst.execute("SELECT id FROM taxon WHERE rank = 'Class'")
+                 if r[0] in tree]
+    reachable = set(tree.descendants(class_ids, include_self=True)[1].tolist())
+    check("tree reachable taxa", len(reachable) > 4800,
+          f"{len(reachable)} reachable via default profile tree")
+    check("no cycles in default profile", len(tree.unrooted) == 0,
+          f"{len(tree.unrooted)} taxa caught in a cycle")
 
     # Check all valid genera in default profile
     valid_genera_total = dst.execute(
@@ -212,10 +216,9 @@ def main():
     print("\n5. Demo queries")
 
     # Orders from tree
-    orders = dst.execute(
-        "SELECT name FROM v_taxonomy_tree WHERE rank='Order' ORDER BY name"
-    ).fetchall()
-    print(f"   Orders: {', '.join(r[0] for r in orders)}")
+    orders = sorted(name for tid, name in dst.execute(
+        "SELECT id, name FROM taxon WHERE rank='Order'") if tid in reachable)
+    print(f"   Orders: {', '.join(orders)}")
 
     # Assertion example
     example = dst.execute("""
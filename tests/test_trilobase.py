@@ -1703,3 +1703,968 @@ class TestAssertionDBEditableEntities:
                     assert fk_table in tables, \
                         f"{ename}.{fname}: FK table '{fk_table}' not in DB"
 
+
+
+# ═══════════════════════════════════════════════════════════════════════
+# Materialized tree caches (scripts/tree_cache.py)
+# ═══════════════════════════════════════════════════════════════════════
+
+def _create_tree_cache_db():
+    """Small two-profile tree: profile 2 moves Genus B from Family 1 to Family 2.
+
+    Profile 1:  Class ─ Order ─┬─ Family1 ─┬─ GenusA
+                               │           └─ GenusB
+                               └─ Family2 ─── GenusC
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.executescript("""
+        CREATE TABLE taxon (id INTEGER PRIMARY KEY, name TEXT, rank TEXT,
+                            author TEXT, year TEXT, temporal_code TEXT,
+                            is_valid INTEGER DEFAULT 1);
+        CREATE TABLE classification_profile (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE classification_edge_cache (
+            profile_id INTEGER NOT NULL, child_id INTEGER NOT NULL,
+            parent_id INTEGER, PRIMARY KEY (profile_id, child_id));
+        CREATE TABLE temporal_code_mya (code TEXT, fad_mya REAL, lad_mya REAL);
+        INSERT INTO temporal_code_mya VALUES ('LCAM', 538.8, 509.0),
+                                             ('MCAM', 509.0, 497.0);
+        INSERT INTO taxon VALUES
+            (1, 'Trilobita', 'Class', NULL, NULL, NULL, 1),
+            (2, 'Testida', 'Order', NULL, NULL, NULL, 1),
+            (3, 'Alphidae', 'Family', NULL, NULL, NULL, 1),
+            (4, 'Betidae', 'Family', NULL, NULL, NULL, 1),
+            (5, 'Alphus', 'Genus', 'SMITH', '1900', 'LCAM', 1),
+            (6, 'Betus', 'Genus', 'JONES', '1950', 'MCAM', 1),
+            (7, 'Gammus', 'Genus', 'BROWN', '1920', 'LCAM', 0);
+        INSERT INTO classification_profile VALUES (1, 'p1'), (2, 'p2');
+        INSERT INTO classification_edge_cache VALUES
+            (1, 2, 1), (1, 3, 2), (1, 4, 2), (1, 5, 3), (1, 6, 3), (1, 7, 4),
+            (2, 2, 1), (2, 3, 2), (2, 4, 2), (2, 5, 3), (2, 6, 4), (2, 7, 4);
+    """)
+    return conn
+
+
+class TestTreeCache:
+    """build_tree_caches() materializes tables that replace recursive CTEs."""
+
+    @pytest.fixture
+    def conn(self):
+        from tree_cache import build_tree_caches
+        conn = _create_tree_cache_db()
+        build_tree_caches(conn)
+        yield conn
+        conn.close()
+
+    def test_closure_self_rows(self, conn):
+        """Every profile node, including the root, has a depth-0 self row."""
+        n = conn.execute(
+            "SELECT COUNT(*) FROM classification_closure "
+            "WHERE profile_id = 1 AND depth = 0").fetchone()[0]
+        assert n == 7
+
+    def test_closure_ancestor_chain(self, conn):
+        """Ancestors of a genus come back ordered root-first by depth."""
+        rows = conn.execute(
+            "SELECT ancestor_id FROM classification_closure "
+            "WHERE profile_id = 1 AND descendant_id = 6 AND depth > 0 "
+            "ORDER BY depth DESC").fetchall()
+        assert [r[0] for r in rows] == [1, 2, 3]
+
+    def test_closure_is_per_profile(self, conn):
+        """Subtree of Betidae differs between profiles."""
+        def genera(profile_id):
+            return {r[0] for r in conn.execute(
+                "SELECT descendant_id FROM classification_closure "
+                "WHERE profile_id = ? AND ancestor_id = 4 AND depth > 0",
+                (profile_id,))}
+        assert genera(1) == {7}
+        assert genera(2) == {6, 7}
+
+    def test_tree_index_intervals_nest(self, conn):
+        """Every descendant's lft lies inside its ancestor's (lft, rgt)."""
+        idx = {r[0]: r[1:] for r in conn.execute(
+            "SELECT taxon_id, lft, rgt, depth FROM profile_tree_index "
+            "WHERE profile_id = 2")}
+        assert len(idx) == 7
+        assert idx[1][2] == 0 and idx[6][2] == 3
+        for anc, desc in conn.execute(
+                "SELECT ancestor_id, descendant_id FROM classification_closure "
+                "WHERE profile_id = 2 AND depth > 0"):
+            assert idx[anc][0] < idx[desc][0] < idx[anc][1]
+
+    def test_tree_index_subtree_range(self, conn):
+        """Genera under a family are one BETWEEN range."""
+        rows = conn.execute(
+            "SELECT d.taxon_id FROM profile_tree_index f "
+            "JOIN profile_tree_index d ON d.profile_id = f.profile_id "
+            "  AND d.lft BETWEEN f.lft + 1 AND f.rgt "
+            "WHERE f.profile_id = 2 AND f.taxon_id = 4").fetchall()
+        assert {r[0] for r in rows} == {6, 7}
+
+    def test_node_stats_rollup(self, conn):
+        """Genus counts roll up bottom-up; invalid genera are excluded from valid_genera."""
+        stats = {r[0]: r[1:] for r in conn.execute(
+            "SELECT taxon_id, direct_genera, total_genera, valid_genera, "
+            "child_rank_counts_json FROM profile_node_stats WHERE profile_id = 1")}
+        assert stats[3][:3] == (2, 2, 2)
+        assert stats[4][:3] == (1, 1, 0)
+        assert stats[2] == (0, 3, 2, '{"Family": 2}')
+        assert stats[1][:3] == (0, 3, 2)
+        assert stats[5] == (0, 0, 0, '{}')
+
+    def test_diversity_cube_counts(self, conn):
+        """Cube rows match the per-profile family grouping; invalid genera are skipped."""
+        rows = conn.execute(
+            "SELECT profile_id, temporal_code, group_name, genus_count FROM diversity_cube "
+            "WHERE grouping_rank = 'Family' ORDER BY profile_id, temporal_code").fetchall()
+        assert rows == [(1, 'LCAM', 'Alphidae', 1), (1, 'MCAM', 'Alphidae', 1),
+                        (2, 'LCAM', 'Alphidae', 1), (2, 'MCAM', 'Betidae', 1)]
+
+    def test_diversity_cube_groups(self):
+        """Homonymous groups keep their own rows; the '' rank holds every genus as 'Unknown'."""
+        from tree_cache import build_tree_caches
+        conn = _create_tree_cache_db()
+        conn.execute("UPDATE taxon SET name = 'Alphidae', temporal_code = 'LCAM' WHERE id = 4")
+        conn.execute("UPDATE taxon SET is_valid = 1 WHERE id = 7")
+        build_tree_caches(conn)
+        rows = conn.execute(
+            "SELECT group_id, group_name, genus_count FROM diversity_cube "
+            "WHERE profile_id = 1 AND grouping_rank = 'Family' AND temporal_code = 'LCAM' "
+            "ORDER BY group_id").fetchall()
+        assert rows == [(3, 'Alphidae', 1), (4, 'Alphidae', 1)]
+        rows = conn.execute(
+            "SELECT temporal_code, group_id, group_name, genus_count FROM diversity_cube "
+            "WHERE profile_id = 1 AND grouping_rank = '' ORDER BY temporal_code").fetchall()
+        assert rows == [('LCAM', 0, 'Unknown', 2), ('MCAM', 0, 'Unknown', 1)]
+        conn.close()
+
+    def test_timeline_snapshots(self):
+        """Each axis stop stores the surviving genera plus their ancestors and edges."""
+        from tree_cache import build_tree_caches
+        conn = _create_tree_cache_db()
+        axis = [("timeline_geologic_periods", "", "SELECT fad_mya AS id FROM temporal_code_mya", None)]
+        counts = build_tree_caches(conn, axis)
+        assert counts["timeline_snapshot_nodes"] > 0
+        nodes = {r[0] for r in conn.execute(
+            "SELECT taxon_id FROM timeline_snapshot_nodes "
+            "WHERE profile_id = 1 AND stop_mya IS 538.8")}
+        assert nodes == {1, 2, 3, 4, 5, 7}
+        edges = set(conn.execute(
+            "SELECT child_id, parent_id FROM timeline_snapshot_edges "
+            "WHERE profile_id = 2 AND stop_mya IS 509.0"))
+        assert edges == {(2, 1), (3, 2), (4, 2), (5, 3), (6, 4), (7, 4)}
+        full = conn.execute(
+            "SELECT COUNT(*) FROM timeline_snapshot_nodes "
+            "WHERE profile_id = 1 AND stop_mya IS NULL").fetchone()[0]
+        assert full == 7
+        conn.close()
+
+    def test_timeline_frame_deltas(self):
+        """Replaying pubyear deltas frame by frame rebuilds the cumulative tree."""
+        from tree_cache import build_tree_caches
+        conn = _create_tree_cache_db()
+        axis = [("timeline_publication_years", "",
+                 "SELECT DISTINCT CAST(year AS INTEGER) FROM taxon "
+                 "WHERE rank = 'Genus' ORDER BY 1", None)]
+        build_tree_caches(conn, axis)
+        frames = conn.execute(
+            "SELECT frame, stop_value, n_nodes FROM timeline_frames "
+            "WHERE profile_id = 1 AND axis = 'pubyear' ORDER BY frame").fetchall()
+        assert [f[1] for f in frames] == [1900, 1920, 1950]
+        nodes = set()
+        for frame, _stop, n_nodes in frames:
+            for taxon_id, op in conn.execute(
+                    "SELECT taxon_id, op FROM timeline_node_deltas "
+                    "WHERE profile_id = 1 AND axis = 'pubyear' AND frame = ?", (frame,)):
+                (nodes.add if op == 'add' else nodes.discard)(taxon_id)
+            assert len(nodes) == n_nodes
+        assert nodes == {1, 2, 3, 4, 5, 6, 7}
+        added = {r[0] for r in conn.execute(
+            "SELECT taxon_id FROM timeline_node_deltas "
+            "WHERE profile_id = 1 AND axis = 'pubyear' AND frame = 1")}
+        assert added == {4, 7}
+        conn.close()
+
+    def test_node_stats_min_desc_year(self, conn):
+        """min_desc_year is the earliest genus year in the node's subtree."""
+        years = dict(conn.execute(
+            "SELECT taxon_id, min_desc_year FROM profile_node_stats WHERE profile_id = 2"))
+        assert years == {1: 1900, 2: 1900, 3: 1900, 4: 1920, 5: 1900, 6: 1950, 7: 1920}
+        as_of_1910 = {r[0] for r in conn.execute(
+            "SELECT taxon_id FROM profile_node_stats "
+            "WHERE profile_id = 2 AND min_desc_year <= 1910")}
+        assert as_of_1910 == {1, 2, 3, 5}
+
+    def test_profile_diff_cache(self, conn):
+        """Betus moves between profiles; a profile against itself is all 'same'."""
+        rows = conn.execute(
+            "SELECT child_id, parent_a, parent_b, diff_status FROM profile_diff_cache "
+            "WHERE profile_a = 1 AND profile_b = 2 AND diff_status != 'same'").fetchall()
+        assert rows == [(6, 3, 4, 'moved')]
+        statuses = {r[0] for r in conn.execute(
+            "SELECT DISTINCT diff_status FROM profile_diff_cache "
+            "WHERE profile_a = 2 AND profile_b = 2")}
+        assert statuses == {'same'}
+        added = conn.execute(
+            "SELECT COUNT(*) FROM profile_diff_cache "
+            "WHERE profile_a = 0 AND profile_b = 1 AND diff_status = 'added'").fetchone()[0]
+        assert added == 6
+
+
+class TestIndexAdvisor:
+    """check_query_plans() creates policy indexes and fails on table scans."""
+
+    @pytest.fixture
+    def conn(self):
+        conn = _create_tree_cache_db()
+        conn.execute("CREATE TABLE ui_queries (name TEXT, sql TEXT, params_json TEXT)")
+        conn.execute(
+            "INSERT INTO ui_queries VALUES ('taxon_by_name', "
+            "'SELECT id, rank FROM taxon WHERE name = :name', NULL)")
+        yield conn
+        conn.close()
+
+    def test_policy_index_removes_scan(self, conn):
+        """Name lookups scan taxon until the policy index exists."""
+        from index_advisor import explain_query, check_query_plans
+        sql = conn.execute("SELECT sql FROM ui_queries").fetchone()[0]
+        before = explain_query(conn, 'taxon_by_name', sql)
+        assert [(f[0], f[1]) for f in before] == [('scan', 'taxon')]
+        report = check_query_plans(conn, verbose=False)
+        assert report == {}
+        names = {r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert 'idx_taxon_name' in names
+
+    def test_disallowed_scan_fails(self, conn):
+        """A scan of a large table outside ALLOWED_SCANS raises QueryPlanError."""
+        from index_advisor import QueryPlanError, check_query_plans
+        conn.execute("INSERT INTO ui_queries VALUES ('by_author', "
+                     "'SELECT id FROM taxon WHERE author = :author', NULL)")
+        with pytest.raises(QueryPlanError, match='by_author'):
+            check_query_plans(conn, verbose=False)
+
+    def test_slower_queries_limits(self):
+        """Only queries both MAX_SLOWDOWN times and MIN_SLOWDOWN_MS slower fail."""
+        from index_advisor import slower_queries
+        before = {'fast': 0.1, 'slow': 2.0, 'noisy': 2.0, 'new': 1.0}
+        after = {'fast': 0.5, 'slow': 4.0, 'noisy': 2.4, 'gone': 9.0}
+        assert slower_queries(before, after) == {'slow': (2.0, 4.0)}
+
+
+class TestSearchIndex:
+    """build_search_index() builds FTS5 tables searched by taxon_search."""
+
+    @pytest.fixture
+    def conn(self):
+        from search_index import build_search_index
+        conn = sqlite3.connect(':memory:')
+        conn.executescript("""
+            CREATE TABLE taxon (id INTEGER PRIMARY KEY, name TEXT, rank TEXT,
+                                author TEXT, type_species TEXT, location TEXT,
+                                formation TEXT);
+            CREATE TABLE reference (id INTEGER PRIMARY KEY, authors TEXT,
+                                    title TEXT, journal TEXT);
+            INSERT INTO taxon VALUES
+                (1, 'Paradoxides', 'Genus', 'BRONGNIART', 'Entomostracites paradoxissimus',
+                 'Sweden', 'Alum Shale'),
+                (2, 'Paradoxididae', 'Family', 'HAWLE & CORDA', NULL, NULL, NULL),
+                (3, 'Elrathia', 'Genus', 'WALCOTT', 'Conocoryphe kingii',
+                 'USA', 'Wheeler Shale'),
+                (4, 'Conocoryphe', 'Genus', 'CORDA', NULL, 'Czech Republic', NULL);
+            INSERT INTO reference VALUES
+                (1, 'WHITTINGTON, H.B.', 'Treatise on Invertebrate Paleontology', 'GSA');
+        """)
+        build_search_index(conn)
+        yield conn
+        conn.close()
+
+    def test_substring_match(self, conn):
+        """Trigram tokens match inside words, case-insensitively."""
+        ids = {r[0] for r in conn.execute(
+            "SELECT rowid FROM taxon_fts WHERE taxon_fts MATCH 'radox'")}
+        assert ids == {1, 2}
+        ids = {r[0] for r in conn.execute(
+            "SELECT rowid FROM taxon_fts WHERE taxon_fts MATCH '\"wheeler shale\"'")}
+        assert ids == {3}
+
+    def test_name_ranks_above_other_columns(self, conn):
+        """A hit in name outranks a hit in type_species with the weighted bm25."""
+        rows = conn.execute(
+            "SELECT rowid FROM taxon_fts WHERE taxon_fts MATCH 'conocoryph' "
+            "ORDER BY bm25(taxon_fts, 10.0, 3.0, 1.0, 1.0, 1.0)").fetchall()
+        assert rows == [(4,), (3,)]
+        n = conn.execute(
+            "SELECT COUNT(*) FROM reference_fts WHERE reference_fts MATCH 'invertebrate'"
+        ).fetchone()[0]
+        assert n == 1
+
+    def test_name_deletes_lookup(self, conn):
+        """Misspelled names reach the right taxon through shared delete keys."""
+        from search_index import name_deletes
+        assert name_deletes('abc') == {'abc': 0, 'bc': 1, 'ac': 1, 'ab': 1}
+        hits = {r[0] for r in conn.execute(
+            "SELECT d.taxon_id FROM taxon_name_deletes d "
+            "WHERE d.del_key IN ('paradoxide', 'paradoxids')")}
+        assert 1 in hits  # 'Paradoxidez' -> substitution of the last letter
+
+    def test_name_lookup_distance(self, conn):
+        """taxon_name_lookup reports true edit distances and drops far candidates."""
+        from search_index import NAME_LOOKUP_SQL, build_name_deletes
+        conn.execute("ALTER TABLE taxon ADD COLUMN year TEXT")
+        conn.execute("ALTER TABLE taxon ADD COLUMN is_valid INTEGER DEFAULT 1")
+        conn.execute("INSERT INTO taxon (id, name, rank) VALUES (5, 'Cdab', 'Genus')")
+        build_name_deletes(conn)
+
+        def lookup(q):
+            return [(r[1], r[6]) for r in conn.execute(
+                NAME_LOOKUP_SQL, {"q": q, "rank": None, "limit": None})]
+        assert lookup('Paradoxidez') == [('Paradoxides', 1)]
+        assert lookup('Elrahtia') == [('Elrathia', 1)]       # adjacent swap
+        assert lookup('Conocoryphee') == [('Conocoryphe', 1)]
+        assert lookup('Cdab') == [('Cdab', 0)]
+        assert lookup('abcd') == []     # shares 'ab' with cdab, but 4 edits away
+
+    def test_sync_triggers(self, conn):
+        """Edits to taxon and reference after the build reach the FTS indexes."""
+        from search_index import create_search_triggers, drop_search_triggers
+        drop_search_triggers(conn)
+        create_search_triggers(conn)
+
+        def match(fts, q):
+            return {r[0] for r in conn.execute(
+                f"SELECT rowid FROM {fts} WHERE {fts} MATCH ?", (q,))}
+        conn.execute("INSERT INTO taxon (id, name, rank) VALUES (5, 'Olenellus', 'Genus')")
+        conn.execute("UPDATE taxon SET formation = 'Burgess Shale' WHERE id = 3")
+        conn.execute("UPDATE taxon SET rank = 'Subgenus' WHERE id = 4")
+        conn.execute("DELETE FROM taxon WHERE id = 2")
+        conn.execute("UPDATE reference SET journal = 'Kansas' WHERE id = 1")
+        assert match("taxon_fts", "olenel") == {5}
+        assert match("taxon_fts", '"burgess shale"') == {3} and not match("taxon_fts", "wheeler")
+        assert match("taxon_fts", "radox") == {1}
+        assert match("reference_fts", "kansas") == {1} and not match("reference_fts", "GSA")
+        for fts in ("taxon_fts", "reference_fts"):
+            conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('integrity-check')")
+
+
+class TestNameReconcile:
+    """reconcile_taxa() finds near-duplicate names through blocking keys."""
+
+    @pytest.fixture
+    def conn(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript("""
+            CREATE TABLE taxon (id INTEGER PRIMARY KEY, name TEXT, rank TEXT,
+                                author TEXT, year TEXT, is_placeholder INTEGER DEFAULT 0);
+            CREATE TABLE assertion (
+                id INTEGER PRIMARY KEY,
+                subject_taxon_id INTEGER NOT NULL REFERENCES taxon(id),
+                predicate TEXT,
+                object_taxon_id INTEGER REFERENCES taxon(id),
+                UNIQUE(subject_taxon_id, predicate, object_taxon_id));
+            INSERT INTO taxon VALUES
+                (1, 'Botsfordiidae', 'Family', 'Schindewolf', '1955', 0),
+                (2, 'Botsfordiiidae', 'Family', 'Schindewolf', NULL, 0),
+                (3, 'Botsfordia', 'Genus', 'MATTHEW', '1891', 0),
+                (4, 'Spirifer', 'Genus', 'SOWERBY', '1816', 0),
+                (5, 'Spirifera', 'Genus', 'SOWERBY', '1816', 0),
+                (6, 'Spiriferina', 'Genus', 'ORBIGNY', '1847', 0);
+            INSERT INTO assertion VALUES
+                (1, 3, 'PLACED_IN', 1), (2, 3, 'PLACED_IN', 2),
+                (3, 5, 'SPELLING_OF', 4);
+        """)
+        yield conn
+        conn.close()
+
+    def test_blocking_keys(self):
+        from name_reconcile import phonetic_key, minhash_bands
+        assert phonetic_key('Phacops') == phonetic_key('Facops')
+        assert phonetic_key('Olenellus') == phonetic_key('Olenelus')
+        assert minhash_bands('Paradoxides') == minhash_bands('paradoxides')
+
+    def test_report_only_by_default(self, conn):
+        """Same-rank OCR variants are reported; SPELLING_OF pairs are not."""
+        from name_reconcile import reconcile_taxa
+        rec = reconcile_taxa(conn)
+        assert (rec['candidates'], rec['merged']) == (1, 0)
+        assert conn.execute("SELECT COUNT(*) FROM taxon").fetchone()[0] == 6
+
+    def test_merge_repoints_references(self, conn):
+        """Merging drops the duplicate, its references and resulting duplicates."""
+        from name_reconcile import reconcile_taxa
+        rec = reconcile_taxa(conn, merge_threshold=0.9)
+        assert rec['merged'] == 1
+        assert conn.execute("SELECT id FROM taxon WHERE name LIKE 'Botsford%dae'").fetchall() == [(1,)]
+        rows = conn.execute(
+            "SELECT subject_taxon_id, object_taxon_id FROM assertion "
+            "WHERE predicate = 'PLACED_IN'").fetchall()
+        assert rows == [(3, 1)]
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+
+
+class TestTSFParser:
+    """iter_placements() streams placements from a TSF body."""
+
+    BODY = (
+        "Order ASAPHIDA Salter, 1864\n"
+        "  Family ASAPHIDAE Burmeister, 1843\n"
+        "    Asaphus Brongniart, 1822 [*A. cornigerus] | Sweden | LORD\n"
+        "      = Isotelus (j.s.s., fide A, 1999)\n"
+        "    ?Ogygiocaris Angelin, 1854 | MORD\n"
+        "  Family UNASSIGNED\n"
+        "Addendum\n"
+        "    Later Author, 2000\n"
+    )
+
+    @staticmethod
+    def dialect(**kw):
+        from tsf_parser import TSFDialect
+        return TSFDialect({"Order", "Family"}, {"Order": 1, "Family": 4, "Genus": 6}, **kw)
+
+    def test_placements(self):
+        import re
+        from tsf_parser import iter_placements
+        ps = list(iter_placements(self.BODY, "Genus",
+                                  self.dialect(stop_re=re.compile("^Addendum"))))
+        assert [(p.name, p.rank, p.parent_name) for p in ps] == [
+            ("Asaphida", "Order", None), ("Asaphidae", "Family", "Asaphida"),
+            ("Asaphus", "Genus", "Asaphidae"), ("Ogygiocaris", "Genus", "Asaphidae")]
+        assert ps[2]["synonyms"] == [{"predicate": "SYNONYM_OF", "target": "Isotelus",
+                                      "detail": "j.s.s., fide A, 1999"}]
+        assert (ps[2]["location"], ps[2]["temporal_code"], ps[2]["year"]) == ("Sweden", "LORD", "1822")
+        assert (ps[3]["status"], ps[3]["temporal_code"], ps[3].get("raw_entry", "")) == \
+            ("questionable", "MORD", "")
+
+    def test_synonym_type(self):
+        from tsf_parser import synonym_type
+        assert synonym_type("j.s.s., fide A, 1999") == "j.s.s."
+        assert synonym_type("j.o.s.") == "j.o.s."
+        assert synonym_type("misspelling, see j.s.s.") == ""
+        assert synonym_type("") == ""
+
+    def test_rules(self):
+        """Line rules consume headers; entry rules turn them into taxa."""
+        from tsf_parser import iter_placements
+
+        def skip_family(state, line):
+            return line.startswith("Family")
+
+        def uncertain(state, line):
+            return ("Family", "Family uncertain") if line == "Family UNASSIGNED" else None
+
+        ps = list(iter_placements(self.BODY, "Genus", self.dialect(
+            line_rules=(skip_family,), type_species=True)))
+        assert [p.parent_name for p in ps][1:3] == ["Asaphida", "Asaphida"]
+        assert ps[1].type_species == "A. cornigerus"
+        ps = list(iter_placements(self.BODY, "Genus", self.dialect(
+            skip_unassigned=False, entry_rules=(uncertain,))))
+        assert [p.name for p in ps][-3:] == ["Family uncertain", "Addendum", "Later"]
+        assert ps[-1].parent_name == "Family uncertain"
+
+    def test_read_source_streams(self, tmp_path):
+        from tsf_parser import iter_placements, read_source
+        src = tmp_path / "src.txt"
+        src.write_text("---\nreference: Test 2000\nscope:\n  - taxon: Asaphida coverage: comprehensive\n---\n"
+                       + self.BODY, encoding="utf-8")
+        header, lines = read_source(src)
+        assert header == {"reference": "Test 2000",
+                          "scope": [{"taxon": "Asaphida", "coverage": "comprehensive"}]}
+        placements = iter_placements(lines, "Genus", self.dialect())
+        assert next(placements).name == "Asaphida"
+        assert len(list(placements)) == 5
+
+    def test_parse_cache(self, tmp_path):
+        """load_placements() reuses the cache until the source changes."""
+        from tsf_parser import load_placements
+        src = tmp_path / "src.txt"
+        src.write_text(self.BODY, encoding="utf-8")
+        cache = tmp_path / "cache"
+        first = load_placements(src, "Genus", self.dialect(), cache)
+        files = list(cache.iterdir())
+        assert len(files) == 1
+        again = load_placements(src, "Genus", self.dialect(), cache)
+        assert [p.as_dict() for p in again] == [p.as_dict() for p in first]
+        assert again[2]["synonyms"][0]["target"] == "Isotelus"
+
+        src.write_text(self.BODY.replace("Asaphus", "Isotelus"), encoding="utf-8")
+        assert load_placements(src, "Genus", self.dialect(), cache)[2].name == "Isotelus"
+        files[0].write_bytes(b"garbage")
+        assert len(load_placements(src, "Genus", self.dialect(), cache)) == 6
+
+    def test_load_all_placements(self, tmp_path):
+        """Parallel parsing returns the serial result, in the order of the paths."""
+        from tsf_parser import load_all_placements, load_placements
+        paths = []
+        for i, body in enumerate([self.BODY, self.BODY.replace("Asaphus", "Isotelus"), self.BODY]):
+            paths.append(tmp_path / f"src{i}.txt")
+            paths[-1].write_text(body, encoding="utf-8")
+        cache = tmp_path / "cache"
+        load_placements(paths[2], "Genus", self.dialect(), cache)   # one cache hit
+        parsed = load_all_placements(paths, "Genus", self.dialect(), jobs=2, cache_dir=cache)
+        serial = [load_placements(p, "Genus", self.dialect(), None) for p in paths]
+        assert [[p.as_dict() for p in ps] for ps in parsed] == \
+               [[p.as_dict() for p in ps] for ps in serial]
+        assert parsed[1][2].name == "Isotelus"
+        assert len(list(cache.iterdir())) == 3
+
+
+class TestBuildState:
+    """--incremental: build_state hashes and the up-to-date check."""
+
+    def test_stale_profiles(self, tmp_path):
+        from build_state import (BUILD_CODE, build_inputs, read_build_state, stale_profiles,
+                                 write_build_state)
+        builder = tmp_path / "build_x_db.py"
+        builder.write_text("# builder\n")
+        for name in BUILD_CODE:
+            (tmp_path / name).write_text(name)
+        a, b = tmp_path / "a.txt", tmp_path / "b.txt"
+        a.write_text("Family A\n")
+        b.write_text("Family B\n")
+        inputs = build_inputs(builder, {1: [a], 2: [a, b]})
+        db = tmp_path / "x.db"
+        assert read_build_state(db) is None
+        conn = sqlite3.connect(db)
+        write_build_state(conn, inputs)
+        conn.close()
+        previous = read_build_state(db)
+        assert previous == inputs
+        assert stale_profiles(None, inputs) is None
+        assert stale_profiles(previous, inputs) == set()
+        b.write_text("Family B2\n")
+        assert stale_profiles(previous, build_inputs(builder, {1: [a], 2: [a, b]})) == {2}
+        a.write_text("Family A2\n")
+        assert stale_profiles(previous, build_inputs(builder, {1: [a], 2: [a, b]})) == {1, 2}
+        # a profile added or removed, or changed build code: full build
+        assert stale_profiles(previous, build_inputs(builder, {1: [a]})) is None
+        assert stale_profiles(previous, build_inputs(
+            builder, {1: [a], 2: [a, b]}, options={"merge_threshold": 0.9})) is None
+        (tmp_path / "tree_cache.py").write_text("changed")
+        assert stale_profiles(previous, build_inputs(builder, {1: [a], 2: [a, b]})) is None
+
+
+class TestBuildStage:
+    """Builder staging: fill-if-empty semantics, local ids and the bulk flush."""
+
+    def _conn(self):
+        conn = sqlite3.connect(':memory:')
+        conn.executescript("""
+            CREATE TABLE taxon (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, rank TEXT NOT NULL,
+                author TEXT, year TEXT, type_species TEXT, is_placeholder INTEGER DEFAULT 0,
+                is_valid INTEGER DEFAULT 1, created_at TIMESTAMP);
+            CREATE TABLE assertion (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subject_taxon_id INTEGER NOT NULL, predicate TEXT NOT NULL,
+                object_taxon_id INTEGER, reference_id INTEGER,
+                assertion_status TEXT, curation_confidence TEXT,
+                synonym_type TEXT, notes TEXT,
+                UNIQUE(subject_taxon_id, predicate, object_taxon_id, reference_id));
+            INSERT INTO taxon (name, rank, author, year) VALUES ('Alphidae', 'Family', 'SMITH', '');
+        """)
+        return conn
+
+    def test_fill_and_flush(self):
+        from staging import BuildStage
+        conn = self._conn()
+        stage = BuildStage(conn)
+        genus = stage.add_taxon('Alphus', 'Genus')
+        assert genus == 2
+        stage.fill(1, 'author', 'JONES')        # already set
+        stage.fill(1, 'year', '1901')           # blank
+        stage.fill(genus, 'type_species', 'Alphus primus', blank=())
+        stage.fill(genus, 'type_species', 'Alphus secundus', blank=())
+        stage.add_assertion(genus, 'PLACED_IN', 1, 10)
+        stage.add_assertion(genus, 'PLACED_IN', 1, 10)
+        assert stage.flush() == {'taxon': 1, 'updated': 1, 'assertion': 2}
+        assert conn.execute("SELECT author, year FROM taxon WHERE id = 1").fetchone() == ('SMITH', '1901')
+        assert conn.execute(
+            "SELECT type_species, is_valid FROM taxon WHERE id = 2").fetchone() == ('Alphus primus', 1)
+        assert conn.execute("SELECT COUNT(*) FROM assertion").fetchone()[0] == 1
+        # taxa inserted by plain SQL between flushes keep the id sequence intact
+        conn.execute("INSERT INTO taxon (name, rank) VALUES ('Betus', 'Genus')")
+        assert stage.add_taxon('Gammus', 'Genus') == 4
+        stage.fill(3, 'author', 'BROWN')
+        stage.flush()
+        assert conn.execute("SELECT author FROM taxon WHERE id = 3").fetchone()[0] == 'BROWN'
+        conn.close()
+
+    def test_persist(self, tmp_path):
+        from staging import open_build_db, persist_build_db
+        conn = open_build_db()
+        self._conn().backup(conn)
+        dst = tmp_path / "x.db"
+        persist_build_db(conn, dst)
+        conn.close()
+        reopened = sqlite3.connect(dst)
+        assert reopened.execute("SELECT name FROM taxon").fetchall() == [('Alphidae',)]
+        assert not (tmp_path / "x.db.tmp").exists()
+        reopened.close()
+
+
+class TestCanonicalFallback:
+    """build_trilobita_db: set-based fallback to the canonical parent_id (Fix 3)."""
+
+    def _dst(self, tmp_path):
+        import build_trilobita_db
+        canon = tmp_path / "canon.db"
+        conn = sqlite3.connect(canon)
+        conn.executescript("""
+            CREATE TABLE taxonomic_ranks (id INTEGER PRIMARY KEY, parent_id INTEGER);
+            INSERT INTO taxonomic_ranks VALUES (1, NULL), (2, 1), (3, 2), (4, 2), (5, 99), (6, 2);
+        """)
+        conn.commit()
+        conn.close()
+        dst = sqlite3.connect(':memory:')
+        dst.execute("PRAGMA foreign_keys=ON")
+        build_trilobita_db.create_schema(dst.cursor())
+        dst.executescript("""
+            INSERT INTO taxon (id, name, rank) VALUES
+                (1, 'Trilobita', 'Class'), (2, 'Alphidae', 'Family'), (3, 'Alphus', 'Genus'),
+                (4, 'Betus', 'Genus'), (5, 'Gammus', 'Genus'), (6, 'Deltus', 'Genus');
+        """)
+        dst.execute(f"ATTACH DATABASE '{canon}' AS canon")
+        return dst
+
+    def test_fallback_edges(self, tmp_path, monkeypatch):
+        """Unplaced taxa get their canonical parent; the edges are the inserted rows."""
+        import build_trilobita_db
+        dst = self._dst(tmp_path)
+        dst.execute("INSERT INTO reference (id, title) VALUES (7, 'Jell & Adrain 2002')")
+        monkeypatch.setattr(build_trilobita_db, "JA2002_REF_ID", 7)
+        placed, edges = {4}, [(4, 2)]
+        # Trilobita is the root, Betus is placed, Gammus' parent is not in the DB
+        assert build_trilobita_db.fallback_canonical_parent_id(dst, placed, edges) == 3
+        assert edges == [(4, 2), (2, 1), (3, 2), (6, 2)]
+        assert placed == {2, 3, 4, 6}
+        assert dst.execute(
+            "SELECT subject_taxon_id, object_taxon_id, reference_id FROM assertion "
+            "ORDER BY id").fetchall() == [(2, 1, 7), (3, 2, 7), (6, 2, 7)]
+
+    def test_missing_reference(self, tmp_path, monkeypatch):
+        """Rows failing a foreign key are skipped instead of aborting the insert."""
+        import build_trilobita_db
+        dst = self._dst(tmp_path)
+        monkeypatch.setattr(build_trilobita_db, "JA2002_REF_ID", 7)
+        placed, edges = set(), []
+        assert build_trilobita_db.fallback_canonical_parent_id(dst, placed, edges) == 0
+        assert edges == [] and placed == set()
+        assert dst.execute("SELECT COUNT(*) FROM assertion").fetchone()[0] == 0
+
+
+class TestBuildAll:
+    """build_all: release DAG, target selection and input fingerprints."""
+
+    def test_targets(self):
+        from build_all import TAXON_PACKAGES, build_targets, select_targets
+        targets = build_targets()
+        assert len(targets) == 2 * len(TAXON_PACKAGES) + 2
+        assert targets["brachiopoda_scoda"].deps == ["brachiopoda_db"]
+        assert set(targets["paleobase_scoda"].deps) == {
+            n for n in targets if n.endswith("_scoda") and n != "paleobase_scoda"}
+        assert sorted(select_targets(targets, ["mollusca"])) == ["mollusca_db", "mollusca_scoda"]
+        assert sorted(select_targets(targets, ["brachiopoda"], db_only=True)) == ["brachiopoda_db"]
+        assert len(select_targets(targets, ["paleobase"])) == len(targets)
+
+    def test_inputs(self):
+        from build_all import SCRIPTS, code_files, data_files
+        script = SCRIPTS / "build_brachiopoda_db.py"
+        code = {p.name for p in code_files(script)}
+        assert {"build_brachiopoda_db.py", "tsf_parser.py", "build_state.py",
+                "name_reconcile.py"} <= code
+        names = {p.name for p in data_files(script)}
+        assert "treatise_brachiopoda_1965_vol1.txt" in names
+        assert "brachiopoda_classification.txt" in names
+
+
+class TestBuildProfiler:
+    """--profile: per-phase timings and normalized per-statement SQL."""
+
+    def test_normalize_sql(self):
+        from build_profiler import normalize_sql
+        assert normalize_sql("SELECT * FROM t\n  WHERE id IN (1, 2, 3) AND name = 'O''Hara'") == \
+            "SELECT * FROM t WHERE id IN (?, ...) AND name = ?"
+        assert normalize_sql("INSERT INTO t2 VALUES (1, 'a'), (2, 'b')") == \
+            "INSERT INTO t2 VALUES (?, ...), ..."
+
+    def test_report(self, tmp_path):
+        import json
+        from build_profiler import BuildProfiler
+        conn = sqlite3.connect(':memory:')
+        prof = BuildProfiler("demo")
+        prof.attach(conn)
+        prof.phase("1. schema")
+        conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+        prof.phase("2. rows")
+        conn.executemany("INSERT INTO t (name) VALUES (?)", [(f"n{i}",) for i in range(500)])
+        conn.execute("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 50000) "
+                     "SELECT COUNT(*) FROM c").fetchone()
+        json_path, folded_path = prof.write(tmp_path / "demo.db")
+        report = json.loads(json_path.read_text())
+        assert [p["name"] for p in report["phases"]] == ["setup", "1. schema", "2. rows"]
+        rows = report["phases"][2]
+        assert rows["peak_bytes"] > 0
+        calls = {s["sql"]: s["calls"] for s in rows["statements"]}
+        assert calls["INSERT INTO t (name) VALUES (?)"] == 500
+        cte = next(s for s in rows["statements"] if s["sql"].startswith("WITH RECURSIVE"))
+        assert cte["vm_steps"] > 0
+        for line in folded_path.read_text().splitlines():
+            stack, count = line.rsplit(" ", 1)
+            assert stack.startswith("demo;") and int(count) > 0
+        assert BuildProfiler("off", None).write(tmp_path / "off.db") is None
+        conn.close()
+
+
+class TestBenchBuilders:
+    """bench_builders: synthetic TSF sources and the regression check."""
+
+    def test_synthetic_tsf(self, tmp_path):
+        from bench_builders import write_synthetic_sources
+        from build_brachiopoda_db import TSF_DIALECT
+        from tsf_parser import iter_placements, read_source
+        original, revised = write_synthetic_sources(500, seed=3, out_dir=tmp_path)
+        header, lines = read_source(original)
+        assert header["scope"][0]["coverage"] == "comprehensive"
+        placements = list(iter_placements(lines, "Genus", TSF_DIALECT))
+        genera = [p for p in placements if p.rank == "Genus"]
+        assert len(genera) == 500
+        assert {"Class", "Order", "Superfamily", "Family"} <= {p.rank for p in placements}
+        assert {p.status for p in genera} == {"asserted", "questionable", "incertae_sedis"}
+        assert any(p.location and p.temporal_code for p in genera)
+        assert {s["predicate"] for p in genera for s in p.synonyms} == {"SYNONYM_OF", "SPELLING_OF"}
+        # the revision has the same genera, some under another family
+        moved = list(iter_placements(read_source(revised)[1], "Genus", TSF_DIALECT))
+        parents = {p.name: p.parent_name for p in moved if p.rank == "Genus"}
+        assert set(parents) == {p.name for p in genera}
+        assert 0 < sum(parents[p.name] != p.parent_name for p in genera) < 150
+        again = write_synthetic_sources(500, seed=3, out_dir=tmp_path / "again")
+        assert again[0].read_text() == original.read_text()
+
+    def test_regressions(self):
+        from bench_builders import regressions
+        past = [{"builder": "mollusca", "genera": 10000, "seed": 1,
+                 "phases": {"parse": s, "flush": 0.01}} for s in (1.0, 1.1, 0.9)]
+        entry = {"builder": "mollusca", "genera": 10000, "seed": 1,
+                 "phases": {"parse": 1.5, "flush": 0.03, "rollup.closure": 9.0}}
+        assert regressions(entry, past, tolerance=1.25) == [("parse", 1.5, 1.0)]
+        assert regressions(dict(entry, genera=100000), past, tolerance=1.25) == []
+
+
+class TestBenchQueries:
+    """bench_queries: version lookup, parameter sampling and the regression check."""
+
+    def _db(self, path):
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE classification_profile (id INTEGER PRIMARY KEY, name TEXT);
+            INSERT INTO classification_profile VALUES (1, 'a'), (2, 'b');
+            CREATE TABLE taxon (id INTEGER PRIMARY KEY, name TEXT, rank TEXT);
+            INSERT INTO taxon VALUES (10, 'Alphus', 'Genus'), (20, 'Betidae', 'Family');
+            CREATE TABLE classification_edge_cache (profile_id INTEGER, child_id INTEGER,
+                                                    parent_id INTEGER);
+            INSERT INTO classification_edge_cache VALUES (1, 10, 20), (2, 10, 20);
+            CREATE TABLE ui_queries (name TEXT, description TEXT, sql TEXT, params_json TEXT);
+            INSERT INTO ui_queries VALUES ('taxon_children', '',
+                'SELECT t.id FROM classification_edge_cache e JOIN taxon t ON t.id = e.child_id
+                 WHERE e.profile_id = :profile_id AND e.parent_id = :taxon_id', NULL);
+        """)
+        conn.commit()
+        conn.close()
+
+    def test_bench_db(self, tmp_path):
+        from bench_queries import (ParamSampler, bench_db, compare, open_package,
+                                   previous_version, sample_params)
+        from db_path import package_version
+        for version in ("0.1.0", "0.1.2", "0.1.10"):
+            self._db(tmp_path / f"demo-{version}.db")
+        assert package_version(tmp_path / "demo-0.1.10.db") == ("demo", (0, 1, 10))
+        assert package_version(tmp_path / "demo.db") is None
+        assert package_version("dist/demo-0.2.0.scoda") == ("demo", (0, 2, 0))
+        assert previous_version(tmp_path / "demo-0.1.10.db", tmp_path).name == "demo-0.1.2.db"
+        assert previous_version(tmp_path / "demo-0.1.0.db", tmp_path) is None
+        conn = open_package(tmp_path / "demo-0.1.10.db")
+        draw = ParamSampler(conn).plan(conn.execute("SELECT sql FROM ui_queries").fetchone()[0])
+        drawn = [draw() for _ in range(4)]
+        assert [p["profile_id"] for p in drawn] == [1, 2, 1, 2]
+        assert {p["taxon_id"] for p in drawn} == {20}
+        conn.close()
+        plans = sample_params(tmp_path / "demo-0.1.10.db", runs=10)
+        assert len(plans["taxon_children"]) == 11
+        current = bench_db(tmp_path / "demo-0.1.10.db", plans)
+        stats = current["taxon_children"]
+        assert stats["runs"] == 10 and stats["rows"] == 1.0 and stats["error"] is None
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+        # the same parameters replayed on an older DB lacking profile 2's edge
+        conn = sqlite3.connect(tmp_path / "demo-0.1.2.db")
+        conn.execute("DELETE FROM classification_edge_cache WHERE profile_id = 2")
+        conn.commit()
+        conn.close()
+        previous = bench_db(tmp_path / "demo-0.1.2.db", plans)
+        compare(current, previous, max_slowdown=100)
+        assert stats["row_mismatches"] == 5
+
+    def test_compare(self):
+        from bench_queries import compare
+        stat = lambda p95, error=None: {"p95_ms": p95, "error": error}
+        current = {"a": stat(10.0), "b": stat(1.2), "c": stat(None, "no such table"), "d": stat(3.0)}
+        previous = {"a": stat(5.0), "b": stat(1.0), "c": stat(2.0)}
+        assert compare(current, previous, max_slowdown=1.5) == ["a", "c"]
+        assert [current[k]["status"] for k in "abcd"] == ["slower", "ok", "error", "new"]
+        assert compare({"b": stat(1.2)}, None, max_slowdown=1.5, budget_ms=1.0) == ["b"]
+
+
+class TestBenchApi:
+    """bench_api: manifest-driven request plan and the load runners."""
+
+    def test_plan_requests(self, tmp_path):
+        from bench_api import _mixed, plan_requests
+        from bench_queries import open_package
+        TestBenchQueries()._db(tmp_path / "demo-0.1.0.db")
+        conn = sqlite3.connect(tmp_path / "demo-0.1.0.db")
+        conn.execute("""INSERT INTO ui_queries VALUES ('taxon_detail', '',
+            'SELECT * FROM taxon t WHERE t.id = :taxon_id', NULL)""")
+        conn.commit()
+        conn.close()
+        conn = open_package(tmp_path / "demo-0.1.0.db")
+        manifest = {
+            "global_controls": [{"type": "select", "source_query": "taxon_children"}],
+            "views": {
+                "tree": {"type": "hierarchy", "source_query": "taxon_children",
+                         "tree_display": {"item_query": "missing_query"}},
+                "taxon_detail_view": {"type": "detail", "source_query": "taxon_detail",
+                                      "source_param": "taxon_id"},
+            },
+        }
+        plan = plan_requests(conn, manifest, 4)
+        conn.close()
+        assert list(plan) == ["(manifest)", "(global controls)", "tree", "taxon_detail_view"]
+        assert plan["tree"][0] == "/api/queries/taxon_children/execute?profile_id=1&taxon_id=20"
+        assert {url.split("?id=")[1] for url in plan["taxon_detail_view"]} <= {"10", "20"}
+        assert all(url.startswith("/api/composite/taxon_detail_view?id=")
+                   for url in plan["taxon_detail_view"])
+        mixed = _mixed(plan, 6)
+        assert mixed[:4] == [urls[0] for urls in plan.values()] and len(mixed) == 6
+
+    def test_package_scodas(self, tmp_path):
+        from bench_api import package_scodas
+        for name in ("demo-0.1.2.scoda", "demo-0.1.10.scoda", "demo-0.2.0.db", "x.scoda"):
+            (tmp_path / name).touch()
+        assert package_scodas(tmp_path) == {"demo": tmp_path / "demo-0.1.10.scoda"}
+
+    def test_runners(self):
+        from bench_api import run_async, run_threads
+
+        class Response:
+            def __init__(self, path):
+                self.status_code = 404 if path == "/missing" else 200
+
+        class Client:
+            def get(self, path):
+                return Response(path)
+
+        class AsyncClient:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                pass
+
+            async def get(self, path):
+                return Response(path)
+
+        paths = ["/api/manifest"] * 20 + ["/missing"]
+        for stats in (run_threads(Client(), paths, 4), run_async(AsyncClient, paths, 4)):
+            assert stats["requests"] == 21 and stats["errors"] == 1
+            assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+            assert stats["req_s"] > 0
+
+
+class TestTreeEngine:
+    """tree_engine.ProfileTree: array layout and vectorized tree queries."""
+
+    # 1 ─┬─ 2 ─┬─ 4
+    #    │     └─ 5 ── 7
+    #    └─ 3 ── 6        8 (second root)    9 <-> 10 (cycle)
+    PARENTS = {2: 1, 3: 1, 4: 2, 5: 2, 6: 3, 7: 5, 8: None, 9: 10, 10: 9}
+
+    def _tree(self):
+        from tree_engine import ProfileTree
+        return ProfileTree(self.PARENTS)
+
+    def test_arrays(self):
+        tree = self._tree()
+        assert tree.ids.tolist() == [1, 2, 3, 4, 5, 6, 7, 8]
+        assert tree.unrooted.tolist() == [9, 10]
+        assert tree.ids[tree.order].tolist() == [1, 2, 4, 5, 7, 3, 6, 8]
+        assert tree.depth.tolist() == [0, 1, 1, 2, 2, 2, 3, 0]
+        assert tree.subtree_sizes([1, 2, 8]).tolist() == [7, 4, 1]
+        lft, rgt = tree.nested_set()
+        assert list(zip(lft.tolist(), rgt.tolist()))[:3] == [(1, 14), (2, 9), (10, 13)]
+        assert tree.ids[tree.euler].tolist() == [1, 2, 4, 2, 5, 7, 5, 2, 1, 3, 6, 3, 1, 8]
+        assert (tree.euler[tree.first] == range(len(tree))).all()
+        assert 8 in tree and 9 not in tree
+        with pytest.raises(KeyError):
+            tree.nodes([4, 9])
+
+    def test_queries(self):
+        tree = self._tree()
+        taxon, ancestor, distance = tree.ancestors([7, 8])
+        assert sorted(zip(taxon.tolist(), ancestor.tolist(), distance.tolist())) == [
+            (7, 1, 3), (7, 2, 2), (7, 5, 1)]
+        root, desc, distance = tree.descendants([2])
+        assert desc.tolist() == [4, 5, 7] and distance.tolist() == [1, 1, 2]
+        assert tree.with_ancestors([7, 6]).tolist() == [1, 2, 3, 5, 6, 7]
+        assert tree.is_ancestor([2, 2, 1], [7, 6, 1]).tolist() == [True, False, True]
+        assert tree.lca([7, 4, 7, 7], [6, 7, 7, 8]).tolist() == [1, 2, 7, -1]
+        assert tree.distance([7, 4, 7, 7], [6, 7, 7, 8]).tolist() == [5, 3, 0, -1]
+        pair, taxa = tree.path([7, 4, 7], [6, 8, 7])
+        assert pair.tolist() == [0] * 6 + [2]
+        assert taxa.tolist() == [7, 5, 2, 1, 3, 6, 7]
+        genus = (tree.ids >= 4) & (tree.ids <= 7)
+        assert tree.subtree_sum(genus.astype(int))[:3].tolist() == [4, 3, 1]
+        assert tree.subtree_min(tree.ids * 10)[tree.nodes([3, 5])].tolist() == [30, 50]
+
+
+class TestTaxonDistance:
+    """Sparse-table LCA/distance matrices and the ui_query-driven genus sets."""
+
+    PARENTS = TestTreeEngine.PARENTS
+
+    def test_matrices(self):
+        import numpy as np
+        from tree_engine import ProfileTree
+        tree = ProfileTree(self.PARENTS)
+        taxa = [4, 7, 6, 8, 1]
+        a, b = np.repeat(taxa, len(taxa)), np.tile(taxa, len(taxa))
+        lca = tree.lca_matrix(taxa)
+        assert lca.shape == (5, 5)
+        assert lca[0].tolist() == [4, 2, 1, -1, 1]
+        assert (lca.ravel() == tree.lca(a, b)).all()
+        distance = tree.distance_matrix(taxa, [7, 8])
+        assert distance.dtype == np.int32
+        assert distance.tolist() == [[3, -1], [0, -1], [5, -1], [-1, 0], [3, -1]]
+        assert (tree.distance_matrix(taxa).ravel() == tree.distance(a, b)).all()
+        both = tree.lca_distance_matrices(taxa, [7, 8])
+        assert (both[0] == tree.lca_matrix(taxa, [7, 8])).all() and (both[1] == distance).all()
+
+    def test_genus_sets(self):
+        from taxon_distance import genus_distances, query_genera
+        conn = sqlite3.connect(":memory:")
+        conn.executescript(
+            "CREATE TABLE ui_queries (name TEXT, description TEXT, sql TEXT, params_json TEXT);"
+            "CREATE TABLE classification_edge_cache (profile_id INTEGER, child_id INTEGER,"
+            " parent_id INTEGER);")
+        conn.executemany("INSERT INTO classification_edge_cache VALUES (1, ?, ?)",
+                         self.PARENTS.items())
+        conn.execute("INSERT INTO ui_queries VALUES ('under', '', ?, ?)",
+                     ("SELECT child_id AS id FROM classification_edge_cache\n"
+                      "WHERE profile_id = COALESCE(:profile_id, 1) AND child_id >= :min_id\n"
+                      "ORDER BY child_id", '{"min_id": "integer"}'))
+        assert query_genera(conn, "under", {"min_id": "6"}) == [6, 7, 8, 9, 10]
+        with pytest.raises(ValueError):
+            query_genera(conn, "missing")
+        result = genus_distances(conn, [6, 7, 9], [4, 5])
+        assert result["rows"].tolist() == [6, 7] and result["missing"] == [9]
+        assert result["lca"].tolist() == [[1, 1], [2, 5]]
+        assert result["distance"].tolist() == [[4, 4], [3, 1]]